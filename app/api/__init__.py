@@ -5,7 +5,8 @@ __version__ = 0.0.1
 __description__ =
 """
 
+from .admin import router as admin_router
 from .settings import router as settings_router
 from .user import router as user_router
 
-routers = [user_router, settings_router]
+routers = [user_router, settings_router, admin_router]
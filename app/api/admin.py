@@ -0,0 +1,106 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-20
+__version__ = 0.0.1
+__description__ = 运维监控 api
+"""
+
+import secrets
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+
+from app.cache import api_cache_stats, result_cache
+from app.ctx import APIResponse, AppState
+from app.db import async_engine, async_rds_bin_pool, async_rds_pool, pool_status, replica_engines
+from app.monitor import sql_monitor
+from app.schema.admin import (
+    ApiCacheStatSchema,
+    PoolStatSchema,
+    ResultCacheStatSchema,
+    SchemaBuildSchema,
+    SqlPlanSchema,
+    SqlStatSchema,
+)
+from app.settings import settings
+from app.utils.metas import schema_registry_report
+
+
+async def verify_admin_key(request: Request):
+    """运维接口会暴露 SQL 指纹与执行计划, 必须携带配置的访问密钥; 未配置密钥时这些接口不可用"""
+    api_key = settings.admin.api_key
+    if not api_key:
+        raise HTTPException(status_code=404)
+    provided = request.headers.get(settings.admin.key_header, "")
+    if not secrets.compare_digest(provided.encode(), api_key.encode()):
+        raise HTTPException(status_code=403, detail="invalid admin key")
+
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+# 除就绪检查外的运维接口都需要校验访问密钥
+ops_router = APIRouter(dependencies=[Depends(verify_admin_key)])
+
+
+@router.get("/ready")
+async def get_ready():
+    """就绪检查: 连接预热完成前返回 503"""
+    if not AppState.ready:
+        return APIResponse.failed(503, "warming up", status_code=503)
+    return APIResponse.success(data=None)
+
+
+@ops_router.get("/pools", response_model=APIResponse[list[PoolStatSchema]])
+async def get_pool_stats():
+    """数据库与 redis 连接池的实时状态"""
+    stats = [
+        pool_status("primary", async_engine),
+        *(pool_status(f"replica-{i}", engine) for i, engine in enumerate(replica_engines)),
+        async_rds_pool.status("redis"),
+        async_rds_bin_pool.status("redis-bin"),
+    ]
+    return APIResponse.success(data=[PoolStatSchema.model_validate(st) for st in stats])
+
+
+@ops_router.get("/sql/stats", response_model=APIResponse[list[SqlStatSchema]])
+async def get_sql_stats(
+    order_by: Literal["total_ms", "calls", "mean_ms", "p99_ms", "max_ms", "rows"] = "total_ms",
+    limit: int = Query(50, gt=0, le=500),
+):
+    """当前 worker 按 SQL 指纹聚合的执行统计"""
+    stats = sql_monitor.stats.snapshot(order_by=order_by, limit=limit)
+    return APIResponse.success(data=[SqlStatSchema.model_validate(st) for st in stats])
+
+
+@ops_router.post("/sql/stats/reset")
+async def reset_sql_stats():
+    sql_monitor.stats.reset()
+    return APIResponse.success(data=None)
+
+
+@ops_router.get("/sql/plans", response_model=APIResponse[list[SqlPlanSchema]])
+async def get_sql_plans():
+    """当前 worker 最近采集的慢查询执行计划, 最新的在前"""
+    plans = sql_monitor.plans.snapshot()
+    return APIResponse.success(data=[SqlPlanSchema.model_validate(plan) for plan in plans])
+
+
+@ops_router.get("/cache/results", response_model=APIResponse[list[ResultCacheStatSchema]])
+async def get_result_cache_stats():
+    """当前 worker 中 BaseDao 查询结果缓存的命中统计"""
+    stats = result_cache.snapshot()
+    return APIResponse.success(data=[ResultCacheStatSchema.model_validate(st) for st in stats])
+
+
+@ops_router.get("/cache/api", response_model=APIResponse[ApiCacheStatSchema])
+async def get_api_cache_stats():
+    """当前 worker 中接口缓存的命中, 请求合并与返回旧值的统计"""
+    return APIResponse.success(data=ApiCacheStatSchema.model_validate(dict(api_cache_stats)))
+
+
+@ops_router.get("/schemas", response_model=APIResponse[list[SchemaBuildSchema]])
+async def get_schema_report():
+    """create_schema 创建的 schema 及其创建耗时"""
+    return APIResponse.success(data=[SchemaBuildSchema.model_validate(st) for st in schema_registry_report()])
+
+
+router.include_router(ops_router)
@@ -5,18 +5,29 @@ __version__ = 0.0.1
 __description__ = 系统配置 api
 """
 
-from typing import Annotated, List
+from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 
-from app.ctx import APIResponse
+from app.cache import cached
+from app.ctx import T_STREAM_FMT, APIResponse
+from app.dao import STREAM_FETCH_SIZE
+from app.model.settings import TabSettings
 from app.schema.settings import SettingsSchema
 from app.service.settings import SettingsService
 
 router = APIRouter(prefix="/settings", tags=["settings"])
 
 
-@router.get("/", response_model=APIResponse[List[SettingsSchema]])
+@router.get("/", response_model=APIResponse[list[SettingsSchema]])
+@cached(namespace="settings", stale_ttl=60, tables=(TabSettings,))
 async def read_settings(service: Annotated[SettingsService, Depends()]):
     settings = await service.get_all()
     return APIResponse.success(data=settings)
+
+
+@router.get("/export")
+async def export_settings(fmt: T_STREAM_FMT = "ndjson", fetch_size: int = Query(STREAM_FETCH_SIZE, gt=0, le=10000)):
+    """以 NDJSON/CSV 格式流式导出全部数据"""
+    rows = SettingsService.stream_all(fetch_size=fetch_size)
+    return APIResponse.stream(rows, SettingsSchema, fmt=fmt, filename="settings")
@@ -5,24 +5,36 @@ __version__ = 0.0.1
 __description__ = 用户数据API
 """
 
-from typing import Annotated, List
+from typing import Annotated
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 
-from app.ctx import APIResponse
+from app.cache import cached
+from app.ctx import T_STREAM_FMT, APIResponse
+from app.dao import STREAM_FETCH_SIZE
+from app.model.user import TabUser
 from app.schema.user import UserSchema, UserSimple
 from app.service.user import UserService
 
 router = APIRouter(prefix="/user", tags=["user"])
 
 
-@router.get("/", response_model=APIResponse[List[UserSchema]])
+@router.get("/", response_model=APIResponse[list[UserSchema]])
+@cached(namespace="user", tables=(TabUser,))
 async def get_user(service: Annotated[UserService, Depends()]):
     users = await service.get_all()
     return APIResponse.success(data=users)
 
 
-@router.get("/simple", response_model=APIResponse[List[UserSimple]])
+@router.get("/simple", response_model=APIResponse[list[UserSimple]])
+@cached(namespace="user", tables=(TabUser,))
 async def get_simple_user(service: Annotated[UserService, Depends()]):
     users = await service.get_all_simple()
     return APIResponse.success(data=users)
+
+
+@router.get("/export")
+async def export_user(fmt: T_STREAM_FMT = "ndjson", fetch_size: int = Query(STREAM_FETCH_SIZE, gt=0, le=10000)):
+    """以 NDJSON/CSV 格式流式导出全部数据"""
+    rows = UserService.stream_all(fetch_size=fetch_size)
+    return APIResponse.stream(rows, UserSchema, fmt=fmt, filename="user")
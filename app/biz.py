@@ -0,0 +1,88 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-20
+__version__ = 0.0.1
+__description__ = 业务配置快照的加载与热更新
+"""
+
+import asyncio
+from typing import Any
+
+import redis
+from loguru import logger
+from sqlalchemy import select
+
+from app.cache import table_change_listener
+from app.db import TABLE_VERSION_KEY, AsyncSessionLocal, async_redis, redis_breaker
+from app.model.settings import TabSettings
+from app.settings import biz_settings, decode_biz_value, settings
+
+
+class BizSettingsLoader:
+    """
+    业务配置快照的加载与热更新. sys_settings 通过 BaseDao 写入后会递增 redis 中的表版本号,
+    后台任务定时检查版本号, 变化后重新加载并整体替换 biz_settings 的快照
+    """
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self.version_key = TABLE_VERSION_KEY.format(TabSettings.__tablename__)
+        self._task: asyncio.Task | None = None
+
+    async def load(self, version: str | None = None):
+        stmt = select(
+            TabSettings.module, TabSettings.key, TabSettings.value, TabSettings.value_type, TabSettings.value_bundle
+        ).where(TabSettings.activated.is_not(False))
+        # 读主库, 避免版本号变化后从副本读到旧数据
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(stmt)).all()
+
+        values: dict[tuple[str, str], Any] = {}
+        for module, key, value, value_type, value_bundle in rows:
+            try:
+                values[(module, key)] = decode_biz_value(value, value_type, value_bundle)
+            except (ValueError, TypeError) as e:
+                logger.warning(f"业务配置 {module}.{key} 的值无效, 已忽略: {e}")
+        biz_settings.swap(values, version)
+        logger.info(f"...加载业务配置 {len(values)} 项, 版本: {version}")
+
+    async def _current_version(self) -> str | None:
+        if not redis_breaker.available:
+            return biz_settings.version
+        try:
+            return await async_redis.get(self.version_key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"读取业务配置版本号失败: {e}")
+            redis_breaker.record_failure()
+            return biz_settings.version
+
+    async def reload(self, *_):
+        """sys_settings 变化通知到达时立即重新加载"""
+        await self.load(await self._current_version())
+
+    async def refresh(self):
+        version = await self._current_version()
+        if not biz_settings.loaded or version != biz_settings.version:
+            await self.load(version)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"刷新业务配置失败: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+biz_settings_loader = BizSettingsLoader(settings.cache.biz_refresh_interval)
+
+table_change_listener.on_change(TabSettings, biz_settings_loader.reload)
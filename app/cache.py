@@ -0,0 +1,691 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-20
+__version__ = 0.0.1
+__description__ = 缓存相关: 数据库查询结果缓存, fastapi-cache2 的缓存后端与接口缓存装饰器
+"""
+
+import asyncio
+import hashlib
+import inspect
+import sys
+import time as _time
+import uuid
+from collections import Counter, OrderedDict
+from collections.abc import Awaitable, Callable
+from datetime import date, datetime, time
+from decimal import Decimal
+from functools import wraps
+from typing import Any
+
+import asyncpg
+import redis
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends import Backend
+from fastapi_cache.backends.redis import RedisBackend
+from loguru import logger
+from sqlalchemy import Select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.db import (
+    TABLE_CHANNEL,
+    TABLE_VERSION_KEY,
+    async_engine,
+    async_redis,
+    async_redis_bin,
+    bump_table_version,
+    redis_breaker,
+)
+from app.model import BaseTable
+from app.settings import STD_UTF8, settings
+from app.utils.serials import dumps_json, loads_json
+
+# 查询结果缓存的 key
+RESULT_KEY = "dao:result:{}:{}"
+# 接口缓存失效通知的 pub/sub 频道
+INVALIDATE_CHANNEL = "api-cache:invalidate"
+
+_dialect = postgresql.asyncpg.dialect()
+
+# 需要在 json 中以字符串保存, 读取时再还原的类型
+_DECODERS: dict[type, Callable[[str], Any]] = {
+    datetime: datetime.fromisoformat,
+    date: date.fromisoformat,
+    time: time.fromisoformat,
+    Decimal: Decimal,
+}
+
+
+def _column_codecs(table_type: type[BaseTable]) -> list[tuple[str, Callable[[str], Any] | None]]:
+    codecs = []
+    for col in table_type.__table__.columns:
+        try:
+            python_type = col.type.python_type
+        except NotImplementedError:
+            python_type = None
+        codecs.append((col.key, _DECODERS.get(python_type)))
+    return codecs
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime | date | time):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class ResultCache:
+    """
+    BaseDao 的查询结果缓存. key 由编译后的语句和参数生成, 缓存值中带有写入时的表版本号,
+    表版本号在每次写入后递增, 因此写入之后旧的缓存不会再被命中
+    """
+
+    def __init__(self, client: redis.asyncio.Redis):
+        self.client = client
+        # 每张表的命中统计 {table: Counter(hits, misses, skipped, bypassed, errors)}
+        self.stats: dict[str, Counter] = {}
+        # (表, 查询的列) => 每列的名称与解码函数
+        self._codecs: dict[tuple, list[tuple[str, Callable[[str], Any] | None]]] = {}
+
+    @staticmethod
+    def build_key(table_type: type[BaseTable], stmt: Select) -> str:
+        compiled = stmt.compile(dialect=_dialect)
+        raw = f"{compiled}|{sorted(compiled.params.items())!r}"
+        digest = hashlib.blake2b(raw.encode(STD_UTF8), digest_size=16).hexdigest()
+        return RESULT_KEY.format(table_type.__tablename__, digest)
+
+    def _count(self, table_type: type[BaseTable], name: str):
+        self.stats.setdefault(table_type.__tablename__, Counter())[name] += 1
+
+    async def get(
+        self, table_type: type[BaseTable], key: str, columns: tuple[str, ...] | None = None
+    ) -> tuple[list[BaseTable] | list[dict[str, Any]] | None, str]:
+        """
+            读取缓存, 同时返回当前的表版本号(写入缓存时需要带上这个版本号)
+        :param columns: 只查询了部分列时的列名, 此时缓存的数据还原为 dict
+        :return: (缓存的数据, 未命中时为None; 当前表版本号, redis 不可用时为空)
+        """
+        if not redis_breaker.available:
+            self._count(table_type, "bypassed")
+            return None, ""
+        try:
+            version, cached = await self.client.mget(TABLE_VERSION_KEY.format(table_type.__tablename__), key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"读取查询缓存失败: {e}")
+            self._count(table_type, "errors")
+            redis_breaker.record_failure()
+            return None, ""
+
+        version = version or "0"
+        if cached:
+            payload = loads_json(cached)
+            if payload["v"] == version:
+                self._count(table_type, "hits")
+                return self._decode(table_type, payload["rows"], columns), version
+        self._count(table_type, "misses")
+        return None, version
+
+    async def set(
+        self,
+        table_type: type[BaseTable],
+        key: str,
+        version: str,
+        rows: list[BaseTable] | list[dict[str, Any]],
+        ttl: int,
+        max_bytes: int,
+        columns: tuple[str, ...] | None = None,
+    ):
+        if not version:
+            return
+        codecs = self._codecs_of(table_type, columns)
+        if columns is not None:
+            payload_rows = [[_encode_value(row[name]) for name, _ in codecs] for row in rows]
+        else:
+            payload_rows = [[_encode_value(getattr(row, name)) for name, _ in codecs] for row in rows]
+        payload = dumps_json({"v": version, "rows": payload_rows})
+        if len(payload) > max_bytes:
+            self._count(table_type, "skipped")
+            return
+        try:
+            await self.client.set(key, payload, ex=ttl)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"写入查询缓存失败: {e}")
+            self._count(table_type, "errors")
+            redis_breaker.record_failure()
+
+    def _codecs_of(self, table_type: type[BaseTable], columns: tuple[str, ...] | None = None):
+        codecs = self._codecs.get((table_type, columns))
+        if codecs is None:
+            codecs = _column_codecs(table_type)
+            if columns is not None:
+                by_name = dict(codecs)
+                codecs = [(name, by_name[name]) for name in columns]
+            self._codecs[(table_type, columns)] = codecs
+        return codecs
+
+    def _decode(
+        self, table_type: type[BaseTable], rows: list[list[Any]], columns: tuple[str, ...] | None = None
+    ) -> list[BaseTable] | list[dict[str, Any]]:
+        codecs = self._codecs_of(table_type, columns)
+        decoded = (
+            {
+                name: decoder(value) if decoder is not None and value is not None else value
+                for (name, decoder), value in zip(codecs, row, strict=True)
+            }
+            for row in rows
+        )
+        if columns is not None:
+            return list(decoded)
+        return [table_type(**values) for values in decoded]
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "table": table,
+                "hits": c["hits"],
+                "misses": c["misses"],
+                "skipped": c["skipped"],
+                "bypassed": c["bypassed"],
+                "errors": c["errors"],
+            }
+            for table, c in self.stats.items()
+        ]
+
+
+result_cache = ResultCache(async_redis)
+
+
+class BreakerRedisBackend(RedisBackend):
+    """
+    fastapi-cache2 的 redis 后端, redis 熔断时绕过缓存: 读取视为未命中, 写入与清理直接忽略
+    """
+
+    async def get_with_ttl(self, key: str) -> tuple[int, Any]:
+        if not redis_breaker.available:
+            return 0, None
+        try:
+            return await super().get_with_ttl(key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"读取接口缓存失败: {e}")
+            redis_breaker.record_failure()
+            return 0, None
+
+    async def get(self, key: str) -> Any:
+        if not redis_breaker.available:
+            return None
+        try:
+            return await super().get(key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"读取接口缓存失败: {e}")
+            redis_breaker.record_failure()
+            return None
+
+    async def set(self, key: str, value: Any, expire: int | None = None) -> None:
+        if not redis_breaker.available:
+            return
+        try:
+            await super().set(key, value, expire)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"写入接口缓存失败: {e}")
+            redis_breaker.record_failure()
+
+    async def clear(self, namespace: str | None = None, key: str | None = None) -> int:
+        if not redis_breaker.available:
+            return 0
+        try:
+            return await super().clear(namespace, key)
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"清理接口缓存失败: {e}")
+            redis_breaker.record_failure()
+            return 0
+
+
+class LocalLRU:
+    """按字节数限制容量、带过期时间的进程内 LRU 缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # key => (本地过期时间点, redis 中的过期时间点, 值, 字节数)
+        self._data: OrderedDict[str, tuple[float, float, Any, int]] = OrderedDict()
+
+    def get(self, key: str) -> tuple[int, Any] | None:
+        """命中时返回 (redis 中剩余的秒数, 值)"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expire_at, remote_expire_at, value, _ = item
+        now = _time.monotonic()
+        if expire_at <= now:
+            self.drop(key)
+            return None
+        self._data.move_to_end(key)
+        return int(remote_expire_at - now), value
+
+    def set(self, key: str, value: Any, ttl: int, remote_ttl: int):
+        """
+        :param ttl: 本地副本的过期秒数
+        :param remote_ttl: redis 中的剩余秒数, 本地副本不会比它活得更久
+        """
+        size = len(value) if isinstance(value, bytes | str) else sys.getsizeof(value)
+        ttl = min(ttl, remote_ttl)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        self.drop(key)
+        now = _time.monotonic()
+        self._data[key] = (now + ttl, now + remote_ttl, value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, _, _, evicted) = self._data.popitem(last=False)
+            self.size -= evicted
+
+    def drop(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= item[3]
+
+    def drop_prefix(self, prefix: str) -> int:
+        keys = [key for key in self._data if key.startswith(prefix)]
+        for key in keys:
+            self.drop(key)
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+
+class TieredBackend(Backend):
+    """
+    fastapi-cache2 的两级缓存后端: 进程内 LRU 在前, redis 在后.
+    清理缓存时通过 redis pub/sub 通知所有 worker 一起删除本地副本
+    """
+
+    def __init__(self, remote: Backend, client: redis.asyncio.Redis, local_max_bytes: int, local_ttl: int):
+        self.remote = remote
+        self.client = client
+        self.local = LocalLRU(local_max_bytes)
+        self.local_ttl = local_ttl
+        self._task: asyncio.Task | None = None
+
+    async def get_with_ttl(self, key: str) -> tuple[int, Any]:
+        hit = self.local.get(key)
+        if hit is not None:
+            return hit
+        ttl, value = await self.remote.get_with_ttl(key)
+        if value is not None:
+            # ttl 为 -1 表示 redis 中没有过期时间
+            self.local.set(key, value, self.local_ttl, ttl if ttl >= 0 else self.local_ttl)
+        return ttl, value
+
+    async def get(self, key: str) -> Any:
+        _, value = await self.get_with_ttl(key)
+        return value
+
+    async def set(self, key: str, value: Any, expire: int | None = None):
+        self.local.set(key, value, self.local_ttl, expire or self.local_ttl)
+        await self.remote.set(key, value, expire)
+
+    async def clear(self, namespace: str | None = None, key: str | None = None) -> int:
+        count = await self.remote.clear(namespace, key)
+        self._drop_local(namespace, key)
+        try:
+            await self.client.publish(INVALIDATE_CHANNEL, dumps_json({"namespace": namespace, "key": key}))
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"发送缓存失效通知失败: {e}")
+        return count
+
+    async def invalidate(self, namespace: str, remote: bool = True) -> int:
+        """
+        清理当前 worker 中的命名空间, remote 为 True 时同时清理 redis.
+        不发送 pub/sub 通知(由调用方保证每个 worker 都会调用)
+        """
+        count = await self.remote.clear(namespace) if remote else 0
+        self._drop_local(namespace, None)
+        return count
+
+    def _drop_local(self, namespace: str | None, key: str | None):
+        if namespace:
+            self.local.drop_prefix(f"{namespace}:")
+        elif key:
+            self.local.drop(key)
+        else:
+            self.local.clear()
+
+    async def _listen(self):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                while True:
+                    # 使用带超时的轮询, 避免阻塞读取触发连接池的 socket_timeout
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None:
+                        continue
+                    payload = loads_json(message["data"])
+                    self._drop_local(payload.get("namespace"), payload.get("key"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 订阅断开期间可能错过失效通知, 重连前清空本地副本
+                logger.warning(f"缓存失效通知订阅中断: {e}")
+                self.local.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+api_cache_backend = TieredBackend(
+    BreakerRedisBackend(async_redis_bin),
+    async_redis,
+    local_max_bytes=settings.cache.local_max_bytes,
+    local_ttl=settings.cache.local_ttl,
+)
+
+
+# ===============接口缓存装饰器==============
+# 表名 => 依赖该表数据的接口缓存命名空间
+TABLE_NAMESPACES: dict[str, set[str]] = {}
+# 接口缓存的命中统计
+api_cache_stats: Counter = Counter()
+# 当前 worker 中正在重新计算的缓存 key => 计算结果编码后的字节
+_inflight: dict[str, asyncio.Future] = {}
+# 注入到被装饰函数签名中的 request 参数名
+_REQUEST_PARAM = "_cached_request"
+# 只删除自己持有的锁
+_UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+# 表示结果来自缓存(而不是本次计算)的标记
+_FROM_CACHE = object()
+
+
+class _ComputeAbandoned(Exception):
+    """负责计算的请求被取消, 等待中的请求需要重新竞争计算"""
+
+
+def cached(
+    namespace: str = "",
+    expire: int | None = None,
+    stale_ttl: int | None = None,
+    lock_ms: int = 5000,
+    tables: tuple[type[BaseTable], ...] = (),
+):
+    """
+        接口缓存装饰器, 用法与 fastapi_cache.decorator.cache 相同, 额外提供:
+        1. 同一个 key 的并发未命中只重新计算一次: worker 内通过 future 合并, worker 之间通过 redis 短锁合并
+        2. stale_ttl > 0 时, 数据过期后的 stale_ttl 秒内仍可返回旧值: 由一个请求负责重新计算, 其余请求直接返回旧值
+    :param namespace: 缓存命名空间
+    :param expire: 过期时间(秒), 默认使用 CacheConfig.expire
+    :param stale_ttl: 过期后还可以返回旧值的时间(秒), 默认使用 CacheConfig.stale_ttl
+    :param lock_ms: 跨 worker 重新计算锁的超时时间(毫秒)
+    :param tables: 接口数据来源的表, 这些表的数据变化后清理整个命名空间
+    :return:
+    """
+    for table_type in tables:
+        TABLE_NAMESPACES.setdefault(table_type.__tablename__, set()).add(namespace)
+
+    def wrapper(func: Callable[..., Awaitable[Any]]):
+        signature = inspect.signature(func)
+        request_param = next((p for p in signature.parameters.values() if p.annotation is Request), None)
+        inject_request = request_param is None
+        if inject_request:
+            # 让 fastapi 注入 request, 用于生成缓存 key
+            request_param = inspect.Parameter(_REQUEST_PARAM, inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+            signature = signature.replace(parameters=[*signature.parameters.values(), request_param])
+
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            if inject_request:
+                request: Request | None = kwargs.pop(_REQUEST_PARAM, None)
+            else:
+                request = kwargs.get(request_param.name)
+            if request is not None and (
+                request.method != "GET" or request.headers.get("Cache-Control") in ("no-store", "no-cache")
+            ):
+                return await func(*args, **kwargs)
+
+            backend = FastAPICache.get_backend()
+            coder = FastAPICache.get_coder()
+            fresh_ttl = expire or FastAPICache.get_expire()
+            keep_stale = settings.cache.stale_ttl if stale_ttl is None else stale_ttl
+            key = FastAPICache.get_key_builder()(
+                func,
+                f"{FastAPICache.get_prefix()}:{namespace}",
+                request=request,
+                response=None,
+                args=args,
+                kwargs=kwargs,
+            )
+            if inspect.isawaitable(key):
+                key = await key
+
+            ttl, value = await backend.get_with_ttl(key)
+            if value is not None:
+                # 缓存的保存时间为 fresh_ttl + keep_stale, 剩余时间不超过 keep_stale 时说明数据已过期
+                if ttl < 0 or ttl > keep_stale:
+                    api_cache_stats["hits"] += 1
+                    return coder.decode(value)
+                if key in _inflight:
+                    api_cache_stats["stale_served"] += 1
+                    return coder.decode(value)
+            else:
+                api_cache_stats["misses"] += 1
+
+            while (fut := _inflight.get(key)) is not None:
+                api_cache_stats["coalesced"] += 1
+                try:
+                    encoded = await asyncio.shield(fut)
+                except _ComputeAbandoned:
+                    # 负责计算的请求被取消(例如客户端断开), 由等待中的请求接手计算
+                    continue
+                # 每个请求解码出自己的响应对象: 框架与中间件会修改响应(响应头、cookie、后台任务), 不能共用
+                return coder.decode(encoded)
+
+            async def compute() -> tuple[Any, Any]:
+                api_cache_stats["refreshes"] += 1
+                result = await func(*args, **kwargs)
+                encoded = coder.encode(result)
+                # 失败的响应不缓存
+                if not isinstance(result, Response) or result.status_code == 200:
+                    await backend.set(key, encoded, fresh_ttl + keep_stale)
+                return result, encoded
+
+            fut = _inflight[key] = asyncio.get_running_loop().create_future()
+            try:
+                outcome = await _compute_across_workers(key, compute, backend, lock_ms, stale=value)
+                fut.set_result(outcome[1])
+            except Exception as e:
+                fut.set_exception(e)
+                # 没有其他请求等待时避免 "exception was never retrieved" 的警告
+                fut.exception()
+                raise
+            except BaseException:
+                # 取消只影响当前请求, 不能传递给等待中的请求
+                fut.set_exception(_ComputeAbandoned())
+                fut.exception()
+                raise
+            finally:
+                _inflight.pop(key, None)
+
+            result, encoded = outcome
+            return coder.decode(encoded) if result is _FROM_CACHE else result
+
+        inner.__signature__ = signature
+        return inner
+
+    return wrapper
+
+
+async def _compute_across_workers(
+    key: str, compute: Callable[[], Awaitable[tuple[Any, Any]]], backend: Backend, lock_ms: int, stale: Any
+) -> tuple[Any, Any]:
+    """
+    通过 redis 锁保证多个 worker 中只有一个重新计算. 没有拿到锁时: 有旧值直接返回旧值,
+    否则等待持锁的 worker 写入缓存, 超时后自己计算
+    """
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    if await _try_lock(lock_key, token, lock_ms):
+        try:
+            return await compute()
+        finally:
+            await _unlock(lock_key, token)
+
+    if stale is not None:
+        api_cache_stats["stale_served"] += 1
+        return _FROM_CACHE, stale
+
+    api_cache_stats["coalesced_remote"] += 1
+    deadline = _time.monotonic() + lock_ms / 1000
+    while _time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        _, value = await backend.get_with_ttl(key)
+        if value is not None:
+            return _FROM_CACHE, value
+    return await compute()
+
+
+async def _try_lock(lock_key: str, token: str, lock_ms: int) -> bool:
+    """redis 不可用时视为拿到锁, 由当前 worker 自己计算"""
+    if not redis_breaker.available:
+        return True
+    try:
+        return bool(await async_redis.set(lock_key, token, nx=True, px=lock_ms))
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"获取缓存重建锁失败: {e}")
+        redis_breaker.record_failure()
+        return True
+
+
+async def _unlock(lock_key: str, token: str):
+    if not redis_breaker.available:
+        return
+    try:
+        await async_redis.eval(_UNLOCK_SCRIPT, 1, lock_key, token)
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"释放缓存重建锁失败: {e}")
+
+
+# ===============表数据变化监听==============
+# 同一次表变化只由一个 worker 清理 redis, 锁自然过期即可(毫秒)
+INVALIDATE_LOCK_MS = 60_000
+
+
+class TableChangeListener:
+    """
+    在独立的 asyncpg 连接上 LISTEN 各表的变化通知(由 DAO 写入或触发器发出),
+    收到通知后清理依赖该表的接口缓存命名空间, 并调用注册的进程内回调
+    """
+
+    def __init__(self, engine: AsyncEngine, backend: TieredBackend, reconnect_interval: float = 1):
+        self.engine = engine
+        self.backend = backend
+        self.reconnect_interval = reconnect_interval
+        self._handlers: dict[str, list[Callable[[str], Awaitable[Any]]]] = {}
+        # 已收到通知但还未开始处理的表, 同一张表的连续通知只处理一次
+        self._pending: set[str] = set()
+        self._tasks: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    def on_change(self, table_type: type[BaseTable], handler: Callable[[str], Awaitable[Any]]):
+        """注册表数据变化后的进程内回调, 回调参数为表名"""
+        self._handlers.setdefault(table_type.__tablename__, []).append(handler)
+
+    @staticmethod
+    def _table_types() -> dict[str, type[BaseTable]]:
+        return {mapper.class_.__tablename__: mapper.class_ for mapper in BaseTable.registry.mappers}
+
+    def _table_names(self) -> list[str]:
+        return list(self._table_types())
+
+    def _on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        table_name, _, change_id = payload.partition(":")
+        if table_name in self._pending:
+            return
+        self._pending.add(table_name)
+        task = asyncio.create_task(self._invalidate(table_name, change_id or None))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _invalidate(self, table_name: str, change_id: str | None = None):
+        """
+        每个 worker 都清理自己的进程内缓存. 清理 redis 需要扫描整个 keyspace,
+        同一次变化(相同的事务ID)的 redis 清理与表版本号递增只由抢到锁的 worker 执行; 没有事务ID时各自执行.
+        其它 worker 在 redis 清理完成前可能把旧值重新读入本地副本, 因此抢到锁的 worker 清理 redis 后
+        再通过 pub/sub 通知所有 worker 删除本地副本
+        """
+        self._pending.discard(table_name)
+        prefix = FastAPICache.get_prefix()
+        if change_id is None:
+            owner = True
+        else:
+            owner = await _try_lock(f"{prefix}:invalidate:{table_name}:{change_id}", "1", INVALIDATE_LOCK_MS)
+        # 触发器或其它进程的写入不经过 BaseDao, 同样需要递增表版本号, 使查询结果缓存失效
+        table_type = self._table_types().get(table_name)
+        if owner and table_type is not None:
+            await bump_table_version(table_type)
+        for namespace in TABLE_NAMESPACES.get(table_name, ()):
+            if owner:
+                await self.backend.clear(f"{prefix}:{namespace}")
+            else:
+                await self.backend.invalidate(f"{prefix}:{namespace}", remote=False)
+        for handler in self._handlers.get(table_name, ()):
+            try:
+                await handler(table_name)
+            except Exception as e:
+                logger.warning(f"处理表 {table_name} 的变化通知失败: {e}")
+
+    async def _connect(self) -> asyncpg.Connection:
+        dsn = self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        return await asyncpg.connect(dsn)
+
+    async def _run(self):
+        reconnect = False
+        while True:
+            conn = None
+            lost = asyncio.Event()
+            try:
+                conn = await self._connect()
+                conn.add_termination_listener(lambda _, lost=lost: lost.set())
+                for table_name in self._table_names():
+                    await conn.add_listener(TABLE_CHANNEL.format(table_name), self._on_notify)
+                if reconnect:
+                    # 断开期间可能错过通知, 重连后全部清理一次
+                    logger.info("表变化监听已重连, 清理全部依赖表的缓存")
+                    await asyncio.gather(*(self._invalidate(name) for name in self._table_names()))
+                reconnect = True
+                await lost.wait()
+                logger.warning("表变化监听连接断开")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"表变化监听失败: {e}")
+                reconnect = True
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close(timeout=1)
+            await asyncio.sleep(self.reconnect_interval)
+
+    def start(self):
+        if self._task is None and self.engine.dialect.name == "postgresql":
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+table_change_listener = TableChangeListener(async_engine, api_cache_backend)
@@ -5,46 +5,129 @@ __version__ = 0.0.1
 __description__ = app context manager
 """
 
+import asyncio
 import sys
-from typing import Generic
+import time
+from collections.abc import AsyncIterator
+from typing import Any, Generic, Literal
 
 from fastapi import FastAPI
 from loguru import logger
 from pydantic import BaseModel
-from starlette.responses import JSONResponse
+from pydantic_core import to_json
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import configure_mappers
+from starlette.responses import Response, StreamingResponse
 from typing_extensions import TypeVar
 
-from .db import async_engine
-from .model import BaseTable
+from .biz import biz_settings_loader
+from .cache import api_cache_backend, table_change_listener
+from .db import (
+    async_engine,
+    drop_stale_staging_tables,
+    redis_breaker,
+    replica_engines,
+    replica_router,
+    warmup_db_pool,
+    warmup_redis_pool,
+)
+from .model import BaseTable, TableRecord, table_meta
 from .settings import settings
+from .utils.serials import aiter_csv, aiter_json_envelope, aiter_ndjson, custom_serializer
 from .utils.times import FMT_DATE, dt_to_str
 
 T_TABLE = TypeVar("T_TABLE", bound=BaseTable)
 T_SCHEMA = TypeVar("T_SCHEMA", bound=BaseModel)
 
 T_RESP_BODY = T_SCHEMA | list[T_SCHEMA] | None
+T_STREAM_FMT = Literal["ndjson", "csv", "json"]
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json",
+}
+
+
+class EnvelopeResponse(Response):
+    """
+    直接把响应内容序列化为字节的 json 响应: 通过 pydantic-core 一次性输出 schema,
+    不经过 model_dump 生成中间的 dict, 也不再经过标准库 json 二次序列化. 已经是 bytes 的内容原样输出.
+    数据库模型与只读记录按 schema 的格式输出: 小驼峰的 key, 日期时间与数值使用相同的序列化函数
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return to_json(content, by_alias=True, fallback=_to_dict_fallback)
+
+
+def _to_dict_fallback(obj: Any) -> Any:
+    if isinstance(obj, BaseTable | TableRecord):
+        table_type = obj.__table_type__ if isinstance(obj, TableRecord) else type(obj)
+        data = obj.to_dict(aliases=table_meta(table_type).column_to_camel)
+        return {key: custom_serializer(value) for key, value in data.items()}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
 class APIResponse(BaseModel, Generic[T_SCHEMA]):
+    """
+    统一的响应结构 {code, msg, data}. 路由中声明的 response_model 只用于生成文档:
+    success/failed 直接返回 Response 对象, fastapi 不会再按 response_model 校验和序列化
+    """
+
     code: int = 0
     msg: str = "ok"
     data: T_RESP_BODY = None
 
     @classmethod
-    def success(cls, data: T_RESP_BODY) -> JSONResponse:
-        content = APIResponse(data=data).model_dump(by_alias=True)
-        return JSONResponse(content=content, status_code=200)
+    def success(cls, data: T_RESP_BODY) -> EnvelopeResponse:
+        return EnvelopeResponse(content={"code": 0, "msg": "ok", "data": data}, status_code=200)
+
+    @classmethod
+    def stream(
+        cls,
+        rows: AsyncIterator[T_SCHEMA],
+        schema: type[T_SCHEMA],
+        fmt: T_STREAM_FMT = "ndjson",
+        filename: str | None = None,
+    ) -> StreamingResponse:
+        """
+            以流的形式逐块输出数据, 不在内存中构建完整的响应体
+        :param rows: 异步迭代的 schema 实例
+        :param schema: schema 类型, 用于生成 CSV 表头
+        :param fmt: 输出格式 ndjson/csv/json, json 为 {code, msg, data: [...]} 结构
+        :param filename: 下载的文件名(不含后缀), 为空时不设置 Content-Disposition
+        :return:
+        """
+        if fmt == "csv":
+            body = aiter_csv(rows, schema)
+        elif fmt == "json":
+            body = aiter_json_envelope(rows)
+        else:
+            body = aiter_ndjson(rows)
+        headers = {"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'} if filename else None
+        return StreamingResponse(body, media_type=STREAM_MEDIA_TYPES[fmt], headers=headers)
 
     @classmethod
-    def failed(cls, code: int, msg: str) -> JSONResponse:
-        content = APIResponse(code=code, msg=msg).model_dump_json()
-        return JSONResponse(content=content, status_code=200)
+    def failed(cls, code: int, msg: str, status_code: int = 200) -> EnvelopeResponse:
+        return EnvelopeResponse(content={"code": code, "msg": msg, "data": None}, status_code=status_code)
+
+
+class AppState:
+    """应用运行状态, 连接预热完成后才算就绪"""
+
+    ready: bool = False
 
 
 async def __init_tables():
     logger.info("...初始化数据库表")
     async with async_engine.begin() as conn:
         await conn.run_sync(BaseTable.metadata.create_all)
+    # 完成映射配置, 同时注册每张表的元数据
+    configure_mappers()
 
 
 def configure_logging():
@@ -75,7 +158,54 @@ def configure_logging():
     )
 
 
+async def __warmup_replica(engine: AsyncEngine):
+    try:
+        async with asyncio.timeout(settings.database.replica_check_interval):
+            await warmup_db_pool(engine, settings.database.warmup_size)
+    except Exception as e:
+        logger.warning(f"只读副本预热失败: {engine.url!r} => {e}")
+        replica_router.mark_down(engine)
+
+
+async def __warmup():
+    logger.info("...预热数据库与redis连接")
+    start = time.perf_counter()
+    # 主库预热失败直接中止启动; 只读副本失败只移出轮询, 由后台健康检查恢复
+    await asyncio.gather(
+        warmup_db_pool(async_engine, settings.database.warmup_size),
+        *(__warmup_replica(engine) for engine in replica_engines),
+        warmup_redis_pool(settings.redis.warmup_size),
+    )
+    logger.info(f"...连接预热完成, 耗时 {time.perf_counter() - start:.2f}S")
+
+
+async def __drop_stale_staging():
+    # 清理进程异常退出后遗留的并发写入中转表, 失败不影响启动
+    try:
+        dropped = await drop_stale_staging_tables(async_engine)
+    except Exception as e:
+        logger.warning(f"清理遗留中转表失败: {e}")
+        return
+    if dropped:
+        logger.info(f"...清理遗留中转表 {len(dropped)} 张: {', '.join(dropped)}")
+
+
 async def app_life_span(app: FastAPI):
     await __init_tables()
+    await __warmup()
+    await __drop_stale_staging()
+    await biz_settings_loader.refresh()
+    AppState.ready = True
+    replica_router.start()
+    redis_breaker.start()
+    api_cache_backend.start()
+    biz_settings_loader.start()
+    table_change_listener.start()
     yield
+    AppState.ready = False
+    await table_change_listener.stop()
+    await biz_settings_loader.stop()
+    await api_cache_backend.stop()
+    await redis_breaker.stop()
+    await replica_router.stop()
     print("===done===")
@@ -5,31 +5,246 @@ __version__ = 0.0.1
 __description__ =
 """
 
-from typing import Any, Generic, List, Sequence, Type
+from collections.abc import AsyncIterator, Awaitable, Callable, Sequence
+from functools import lru_cache
+from typing import Any, Generic, TypeVar
 
-from sqlalchemy import select
+from pydantic import BaseModel
+from sqlalchemy import Select, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
 
-from app.ctx import T_TABLE
-from app.db import pg_upsert
+from app.cache import result_cache
+from app.ctx import T_SCHEMA, T_TABLE
+from app.db import (
+    bump_table_version,
+    is_read_sticky,
+    is_replica_failure,
+    mark_write,
+    notify_table_change,
+    pg_upsert,
+    replica_router,
+)
+from app.model import TableRecord, record_class, table_meta
+from app.utils.metas import schemas_to_dicts
+from app.utils.serials import build_schema
+
+# 流式读取时每次从服务端游标拉取的行数
+STREAM_FETCH_SIZE = 1000
+
+T_RESULT = TypeVar("T_RESULT")
+T_COLUMNS = Sequence[str | InstrumentedAttribute]
+
+
+@lru_cache(maxsize=256)
+def schema_columns(table: type[T_TABLE], schema: type[BaseModel]) -> tuple[str, ...]:
+    """schema 中与表的列同名的字段, 即按 schema 投影查询时需要的列"""
+    table_columns = table_meta(table).attr_keys
+    names = tuple(name for name in schema.model_fields if name in table_columns)
+    if not names:
+        raise ValueError(f"Schema {schema.__name__} has no columns of table {table.__tablename__}")
+    return names
+
+
+def _projection(
+    table: type[T_TABLE], schema: type[BaseModel] | None, columns: T_COLUMNS | None
+) -> tuple[str, ...] | None:
+    if columns is not None:
+        return tuple(col.key if isinstance(col, InstrumentedAttribute) else col for col in columns)
+    if schema is not None:
+        return schema_columns(table, schema)
+    return None
 
 
 class BaseDao(Generic[T_TABLE]):
-    def __init__(self, table: Type[T_TABLE], db: AsyncSession):
+    # 查询结果缓存的过期时间(秒), 为空时不缓存. 子类按表的更新频率设置
+    cache_ttl: int | None = None
+    # 单个查询结果缓存的最大字节数, 超过时不缓存
+    cache_max_bytes: int = 1024 * 1024
+
+    def __init__(self, table: type[T_TABLE], db: AsyncSession, read_db: AsyncSession | None = None):
+        """
+        Args:
+            table: 数据库模型
+            db: 主库 session, 所有写操作都使用它
+            read_db: 只读副本 session, 读方法优先使用它. 为空时读写都使用主库
+        """
         self.table = table
         self.db = db
+        self.read_db = read_db
+
+    @property
+    def reader(self) -> AsyncSession:
+        """读方法使用的 session. 当前请求写入后的粘滞窗口内始终读主库, 保证读到自己的写入"""
+        if self.read_db is None or is_read_sticky():
+            return self.db
+        return self.read_db
+
+    async def _read(self, query: Callable[[AsyncSession], Awaitable[T_RESULT]]) -> T_RESULT:
+        """在只读副本上执行查询, 副本连接失败时将其移出轮询并改用主库重试"""
+        session = self.reader
+        if session is self.db:
+            return await query(session)
+        try:
+            return await query(session)
+        except Exception as e:
+            if not is_replica_failure(e):
+                raise
+            replica_router.mark_down(session.bind)
+            await session.rollback()
+            return await query(self.db)
+
+    async def _cached_read(
+        self, stmt: Select, query: Callable[[AsyncSession], Awaitable[list]], columns: tuple[str, ...] | None = None
+    ) -> list:
+        """
+        开启了结果缓存时先查缓存, 未命中再查询数据库并写入缓存.
+        写入缓存的数据从主库读取: 副本可能存在延迟, 读到的旧数据会以当前的表版本号缓存到过期为止
+        """
+        if self.cache_ttl is None:
+            return await self._read(query)
+
+        key = result_cache.build_key(self.table, stmt)
+        rows, version = await result_cache.get(self.table, key, columns)
+        if rows is None:
+            rows = await query(self.db)
+            await result_cache.set(
+                self.table, key, version, rows, ttl=self.cache_ttl, max_bytes=self.cache_max_bytes, columns=columns
+            )
+        return rows
+
+    async def _projected_read(
+        self, names: tuple[str, ...], schema: type[T_SCHEMA] | None, where: Callable[[Select], Select] | None = None
+    ) -> list[T_SCHEMA] | list[dict[str, Any]]:
+        """
+        只查询指定的列: 不创建 ORM 实例, 也不进入 session 的 identity map.
+        指定了 schema 时直接用查询结果构建 schema(数据来自数据库, 跳过校验), 否则返回 dict
+        """
+        stmt = select(*(getattr(self.table, name) for name in names))
+        if where is not None:
+            stmt = where(stmt)
+
+        async def query(session: AsyncSession):
+            result = await session.execute(stmt)
+            return [dict(row) for row in result.mappings().all()]
+
+        rows = await self._cached_read(stmt, query, columns=names)
+        if schema is None:
+            return rows
+        build_schema(schema)
+        return [schema.model_construct(**row) for row in rows]
+
+    async def get_all(
+        self, schema: type[T_SCHEMA] | None = None, columns: T_COLUMNS | None = None
+    ) -> Sequence[T_TABLE] | list[T_SCHEMA] | list[dict[str, Any]]:
+        """
+        查询全表
+        Args:
+            schema: 目标 schema, 只查询 schema 需要的列并直接返回 schema 实例
+            columns: 只查询指定的列, 返回 dict(同时指定 schema 时按 columns 查询)
+
+        Returns: 默认返回数据对象
+        """
+        names = _projection(self.table, schema, columns)
+        if names is not None:
+            return await self._projected_read(names, schema)
+
+        stmt = select(self.table)
+
+        async def query(session: AsyncSession):
+            result = await session.scalars(stmt)
+            return list(result.all())
+
+        return await self._cached_read(stmt, query)
+
+    async def stream(self, stmt: Select | None = None, fetch_size: int = STREAM_FETCH_SIZE) -> AsyncIterator[T_TABLE]:
+        """
+        基于服务端游标分批读取数据, 内存占用不随数据量增长
+        Args:
+            stmt: 查询语句, 默认查询全表
+            fetch_size: 每批从游标中拉取的行数
+
+        Returns: 逐个返回的数据对象
+        """
+        stmt = (select(self.table) if stmt is None else stmt).execution_options(yield_per=fetch_size)
+        # 与其它读方法一样优先使用只读副本, 建立游标失败时回落到主库
+        result = await self._read(lambda session: session.stream_scalars(stmt))
+        async for obj in result:
+            yield obj
+
+    async def get_all_records(self, columns: T_COLUMNS | None = None) -> list[TableRecord]:
+        """
+        只读查询全表: 通过 Core select 返回精简记录, 不创建 ORM 实例, 也不进入 session.
+        适合只读取不修改的列表接口
+        Args:
+            columns: 只查询指定的列, 默认查询全部列
+
+        Returns: 只读记录
+        """
+        names = _projection(self.table, None, columns) or table_meta(self.table).attr_keys
+        record_cls = record_class(self.table, names)
+        stmt = select(*(getattr(self.table, name) for name in names))
+
+        async def query(session: AsyncSession):
+            result = await session.execute(stmt)
+            return [record_cls.from_row(row) for row in result.all()]
+
+        rows = await self._cached_read(stmt, query, columns=names)
+        if rows and isinstance(rows[0], dict):
+            # 从结果缓存中读取的是 dict
+            rows = [record_cls.from_row(tuple(row.values())) for row in rows]
+        return rows
+
+    async def stream_records(
+        self, columns: T_COLUMNS | None = None, fetch_size: int = STREAM_FETCH_SIZE
+    ) -> AsyncIterator[TableRecord]:
+        """
+        基于服务端游标分批读取只读记录, 内存占用不随数据量增长
+        Args:
+            columns: 只查询指定的列, 默认查询全部列
+            fetch_size: 每批从游标中拉取的行数
+
+        Returns: 逐个返回的只读记录
+        """
+        names = _projection(self.table, None, columns) or table_meta(self.table).attr_keys
+        record_cls = record_class(self.table, names)
+        stmt = select(*(getattr(self.table, name) for name in names)).execution_options(yield_per=fetch_size)
+        result = await self._read(lambda session: session.stream(stmt))
+        async for row in result:
+            yield record_cls.from_row(row)
+
+    async def get_by_id(
+        self, model_id: int, schema: type[T_SCHEMA] | None = None, columns: T_COLUMNS | None = None
+    ) -> T_TABLE | T_SCHEMA | dict[str, Any] | None:
+        """
+        按 id 查询
+        Args:
+            model_id: 数据 id
+            schema: 目标 schema, 只查询 schema 需要的列并直接返回 schema 实例
+            columns: 只查询指定的列, 返回 dict
+
+        Returns: 默认返回数据对象, 不存在时返回 None
+        """
+        names = _projection(self.table, schema, columns)
+        if names is not None:
+            rows = await self._projected_read(names, schema, where=lambda stmt: stmt.where(self.table.id == model_id))
+            return rows[0] if rows else None
+
+        stmt = select(self.table).where(self.table.id == model_id)
 
-    async def get_all(self) -> Sequence[T_TABLE]:
-        result = await self.db.scalars(select(self.table))
-        return result.all()
+        async def query(session: AsyncSession):
+            result = await session.execute(stmt)
+            return list(result.scalars().all())
 
-    async def get_by_id(self, model_id: int) -> T_TABLE:
-        result = await self.db.execute(select(self.table).where(self.table.id == model_id))
-        return result.scalar_one_or_none()
+        rows = await self._cached_read(stmt, query)
+        return rows[0] if rows else None
 
     async def create(self, obj_in: T_TABLE) -> T_TABLE:
         self.db.add(obj_in)
+        await notify_table_change(self.db, self.table)
         await self.db.commit()
+        mark_write()
+        await bump_table_version(self.table)
         await self.db.refresh(obj_in)
         return obj_in
 
@@ -43,21 +258,49 @@ class BaseDao(Generic[T_TABLE]):
         Returns:　更新后的对象
         """
         assert obj_in.id, f"The data to be updated [{obj_in}] does not have an id and cannot be updated!"
+        if obj_in not in self.db:
+            # 数据可能是从只读副本读取的, 需要先合并到主库的 session 中
+            obj_in = await self.db.merge(obj_in)
         True and [setattr(obj_in, k, v) for k, v in new_values if hasattr(obj_in, k)]
+        await notify_table_change(self.db, self.table)
         await self.db.commit()
+        mark_write()
+        await bump_table_version(self.table)
         await self.db.refresh(obj_in)
         return obj_in
 
-    async def save_or_update(self, obj_ins: List[T_TABLE], ignore_cols: set[str]) -> List[int]:
+    async def save_or_update(
+        self,
+        obj_ins: list[T_TABLE] | list[BaseModel],
+        ignore_cols: set[str],
+        use_copy: bool = False,
+        concurrency: int = 1,
+    ) -> list[int]:
         """
         保存或更新多个对象
         Args:
-            obj_ins: 待更新的数据集
+            obj_ins: 待更新的数据集, 也可以是 schema 列表(通过预编译的转换计划批量转换为行数据,
+                未设置的字段不写入, 冲突时也只更新写入的列)
             ignore_cols: 需要忽略更新的字段
+            use_copy: 是否使用 COPY 批量导入模式(适合大批量数据)
+            concurrency: 并发写入使用的连接数, 大于1时各批次分散到多个连接上执行
 
         Returns:
             更新后的数据ID 合集
         """
         pks = self.table.get_biz_primary_keys()
         assert pks and any(pks), "Table {T_TABLE} has no biz primary keys!"
-        return await pg_upsert(self.db, self.table, obj_ins, conflict_columns=pks, ignore_columns=ignore_cols)
+        from_schemas = bool(obj_ins) and isinstance(obj_ins[0], BaseModel)
+        if from_schemas:
+            obj_ins = schemas_to_dicts(obj_ins, self.table)
+        mark_write()
+        return await pg_upsert(
+            self.db,
+            self.table,
+            obj_ins,
+            conflict_columns=pks,
+            ignore_columns=ignore_cols,
+            use_copy=use_copy,
+            concurrency=concurrency,
+            update_written_only=from_schemas,
+        )
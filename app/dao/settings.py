@@ -11,12 +11,15 @@ from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.dao import BaseDao
-from app.db import use_db
+from app.db import use_db, use_read_db
 from app.model.settings import TabSettings
 
 
 class SettingsDao(BaseDao[TabSettings]):
+    cache_ttl = 600
+
     DB_SESSION = Annotated[AsyncSession, Depends(use_db)]
+    READ_SESSION = Annotated[AsyncSession, Depends(use_read_db)]
 
-    def __init__(self, db: DB_SESSION):
-        super().__init__(table=TabSettings, db=db)
+    def __init__(self, db: DB_SESSION, read_db: READ_SESSION):
+        super().__init__(table=TabSettings, db=db, read_db=read_db)
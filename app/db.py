@@ -5,19 +5,34 @@ __version__ = 0.0.1
 __description__ = 数据库及redis连接相关配置
 """
 
+import asyncio
+import itertools
+import re
+import time
+import uuid
+from collections.abc import Iterable
 from contextlib import asynccontextmanager
-from typing import Any
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Annotated, Any
 
 import redis
+from fastapi import Depends
 from loguru import logger
 from redis.asyncio import ConnectionPool, Redis
-from sqlalchemy import Engine, event
+from sqlalchemy import JSON, Column, Engine, Select, Table, TextClause, and_, case, event, exc, func, or_, select, text
+from sqlalchemy import column as sa_column
+from sqlalchemy import table as sa_table
+from sqlalchemy.dialects.postgresql import Insert
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from app.model import BaseTable
+from app.model import BaseTable, table_meta
+from app.monitor import PoolStats, sql_monitor
 from app.settings import settings
 from app.utils.iterators import filter_dict_keys
 from app.utils.serials import dumps_json
@@ -27,16 +42,43 @@ REDIS_POOL_SIZE = settings.redis.pool_size
 
 # =============================== DATABASE ===============================
 ASYNC_DATABASE_URL = settings.database.build_url()
-async_engine = create_async_engine(
-    ASYNC_DATABASE_URL,
-    pool_size=DB_POOL_SIZE,
-    max_overflow=20,
-    pool_timeout=30,
-    pool_recycle=1800,
-    pool_pre_ping=False,
-    json_serializer=dumps_json,
-    isolation_level="READ COMMITTED",
-)
+
+
+class MonitoredQueuePool(AsyncAdaptedQueuePool):
+    """记录获取连接等待耗时与超时次数的连接池"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_wait((time.perf_counter() - start) * 1000)
+        return conn
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    """主库与只读副本使用相同的连接池配置, 各自拥有独立的连接池"""
+    return create_async_engine(
+        url,
+        poolclass=MonitoredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=20,
+        pool_timeout=30,
+        pool_recycle=1800,
+        pool_pre_ping=False,
+        json_serializer=dumps_json,
+        isolation_level="READ COMMITTED",
+    )
+
+
+async_engine = _create_engine(ASYNC_DATABASE_URL)
+replica_engines = [_create_engine(url) for url in settings.database.replica_urls]
 AsyncSessionLocal = sessionmaker(bind=async_engine, expire_on_commit=False, autoflush=False, class_=AsyncSession)
 
 
@@ -45,29 +87,227 @@ async def use_db():
         yield session
 
 
-# 不输出SQL 的表
-ignore_tables = ["pg_catalog.pg_class"]
+@asynccontextmanager
+async def read_session(db: AsyncSession):
+    """
+    只读 session, 绑定到当前可用的副本. 没有可用副本或处于写后粘滞窗口时直接使用主库的 session db,
+    避免同一个请求在主库上占用两个连接, 读出的对象也可以直接在 db 中修改
+    """
+    bind = read_bind()
+    if bind is async_engine:
+        yield db
+        return
+    async with AsyncSessionLocal(bind=bind) as session:
+        yield session
+
+
+async def use_read_db(db: Annotated[AsyncSession, Depends(use_db)]):
+    """只读 session 的依赖, 与同一请求中的 use_db 共用主库 session"""
+    async with read_session(db) as session:
+        yield session
+
+
+# 副本连接级别的异常, 出现时把副本移出轮询并回落到主库
+REPLICA_ERRORS = (OperationalError, InterfaceError, OSError, TimeoutError)
+
+
+def is_replica_failure(exc: BaseException) -> bool:
+    return isinstance(exc, REPLICA_ERRORS) or (isinstance(exc, DBAPIError) and exc.connection_invalidated)
+
+
+class ReplicaRouter:
+    """只读副本路由: 在健康的副本之间轮询, 后台定时检查副本状态"""
+
+    def __init__(self, engines: list[AsyncEngine], check_interval: int):
+        self.engines = engines
+        self.healthy = list(engines)
+        self.check_interval = check_interval
+        self._cursor = itertools.count()
+        self._task: asyncio.Task | None = None
+
+    def pick(self) -> AsyncEngine:
+        healthy = self.healthy
+        if not healthy:
+            return async_engine
+        return healthy[next(self._cursor) % len(healthy)]
+
+    def mark_down(self, engine: AsyncEngine):
+        if engine in self.healthy:
+            logger.warning(f"只读副本不可用, 移出轮询: {engine.url!r}")
+            self.healthy = [e for e in self.healthy if e is not engine]
+
+    async def check(self):
+        healthy = []
+        for engine in self.engines:
+            try:
+                async with asyncio.timeout(self.check_interval):
+                    async with engine.connect() as conn:
+                        await conn.execute(text("SELECT 1"))
+                healthy.append(engine)
+            except Exception as e:
+                logger.warning(f"只读副本健康检查失败: {engine.url!r} => {e}")
+        if len(healthy) != len(self.healthy):
+            logger.info(f"只读副本可用数量: {len(healthy)}/{len(self.engines)}")
+        self.healthy = healthy
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    def start(self):
+        if self.engines and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for engine in self.engines:
+            await engine.dispose()
+
+
+# 同步 engine => 异步 engine, 监听器中据此找到执行语句的连接池
+_async_engines = {engine.sync_engine: engine for engine in [async_engine, *replica_engines]}
+
+replica_router = ReplicaRouter(replica_engines, settings.database.replica_check_interval)
+
+
+@dataclass
+class RWState:
+    """当前请求的读写状态, 写入后 sticky_until 之前的读操作都走主库"""
+
+    sticky_until: float = 0
+
+
+_rw_state: ContextVar[RWState | None] = ContextVar("rw_state", default=None)
+
+
+def begin_rw_state(sticky_until: float = 0) -> RWState:
+    """在请求开始时创建读写状态, sticky_until 一般来自客户端上一次写入后的 cookie"""
+    state = RWState(sticky_until=sticky_until)
+    _rw_state.set(state)
+    return state
+
+
+def mark_write():
+    state = _rw_state.get()
+    if state is not None:
+        state.sticky_until = time.time() + settings.database.replica_sticky_seconds
+
+
+def is_read_sticky() -> bool:
+    state = _rw_state.get()
+    return state is not None and state.sticky_until > time.time()
+
+
+def read_bind() -> AsyncEngine:
+    return async_engine if is_read_sticky() else replica_router.pick()
 
 
 # 定义监听器函数
 @event.listens_for(Engine, "before_cursor_execute")
 def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    if not any([tab in statement for tab in ignore_tables]):
-        logger.debug(f"SQL    => {statement}")
-        logger.debug(f"Params => {parameters}")
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
 
 
 @event.listens_for(Engine, "after_cursor_execute")
 def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    if not any([tab in statement for tab in ignore_tables]):
-        logger.info(f"Affected Rows  => {cursor.rowcount}")
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    engine = _async_engines.get(conn.engine)
+    sql_monitor.on_query(statement, parameters, elapsed_ms, cursor.rowcount, engine=engine)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    # 执行失败的语句不会触发 after_cursor_execute, 需要移除它的开始时间, 否则后续语句的耗时会错位
+    conn = context.connection
+    starts = conn.info.get("query_start_time") if conn is not None else None
+    if starts:
+        starts.pop()
+
+
+async def warmup_db_pool(engine: AsyncEngine, size: int):
+    """
+        预先建立数据库连接, 并在每个连接上执行一次 BaseDao 的常用查询,
+        提前完成 asyncpg 的类型查询(pg_catalog)与预编译语句缓存
+    :param engine: 需要预热的 engine
+    :param size: 预先建立的连接数, 不超过连接池大小
+    """
+    size = min(size, engine.pool.size())
+    if size <= 0:
+        return
+    results = await asyncio.gather(*(engine.connect().start() for _ in range(size)), return_exceptions=True)
+    conns: list[AsyncConnection] = [res for res in results if isinstance(res, AsyncConnection)]
+    try:
+        # 部分连接失败时也要归还已经建立的连接
+        for res in results:
+            if isinstance(res, BaseException):
+                raise res
+        for conn in conns:
+            await _prime_statements(conn)
+    finally:
+        for conn in conns:
+            await conn.close()
+
+
+async def _prime_statements(conn: AsyncConnection):
+    # 语句与 BaseDao.get_all / get_by_id 保持一致, 预编译缓存以 SQL 文本为 key
+    for mapper in BaseTable.registry.mappers:
+        table_type = mapper.class_
+        await conn.execute(select(table_type).where(table_type.id == -1))
+        # get_all 只建立游标而不读取整张表
+        result = await conn.stream(select(table_type))
+        await result.close()
+    await conn.rollback()
+
+
+def pool_status(name: str, engine: AsyncEngine) -> dict[str, Any]:
+    pool = engine.pool
+    return {
+        "name": name,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        **pool.stats.to_dict(),
+    }
 
 
 # =============================== REDIS ===============================
+class MonitoredRedisPool(ConnectionPool):
+    """记录获取连接等待耗时与连接数超限次数的 redis 连接池"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            conn = await super().get_connection(*args, **kwargs)
+        except redis.exceptions.ConnectionError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_wait((time.perf_counter() - start) * 1000)
+        return conn
+
+    def status(self, name: str) -> dict[str, Any]:
+        in_use = len(self._in_use_connections)
+        return {
+            "name": name,
+            "size": self.max_connections,
+            "checked_in": len(self._available_connections),
+            "checked_out": in_use,
+            "overflow": 0,
+            **self.stats.to_dict(),
+        }
+
+
 REDIS_URL = settings.redis.build_url()
 redis_pool = ConnectionPool.from_url(REDIS_URL, max_connections=10)
 # 异步redis
-async_rds_pool = ConnectionPool.from_url(
+async_rds_pool = MonitoredRedisPool.from_url(
     REDIS_URL,
     max_connections=REDIS_POOL_SIZE,
     decode_responses=True,
@@ -77,48 +317,191 @@ async_rds_pool = ConnectionPool.from_url(
     retry_on_timeout=True,  # 在超时的情况下重新尝试连接
 )
 async_redis = Redis(connection_pool=async_rds_pool)
+# 读写二进制数据(压缩后的接口缓存)的 redis, 不对返回值解码
+async_rds_bin_pool = MonitoredRedisPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_POOL_SIZE,
+    decode_responses=False,
+    health_check_interval=30,
+    socket_timeout=5,
+    socket_connect_timeout=5,
+    retry_on_timeout=True,
+)
+async_redis_bin = Redis(connection_pool=async_rds_bin_pool)
 
 
-async def dep_redis():
-    """专门为fastapi的depends构建的依赖函数"""
+class RedisBreaker:
+    """
+    redis 熔断器. 后台任务定时 ping 检查 redis 是否可用, 请求路径上不再额外 ping.
+    连续失败达到阈值后熔断, 熔断期间依赖 redis 的功能直接失败或绕过缓存, 直到后台检查恢复
+    """
+
+    def __init__(self, client: Redis, check_interval: float, failure_threshold: int):
+        self.client = client
+        self.check_interval = check_interval
+        self.failure_threshold = failure_threshold
+        self.available = True
+        self.failures = 0
+        self._task: asyncio.Task | None = None
+        # 事件循环只保留任务的弱引用, 需要持有引用直到任务完成
+        self._tasks: set[asyncio.Task] = set()
+
+    def record_success(self):
+        self.failures = 0
+        if not self.available:
+            logger.info("redis 已恢复, 关闭熔断")
+            self.available = True
+            task = asyncio.get_running_loop().create_task(_flush_pending_versions())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.available and self.failures >= self.failure_threshold:
+            logger.warning(f"redis 连续失败 {self.failures} 次, 开启熔断")
+            self.available = False
+
+    async def check(self):
+        try:
+            async with asyncio.timeout(self.check_interval):
+                await self.client.ping()
+        except (redis.exceptions.RedisError, OSError, TimeoutError) as e:
+            logger.warning(f"redis 健康检查失败: {e}")
+            self.record_failure()
+        else:
+            self.record_success()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+redis_breaker = RedisBreaker(
+    async_redis,
+    check_interval=settings.redis.breaker_check_interval,
+    failure_threshold=settings.redis.breaker_threshold,
+)
+
+
+async def warmup_redis_pool(size: int):
+    """预先建立 redis 连接, redis 不可用时只记录日志, 不影响启动"""
+    size = min(size, async_rds_pool.max_connections)
+    conns = []
     try:
-        await async_redis.ping()
-        yield async_redis
-    except redis.exceptions.ConnectionError:
-        yield Redis(connection_pool=async_rds_pool)
+        for _ in range(size):
+            conns.append(await async_rds_pool.get_connection("PING"))
+    except (redis.exceptions.RedisError, OSError) as e:
+        logger.warning(f"redis 连接预热失败: {e}")
+        redis_breaker.record_failure()
+    finally:
+        for conn in conns:
+            await async_rds_pool.release(conn)
+
+
+def _ensure_redis_available():
+    if not redis_breaker.available:
+        raise redis.exceptions.ConnectionError("redis is unavailable (circuit open)")
+
+
+async def dep_redis():
+    """专门为fastapi的depends构建的依赖函数. redis 熔断时直接失败"""
+    _ensure_redis_available()
+    yield async_redis
 
 
 @asynccontextmanager
 async def dep_async_redis():
-    """为普通异步函数中封装的上下文参数"""
+    """为普通异步函数中封装的上下文参数. redis 熔断时直接失败"""
+    _ensure_redis_available()
+    yield async_redis
+
+
+# 每张表的数据版本号, 写入后递增, 查询结果缓存据此判断是否过期
+TABLE_VERSION_KEY = "dao:version:{}"
+# redis 不可用期间未能递增版本号的表, 恢复后补偿递增
+_pending_versions: set[str] = set()
+
+
+async def bump_table_version(table_type: type[BaseTable]):
+    """表数据发生变化后递增版本号, redis 不可用时记下表名待恢复后补偿, 不影响写入"""
+    table_name = table_type.__tablename__
+    if not redis_breaker.available:
+        _pending_versions.add(table_name)
+        return
     try:
-        await async_redis.ping()
-        yield async_redis
-    except redis.exceptions.ConnectionError:
-        yield Redis(connection_pool=async_rds_pool)
+        await async_redis.incr(TABLE_VERSION_KEY.format(table_name))
+    except redis.exceptions.RedisError as e:
+        logger.warning(f"更新表 {table_name} 的缓存版本失败: {e}")
+        _pending_versions.add(table_name)
+        redis_breaker.record_failure()
+
+
+async def _flush_pending_versions():
+    while _pending_versions:
+        table_name = _pending_versions.pop()
+        try:
+            await async_redis.incr(TABLE_VERSION_KEY.format(table_name))
+        except redis.exceptions.RedisError as e:
+            logger.warning(f"补偿更新表 {table_name} 的缓存版本失败: {e}")
+            _pending_versions.add(table_name)
+            redis_breaker.record_failure()
+            return
+
+
+# 表数据变化的 NOTIFY 频道, 每张表一个, 消息内容为 "表名:事务ID"(触发器发出的通知可以只有表名)
+TABLE_CHANNEL = "table_changed_{}"
+
+
+async def notify_table_change(session: AsyncSession, table_type: type[BaseTable]):
+    """
+    在当前事务中发送表数据变化通知, 事务提交后才会送达监听方, 回滚则不会送达.
+    消息中带上事务ID, 各 worker 以此判断同一次变化只由一个 worker 清理 redis
+    """
+    table_name = table_type.__tablename__
+    payload = func.concat(f"{table_name}:", func.txid_current())
+    await session.execute(select(func.pg_notify(TABLE_CHANNEL.format(table_name), payload)))
 
 
 async def pg_upsert(
     session: AsyncSession,
     table_type: type[BaseTable],
     values: list[dict[str, Any]],
-    conflict_columns: set[str],
+    conflict_columns: set[str] | None = None,
     ignore_columns: set[str] = None,
     batch_size=300,
+    use_copy: bool = False,
+    concurrency: int = 1,
+    update_written_only: bool = False,
 ) -> list[int]:
     """
         异步版本的upsert.
 
     :param session: AsyncSession
     :param table_type: 基于Base的声明式模型
-    :param values: 要写入的值或模型
-    :param conflict_columns: 模型中标记为unique的一列或多列
+    :param values: 要写入的值或模型, 以第一行的 key 作为写入列
+    :param conflict_columns: 模型中标记为unique的一列或多列, 默认使用表的业务主键或第一个唯一约束
     :param ignore_columns: 要忽略update的列(一般是create_time,update_time之类的)
     :param batch_size: 单次写入多少数量. 默认300
-    :return:
+    :param use_copy: 是否使用 COPY 批量导入模式(适合大批量数据, 此时 batch_size 和 concurrency 无效)
+    :param concurrency: 并发写入使用的连接数. 大于1时各批次并发导入中转表, 再在一个事务中合并到目标表
+    :param update_written_only: 冲突时只更新写入的列, 未写入的列保留原值.
+        默认更新表的所有列(冲突列与忽略列除外), 未写入的列会被更新为默认值
+    :return: 按批次顺序返回的数据ID
     """
     if not values:
         raise ValueError("values can't be empty")
+    if not conflict_columns:
+        conflict_columns = table_meta(table_type).conflict_target
 
     final_ignore_columns = ["id", "created_time", "updated_time"]
     if ignore_columns is not None:
@@ -126,25 +509,319 @@ async def pg_upsert(
 
     fill_values = filter_dict_keys(values, exclude=final_ignore_columns)
 
+    if not use_copy and concurrency > 1:
+        batches = [fill_values[i : i + batch_size] for i in range(0, len(fill_values), batch_size)]
+        batch_result = await _pg_upsert_concurrent(
+            session, table_type, batches, conflict_columns, final_ignore_columns, concurrency, update_written_only
+        )
+        await bump_table_version(table_type)
+        return batch_result
+
     batch_result = []
     try:
-        for i in range(0, len(fill_values), batch_size):
-            batch_data = fill_values[i : i + batch_size]
-            # 只有pg方言中导入的insert函数才有on_conflict_do_update方法
-            insert_stmt = pg_insert(table_type).returning(table_type.id)
-            update_columns = {
-                col.name: col
-                for col in insert_stmt.excluded
-                if col.name not in [*conflict_columns, *final_ignore_columns]
-            }
-
-            upsert_stmt = insert_stmt.on_conflict_do_update(index_elements=conflict_columns, set_=update_columns)
-            wait_res = await session.execute(upsert_stmt, batch_data)
-            result = wait_res.all()
-            batch_result.extend([_ids[0] for _ids in result])
+        if use_copy:
+            batch_result = await _pg_copy_upsert(
+                session, table_type, fill_values, conflict_columns, final_ignore_columns, update_written_only
+            )
+        else:
+            upsert_stmt = _build_upsert_stmt(
+                table_type,
+                frozenset(conflict_columns),
+                frozenset(final_ignore_columns),
+                frozenset(fill_values[0]) if update_written_only else None,
+            )
+            for i in range(0, len(fill_values), batch_size):
+                batch_data = fill_values[i : i + batch_size]
+                wait_res = await session.execute(upsert_stmt, batch_data)
+                result = wait_res.all()
+                batch_result.extend([_ids[0] for _ids in result])
 
+        await notify_table_change(session, table_type)
         await session.commit()
+        await bump_table_version(table_type)
         return batch_result
-    except SQLAlchemyError as e:
+    except SQLAlchemyError:
+        await session.rollback()
+        raise
+    except Exception as e:
+        # COPY 直接使用 asyncpg 连接, 驱动的异常没有经过 SQLAlchemy 转换
         await session.rollback()
-        raise e
+        raise DBAPIError(None, None, e) from e
+
+
+@lru_cache(maxsize=128)
+def _build_upsert_stmt(
+    table_type: type[BaseTable],
+    conflict_columns: frozenset[str],
+    ignore_columns: frozenset[str],
+    written_columns: frozenset[str] | None = None,
+) -> Insert:
+    """按 (表, 冲突列, 忽略列, 只更新的写入列) 缓存构建好的 upsert 语句, 避免每个批次重复构建"""
+    # 只有pg方言中导入的insert函数才有on_conflict_do_update方法
+    insert_stmt = pg_insert(table_type).returning(table_type.id)
+    update_columns = _excluded_columns(insert_stmt, conflict_columns, ignore_columns, written_columns)
+    return insert_stmt.on_conflict_do_update(index_elements=sorted(conflict_columns), set_=update_columns)
+
+
+async def _pg_upsert_concurrent(
+    session: AsyncSession,
+    table_type: type[BaseTable],
+    batches: list[list[dict[str, Any]]],
+    conflict_columns: set[str],
+    ignore_columns: list[str],
+    concurrency: int,
+    update_written_only: bool = False,
+) -> list[int]:
+    """
+        把批次分散到多个连接上并发 COPY 到一张 UNLOGGED 中转表, 再在调用方的 session 中用一条语句合并到目标表.
+        目标表只在合并的事务中被修改, 任一批次失败或合并失败时目标表都不会有任何变化. 中转表在结束后删除,
+        进程异常退出时遗留的中转表由 drop_stale_staging_tables 清理. 需要当前用户有建表权限
+
+    :param session: 调用方的 session, 合并与提交在其中执行
+    :param table_type: 基于Base的声明式模型
+    :param batches: 分好批次的数据
+    :param conflict_columns: 冲突列
+    :param ignore_columns: 忽略update的列
+    :param concurrency: 最多使用的连接数
+    :param update_written_only: 冲突时只更新写入的列
+    :return: 按输入顺序返回的数据ID
+    """
+    table = table_type.__table__
+    columns = _staging_columns(table_type, batches[0][0])
+    col_names = [col.name for col in columns]
+    # 中转表需要被多个连接看到, 不能使用临时表. 表名带创建时间与随机后缀, 避免并发调用冲突, 也用于清理遗留的表
+    staging_name = f"{STAGING_PREFIX}{table.name[:STAGING_TABLE_NAME_MAX]}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    starts = list(itertools.accumulate((len(batch) for batch in batches[:-1]), initial=0))
+    pending = iter(enumerate(batches))
+    bind = session.bind
+
+    async def worker():
+        # 多个 worker 共享同一个迭代器, 取到哪个批次就导入哪个, 每次 COPY 自动提交
+        async with bind.connect() as conn:
+            raw_conn = await conn.get_raw_connection()
+            for idx, batch_data in pending:
+                await raw_conn.driver_connection.copy_records_to_table(
+                    staging_name,
+                    records=_staging_records(columns, batch_data, starts[idx]),
+                    columns=[*col_names, STAGING_ORDINAL],
+                )
+
+    async with bind.begin() as conn:
+        await conn.execute(_create_staging_sql(bind, table, staging_name, col_names, temporary=False))
+    try:
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(min(concurrency, len(batches))):
+                    tg.create_task(worker())
+        except* Exception as eg:
+            # 只向外抛出第一个失败批次的异常, 驱动的异常与 pg_upsert 一样包装为 DBAPIError
+            error = eg.exceptions[0]
+            if isinstance(error, SQLAlchemyError):
+                raise error from None
+            raise DBAPIError(None, None, error) from error
+
+        try:
+            batch_result = await _merge_staging(
+                session, table_type, staging_name, col_names, conflict_columns, ignore_columns, update_written_only
+            )
+            await notify_table_change(session, table_type)
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+    finally:
+        try:
+            async with bind.begin() as conn:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {bind.dialect.identifier_preparer.quote(staging_name)}"))
+        except Exception as e:
+            logger.warning(f"删除中转表 {staging_name} 失败: {e}")
+
+    return batch_result
+
+
+def _excluded_columns(
+    insert_stmt: Insert,
+    conflict_columns: set[str] | frozenset[str],
+    ignore_columns: list[str] | frozenset[str],
+    written_columns: Iterable[str] | None = None,
+) -> dict[str, Any]:
+    """
+    冲突时需要更新的列: 排除冲突列和忽略列. 指定了 written_columns 时只更新这些写入的列, 未写入的列保留原值,
+    此时没有可更新的列则用冲突列原值更新一次, 保证 RETURNING 仍然返回已存在数据的ID
+    """
+    skip = {*conflict_columns, *ignore_columns}
+    if written_columns is None:
+        return {col.name: col for col in insert_stmt.excluded if col.name not in skip}
+    update_columns = {name: insert_stmt.excluded[name] for name in written_columns if name not in skip}
+    return update_columns or {name: insert_stmt.excluded[name] for name in sorted(conflict_columns)}
+
+
+# 中转表中记录输入行号的列
+STAGING_ORDINAL = "_stg_ordinal"
+# 并发写入的中转表名: 前缀 + 表名 + 创建时间 + 随机后缀, 表名截断后总长度不超过 pg 标识符的 63 字节
+STAGING_PREFIX = "_stg_"
+STAGING_TABLE_NAME_MAX = 38
+_STAGING_NAME = re.compile(rf"^{STAGING_PREFIX}.+_(\d{{10}})_[0-9a-f]{{8}}$")
+# 超过这个时间(秒)的中转表视为进程异常退出后遗留的
+STAGING_MAX_AGE = 3600
+
+
+async def drop_stale_staging_tables(engine: AsyncEngine, max_age: int = STAGING_MAX_AGE) -> list[str]:
+    """
+    删除进程异常退出后遗留的并发写入中转表. 只删除按表名中的创建时间已超过 max_age 秒的表,
+    不影响其它 worker 正在使用的中转表
+    """
+    if engine.dialect.name != "postgresql":
+        return []
+    async with engine.begin() as conn:
+        result = await conn.execute(
+            text("SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE :pattern"),
+            {"pattern": STAGING_PREFIX.replace("_", "\\_") + "%"},
+        )
+        stale = _stale_staging_tables(result.scalars().all(), time.time() - max_age)
+        for name in stale:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {engine.dialect.identifier_preparer.quote(name)}"))
+    return stale
+
+
+def _stale_staging_tables(names: Iterable[str], before: float) -> list[str]:
+    stale = []
+    for name in names:
+        matched = _STAGING_NAME.match(name)
+        if matched and int(matched.group(1)) < before:
+            stale.append(name)
+    return stale
+
+
+def _staging_columns(table_type: type[BaseTable], row: dict[str, Any]) -> list[Column]:
+    """以第一行的 key 作为写入列, 与 executemany 的行为保持一致"""
+    return [col for col in table_meta(table_type).columns if col.name in row]
+
+
+def _create_staging_sql(
+    bind: AsyncEngine, table: Table, staging_name: str, col_names: list[str], temporary: bool
+) -> TextClause:
+    """与目标表写入列结构相同的中转表, 额外带一列输入行号. 临时表仅对当前连接可见, 事务结束后自动删除"""
+    preparer = bind.dialect.identifier_preparer
+    kind = "TEMP TABLE" if temporary else "UNLOGGED TABLE"
+    on_commit = " ON COMMIT DROP" if temporary else ""
+    return text(
+        f"CREATE {kind} {preparer.quote(staging_name)}{on_commit} AS "
+        f"SELECT {', '.join(preparer.quote(name) for name in col_names)}, 0::bigint AS {STAGING_ORDINAL} "
+        f"FROM {preparer.format_table(table)} WITH NO DATA"
+    )
+
+
+def _staging_records(columns: list[Column], rows: list[dict[str, Any]], start: int) -> list[list[Any]]:
+    """
+    转换为 COPY 使用的记录, 末尾追加输入行号. COPY 使用二进制协议, json 类型需要先序列化为字符串.
+    与 executemany 一样, 缺少第一行中的列时报错, 不会写入 NULL
+    """
+    col_names = [col.name for col in columns]
+    json_indexes = [i for i, col in enumerate(columns) if isinstance(col.type, JSON)]
+    records = []
+    for ordinal, row in enumerate(rows, start):
+        try:
+            record = [row[name] for name in col_names]
+        except KeyError as e:
+            raise exc.InvalidRequestError(f"A value is required for column {e}, in row {ordinal}") from None
+        for i in json_indexes:
+            if record[i] is not None:
+                record[i] = dumps_json(record[i])
+        record.append(ordinal)
+        records.append(record)
+    return records
+
+
+async def _merge_staging(
+    session: AsyncSession,
+    table_type: type[BaseTable],
+    staging_name: str,
+    col_names: list[str],
+    conflict_columns: set[str],
+    ignore_columns: list[str],
+    update_written_only: bool = False,
+) -> list[int]:
+    """
+    用一条 INSERT ... SELECT ... ON CONFLICT 把中转表合并到目标表.
+    一条语句不能多次更新同一行, 因此冲突列重复的行只合并输入行号最大的一行, 与逐批写入时后写入的覆盖先写入的一致.
+    RETURNING 的顺序不固定, 因此通过冲突列关联回中转表后按输入行号返回ID, 重复的行返回同一个ID
+    (冲突列为 NULL 的行无法关联, 不会出现在结果中)
+    """
+    result = await session.execute(
+        _merge_staging_stmt(table_type, staging_name, col_names, conflict_columns, ignore_columns, update_written_only)
+    )
+    return list(result.scalars().all())
+
+
+def _merge_staging_stmt(
+    table_type: type[BaseTable],
+    staging_name: str,
+    col_names: list[str],
+    conflict_columns: set[str],
+    ignore_columns: list[str],
+    update_written_only: bool = False,
+) -> Select:
+    table = table_type.__table__
+    staging = sa_table(staging_name, *[sa_column(name) for name in (*col_names, STAGING_ORDINAL)])
+    conflict_names = sorted(conflict_columns)
+    keys = [staging.c[name] for name in conflict_names]
+    ordinal = staging.c[STAGING_ORDINAL]
+    # 冲突列为 NULL 的行不会发生冲突, 不参与去重
+    null_key = case((or_(*(key.is_(None) for key in keys)), ordinal))
+    latest = (
+        select(*(staging.c[name] for name in col_names))
+        .distinct(*keys, null_key)
+        .order_by(*keys, null_key, ordinal.desc())
+    )
+    insert_stmt = pg_insert(table_type).from_select(col_names, latest)
+    update_columns = _excluded_columns(
+        insert_stmt, conflict_columns, ignore_columns, col_names if update_written_only else None
+    )
+    upserted = (
+        insert_stmt.on_conflict_do_update(index_elements=conflict_names, set_=update_columns)
+        .returning(table.c.id, *(table.c[name] for name in conflict_names))
+        .cte("upserted")
+    )
+    return (
+        select(upserted.c.id)
+        .join_from(staging, upserted, and_(*(staging.c[name] == upserted.c[name] for name in conflict_names)))
+        .order_by(ordinal)
+    )
+
+
+async def _pg_copy_upsert(
+    session: AsyncSession,
+    table_type: type[BaseTable],
+    values: list[dict[str, Any]],
+    conflict_columns: set[str],
+    ignore_columns: list[str],
+    update_written_only: bool = False,
+) -> list[int]:
+    """
+        通过 asyncpg 的 COPY 把数据导入临时表, 再用一条 INSERT ... SELECT ... ON CONFLICT 合并到目标表.
+        冲突列重复的行以最后一行为准.
+
+    :param session: AsyncSession
+    :param table_type: 基于Base的声明式模型
+    :param values: 已经去除忽略列的数据
+    :param conflict_columns: 冲突列
+    :param ignore_columns: 忽略update的列
+    :param update_written_only: 冲突时只更新写入的列
+    :return: 按输入顺序返回的写入或更新的数据ID
+    """
+    table = table_type.__table__
+    columns = _staging_columns(table_type, values[0])
+    col_names = [col.name for col in columns]
+    staging_name = f"_stg_{table.name}"
+    await session.execute(_create_staging_sql(session.bind, table, staging_name, col_names, temporary=True))
+
+    # 与 session 共用同一个连接和事务
+    conn = await session.connection()
+    raw_conn = await conn.get_raw_connection()
+    await raw_conn.driver_connection.copy_records_to_table(
+        staging_name, records=_staging_records(columns, values, 0), columns=[*col_names, STAGING_ORDINAL]
+    )
+    return await _merge_staging(
+        session, table_type, staging_name, col_names, conflict_columns, ignore_columns, update_written_only
+    )
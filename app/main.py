@@ -11,7 +11,7 @@ from loguru import logger
 from .api import routers
 from .ctx import app_life_span, configure_logging
 from .exception import register_exception_handler
-from .midware import register_middleware_cors, register_plugin_cache
+from .midware import register_middleware_cors, register_middleware_rw_sticky, register_plugin_cache
 
 app = FastAPI(lifespan=app_life_span)
 
@@ -29,5 +29,8 @@ register_exception_handler(app)
 # CORS
 register_middleware_cors(app)
 
+# 读写分离
+register_middleware_rw_sticky(app)
+
 # Cache2
 register_plugin_cache()
@@ -5,20 +5,28 @@ __version__ = 0.0.1
 __description__ = 中间件
 """
 
-import json
-from typing import Any, Callable
+import lzma
+import math
+import zlib
+from collections.abc import Callable
+from datetime import date, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any
 
 from fastapi import FastAPI
 from fastapi_cache import Coder, FastAPICache
-from fastapi_cache.backends.redis import RedisBackend
 from loguru import logger
+from pydantic import BaseModel
 from starlette.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse, Response
 
-from app.db import async_redis
-from app.utils.encrypts import hash_md5
-from app.utils.serials import dumps_json, loads_json
+from app.cache import api_cache_backend
+from app.db import begin_rw_state, replica_engines
+from app.settings import STD_UTF8, settings
+from app.utils.encrypts import hash_blake2b
+from app.utils.serials import dumps_json
 
 
 def register_middleware_cors(app: FastAPI):
@@ -33,8 +41,75 @@ def register_middleware_cors(app: FastAPI):
     )
 
 
+# 记录客户端写后读粘滞截止时间的 cookie
+RW_STICKY_COOKIE = "rw_sticky_until"
+
+
+def register_middleware_rw_sticky(app: FastAPI):
+    """
+    读写分离的写后读一致性: 请求中发生写入后, 通过 cookie 让同一客户端在粘滞窗口内的读请求也走主库
+    """
+    if not replica_engines:
+        return
+
+    logger.info("...注册 读写分离粘滞 中间件")
+
+    @app.middleware("http")
+    async def rw_sticky(request: Request, call_next):
+        try:
+            sticky_until = float(request.cookies.get(RW_STICKY_COOKIE, 0))
+        except ValueError:
+            sticky_until = 0
+        state = begin_rw_state(sticky_until)
+        response = await call_next(request)
+        if state.sticky_until > sticky_until:
+            response.set_cookie(
+                RW_STICKY_COOKIE,
+                f"{state.sticky_until:.3f}",
+                max_age=math.ceil(settings.database.replica_sticky_seconds),
+                httponly=True,
+            )
+        return response
+
+
 # ===============cache插件处理==============
-def __md5_key_builder(
+def _canonical(value: Any) -> str | None:
+    """
+        把参数编码为带类型与长度前缀的规范字符串, 不同的参数组合不会得到相同的编码.
+        不支持的类型(注入的 service, session, request 等)返回 None, 不参与生成 key
+    """
+    if value is None:
+        return "n"
+    # bool 是 int 的子类, 需要先判断
+    if isinstance(value, bool):
+        return "b1" if value else "b0"
+    if isinstance(value, Enum):
+        value = value.value
+    if isinstance(value, str):
+        text, tag = value, "s"
+    elif isinstance(value, int):
+        text, tag = str(value), "i"
+    elif isinstance(value, float):
+        text, tag = repr(value), "f"
+    elif isinstance(value, Decimal):
+        text, tag = str(value), "d"
+    elif isinstance(value, date | time):
+        text, tag = value.isoformat(), "t"
+    elif isinstance(value, BaseModel):
+        text, tag = value.model_dump_json(), "m"
+    elif isinstance(value, list | tuple | set | frozenset):
+        items = [_canonical(item) for item in value]
+        if any(item is None for item in items):
+            return None
+        if isinstance(value, set | frozenset):
+            items.sort()
+        text, tag = "".join(items), "l"
+    else:
+        return None
+    return f"{tag}{len(text)}:{text}"
+
+
+def __canonical_key_builder(
     func: Callable[..., Any],
     namespace: str = "",
     *,
@@ -43,49 +118,121 @@ def __md5_key_builder(
     args: tuple[Any, ...],
     kwargs: dict[str, Any],
 ) -> str:
-    def is_serializable(obj):
-        try:
-            json.dumps(obj)
-            return True
-        except TypeError:
-            return False
-
-    # 根据请求的 path、query 参数等构建唯一的缓存键
-    hash_keys = []
+    """
+        根据 path、排序后的 query 参数、指定的请求头以及可序列化的函数参数构建缓存 key:
+        key = {namespace}:{path}:{blake2b(规范编码)}
+    """
     if namespace == "":
-        namespace = biz_settings.pk_cache_ns
-
-    # 具体的key
-    key = f"{namespace}:{request.url.path}" if request and request.url else f"{namespace}:{func.__name__}"
-
-    if args:
-        hash_keys.extend([arg for arg in args if is_serializable(arg)])
-    if kwargs:
-        hash_keys.extend([arg for arg in kwargs.values() if is_serializable(arg)])
-
-    if hash_keys:
-        key = f"{key}:{hash_md5("".join(hash_keys))}"
-
-    return key
+        namespace = settings.cache.prefix
+
+    parts = []
+    if request is not None:
+        path = request.url.path
+        # 只按参数名排序(稳定排序), 同名参数保持原有顺序: ?a=1&a=2 与 ?a=2&a=1 对应不同的列表
+        query_items = sorted(request.query_params.multi_items(), key=lambda kv: kv[0])
+        parts.extend(f"q{_canonical(k)}{_canonical(v)}" for k, v in query_items)
+        parts.extend(f"h{_canonical(h)}{_canonical(request.headers.get(h))}" for h in settings.cache.vary_headers)
+    else:
+        path = f"{func.__module__}.{func.__qualname__}"
+
+    for arg in args:
+        encoded = _canonical(arg)
+        if encoded is not None:
+            parts.append(f"a{encoded}")
+    for name in sorted(kwargs):
+        encoded = _canonical(kwargs[name])
+        if encoded is not None:
+            parts.append(f"k{_canonical(name)}{encoded}")
+
+    return f"{namespace}:{path}:{hash_blake2b("".join(parts))}"
+
+
+# 接口缓存信封: 版本(1字节) + 压缩方式(1字节) + content-type 长度(1字节) + content-type
+# + 状态码(2字节) + 响应头长度(2字节) + 响应头 + 响应内容
+_ENVELOPE_VERSION = 2
+_CODEC_RAW, _CODEC_ZLIB, _CODEC_LZMA = 0, 1, 2
+_COMPRESSORS = {_CODEC_ZLIB: zlib.compress, _CODEC_LZMA: lzma.compress}
+_DECOMPRESSORS = {_CODEC_ZLIB: zlib.decompress, _CODEC_LZMA: lzma.decompress}
+_CODEC_NAMES = {"zlib": _CODEC_ZLIB, "lzma": _CODEC_LZMA}
+# 与请求无关、可以随缓存返回给其它客户端的响应头. set-cookie、date、server 等头不保存,
+# content-length 与 content-type 由 Response 根据内容重新生成
+_CACHED_HEADERS = frozenset(
+    (
+        b"cache-control",
+        b"content-disposition",
+        b"content-language",
+        b"etag",
+        b"expires",
+        b"last-modified",
+        b"vary",
+    )
+)
+_MAX_HEADERS_BYTES = 0xFFFF
 
 
 class UJsonCoder(Coder):
+    """
+    接口缓存的编解码: 以二进制信封保存响应内容、状态码与响应头, 超过阈值时压缩.
+    命中时直接返回保存的响应字节, 不再解析 json 后重新序列化
+    """
+
     @classmethod
-    def encode(cls, value: Any) -> str:
-        if isinstance(value, JSONResponse):
-            return value.body
-        return dumps_json(value)
+    def encode(cls, value: Any) -> bytes:
+        if isinstance(value, Response):
+            body, media_type = bytes(value.body), value.media_type or JSONResponse.media_type
+            status_code = value.status_code
+            headers = b"\r\n".join(k + b": " + v for k, v in value.raw_headers if k in _CACHED_HEADERS)
+            if len(headers) > _MAX_HEADERS_BYTES:
+                logger.warning(f"响应头过长({len(headers)} 字节), 缓存时不保存响应头")
+                headers = b""
+        else:
+            body, media_type = dumps_json(value).encode(STD_UTF8), JSONResponse.media_type
+            status_code, headers = 200, b""
+
+        codec = _CODEC_RAW
+        if len(body) >= settings.cache.compress_min_bytes:
+            codec = _CODEC_NAMES.get(settings.cache.compress_codec, _CODEC_ZLIB)
+            body = _COMPRESSORS[codec](body)
+        content_type = media_type.encode(STD_UTF8)
+        if len(content_type) > 0xFF:
+            raise ValueError(f"content-type is too long to cache: {media_type!r}")
+        return b"".join(
+            (
+                bytes((_ENVELOPE_VERSION, codec, len(content_type))),
+                content_type,
+                status_code.to_bytes(2),
+                len(headers).to_bytes(2),
+                headers,
+                body,
+            )
+        )
 
     @classmethod
-    def decode(cls, value: str) -> Any:
-        return loads_json(value)
+    def decode(cls, value: bytes) -> Response:
+        version, codec, ct_len = value[0], value[1], value[2]
+        if version != _ENVELOPE_VERSION:
+            raise ValueError(f"unknown cache envelope version: {version}")
+        offset = 3 + ct_len
+        media_type = value[3:offset].decode(STD_UTF8)
+        status_code = int.from_bytes(value[offset : offset + 2])
+        hdr_len = int.from_bytes(value[offset + 2 : offset + 4])
+        headers = value[offset + 4 : offset + 4 + hdr_len]
+        offset += 4 + hdr_len
+        body = value[offset:]
+        if codec != _CODEC_RAW:
+            body = _DECOMPRESSORS[codec](body)
+        response = Response(content=body, status_code=status_code, media_type=media_type)
+        if headers:
+            response.raw_headers.extend(tuple(line.split(b": ", 1)) for line in headers.split(b"\r\n"))
+        return response
 
 
 def register_plugin_cache():
     logger.info("...注册 FastAPI-cache2 插件")
     FastAPICache.init(
-        RedisBackend(async_redis),
-        prefix="api-cache",
+        api_cache_backend,
+        prefix=settings.cache.prefix,
+        expire=settings.cache.expire,
         coder=UJsonCoder,
-        key_builder=__md5_key_builder,
+        key_builder=__canonical_key_builder,
     )
@@ -5,12 +5,17 @@ __version__ = 0.0.1
 __description__ = 数据库模型的基类
 """
 
-from typing import Any, Type
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import attrgetter
+from typing import Any, ClassVar, Self
 
-from sqlalchemy import BIGINT, TIMESTAMP, func
+from pydantic.alias_generators import to_camel
+from sqlalchemy import BIGINT, TIMESTAMP, Column, Table, UniqueConstraint, event, func
 from sqlalchemy import inspect as sa_inspect
 from sqlalchemy.ext.asyncio import AsyncAttrs
-from sqlalchemy.orm import DeclarativeBase, mapped_column
+from sqlalchemy.orm import DeclarativeBase, Mapper, mapped_column
 
 
 class BaseTable(AsyncAttrs, DeclarativeBase):
@@ -18,9 +23,12 @@ class BaseTable(AsyncAttrs, DeclarativeBase):
 
     id = mapped_column(BIGINT, primary_key=True, autoincrement=True, nullable=False, sort_order=-99)
 
-    created_time = mapped_column(TIMESTAMP, nullable=False, sort_order=100, default=func.current_time)
+    # 默认值必须是 SQL 表达式 func.now() 而不是 func.now 本身: 后者是可调用对象, 会被当作 Python 端的默认值函数
+    created_time = mapped_column(
+        TIMESTAMP, nullable=False, sort_order=100, default=func.now(), server_default=func.now()
+    )
     updated_time = mapped_column(
-        TIMESTAMP, nullable=False, sort_order=101, default=func.current_time, onupdate=func.current_time
+        TIMESTAMP, nullable=False, sort_order=101, default=func.now(), server_default=func.now(), onupdate=func.now()
     )
 
     def __repr__(self) -> str:
@@ -33,16 +41,148 @@ class BaseTable(AsyncAttrs, DeclarativeBase):
         :param exclude_none: 默认排除None值
         returns: dict
         """
+        meta = table_meta(type(self))
+        names = meta.column_names if not aliases else [aliases.get(name, name) for name in meta.column_names]
+        data = zip(names, meta.getter(self), strict=True)
+        if exclude_none:
+            return {name: value for name, value in data if value is not None}
+        return dict(data)
+
+    @classmethod
+    def get_biz_primary_keys(cls) -> set[str]:
+        # 获取除 id 以外的主键字段, 没有时使用第一个唯一约束的字段
+        return set(table_meta(cls).conflict_target)
+
+
+@dataclass(frozen=True, slots=True)
+class TableMeta:
+    """表的元数据, 每张表只在映射配置完成时计算一次, 热点路径上不再调用 sa_inspect"""
+
+    table_type: type[BaseTable]
+    # 按表中顺序的列对象、列名与属性名
+    columns: tuple[Column, ...]
+    column_names: tuple[str, ...]
+    attr_keys: tuple[str, ...]
+    # 一次取出所有列的值, 返回 tuple
+    getter: Callable[[Any], tuple]
+    # 除 id 以外的主键字段
+    biz_keys: frozenset[str]
+    # upsert 时默认的冲突字段: 业务主键, 没有时使用第一个唯一约束
+    conflict_target: frozenset[str]
+    # 驼峰名称与下划线名称 => 列名
+    field_to_column: dict[str, str]
+    # 列名 => 驼峰名称
+    column_to_camel: dict[str, str]
+
+
+# 表 => 元数据
+_TABLE_META: dict[type, TableMeta] = {}
+
+
+def _unique_constraints(table: Table) -> list[frozenset[str]]:
+    """
+    每个唯一约束的字段. table.constraints 是 set, 按列在表中的位置与约束名排序,
+    保证每次启动得到相同的默认冲突列
+    """
+    positions = {col.name: i for i, col in enumerate(table.columns)}
+    constraints = sorted(
+        (constraint for constraint in table.constraints if isinstance(constraint, UniqueConstraint)),
+        key=lambda c: (sorted(positions[col.name] for col in c.columns), c.name or ""),
+    )
+    return [frozenset(col.name for col in constraint.columns) for constraint in constraints]
+
+
+def _build_table_meta(table_type: type[BaseTable]) -> TableMeta:
+    columns = tuple(sa_inspect(table_type).columns)
+    column_names = tuple(col.name for col in columns)
+    attr_keys = tuple(col.key for col in columns)
+    getter = attrgetter(*attr_keys)
+    if len(attr_keys) == 1:
+        single = getter
+        getter = lambda obj: (single(obj),)  # noqa: E731
+
+    table = table_type.__table__
+    biz_keys = frozenset(col.name for col in table.primary_key if col.name != "id")
+    conflict_target = biz_keys or next(iter(_unique_constraints(table)), frozenset())
+
+    field_to_column = {name: name for name in column_names}
+    field_to_column.update({to_camel(name): name for name in column_names})
+    return TableMeta(
+        table_type=table_type,
+        columns=columns,
+        column_names=column_names,
+        attr_keys=attr_keys,
+        getter=getter,
+        biz_keys=biz_keys,
+        conflict_target=conflict_target,
+        field_to_column=field_to_column,
+        column_to_camel={name: to_camel(name) for name in column_names},
+    )
+
+
+def table_meta(table_type: type[BaseTable]) -> TableMeta:
+    """获取表的元数据. 一般在映射配置完成时已经注册, 否则在第一次使用时计算"""
+    meta = _TABLE_META.get(table_type)
+    if meta is None:
+        meta = _TABLE_META[table_type] = _build_table_meta(table_type)
+    return meta
+
+
+@event.listens_for(BaseTable, "mapper_configured", propagate=True)
+def _register_table_meta(mapper: Mapper, table_type: type[BaseTable]):
+    _TABLE_META[table_type] = _build_table_meta(table_type)
+
+
+class TableRecord:
+    """
+    只读查询使用的精简记录, 由 record_class 按表生成带 __slots__ 的子类.
+    没有 ORM 的状态跟踪与 identity map, 支持按属性读取与 to_dict, 可以直接转换为 schema
+    """
+
+    __slots__ = ()
+    __table_type__: ClassVar[type[BaseTable]]
+    __columns__: ClassVar[tuple[str, ...]] = ()
+    # 每一列的 slot 赋值函数, 绕过只读的 __setattr__
+    __setters__: ClassVar[tuple[Callable[[Any, Any], None], ...]] = ()
+
+    @classmethod
+    def from_row(cls, values: Sequence[Any]) -> Self:
+        record = object.__new__(cls)
+        for setter, value in zip(cls.__setters__, values, strict=True):
+            setter(record, value)
+        return record
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, name: str) -> Any:
+        return getattr(self, name)
+
+    def __repr__(self) -> str:
+        return str(self.to_dict())
+
+    def to_dict(self, aliases: dict[str, str] = None, exclude_none=False) -> dict[str, Any]:
+        """与 BaseTable.to_dict 相同"""
         aliases = aliases or {}
+        data = {aliases.get(name, name): getattr(self, name) for name in self.__columns__}
         if exclude_none:
-            return {
-                aliases.get(c.name, c.name): getattr(self, c.name)
-                for c in sa_inspect(type(self)).columns
-                if getattr(self, c.name) is not None
-            }
-        else:
-            return {aliases.get(c.name, c.name): getattr(self, c.name, None) for c in sa_inspect(type(self)).columns}
-
-    def get_biz_primary_keys(self) -> set[str]:
-        # 获取除 id 以外的主键字段
-        return {col.name for col in self.__table__.primary_key if col.name != "id"}
+            return {k: v for k, v in data.items() if v is not None}
+        return data
+
+
+@lru_cache(maxsize=256)
+def record_class(table_type: type[BaseTable], columns: tuple[str, ...] | None = None) -> type[TableRecord]:
+    """
+        生成表的只读记录类型
+    :param table_type: 数据库模型
+    :param columns: 记录包含的列, 为空时包含全部列
+    :return:
+    """
+    names = columns or table_meta(table_type).attr_keys
+    record_cls = type(
+        f"{table_type.__name__}Record",
+        (TableRecord,),
+        {"__slots__": names, "__table_type__": table_type, "__columns__": names},
+    )
+    record_cls.__setters__ = tuple(record_cls.__dict__[name].__set__ for name in names)
+    return record_cls
@@ -19,7 +19,7 @@ class TabUser(BaseTable):
     password = mapped_column(String(50), nullable=False)
     nickname = mapped_column(String(50))
     age = mapped_column(SMALLINT)
-    last_login_time = mapped_column(TIMESTAMP, nullable=False, default=func.now)
+    last_login_time = mapped_column(TIMESTAMP, nullable=False, default=func.now(), server_default=func.now())
     expired = mapped_column(BOOLEAN, nullable=False, default=False)
     locked = mapped_column(BOOLEAN, nullable=False, default=False)
 
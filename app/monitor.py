@@ -0,0 +1,264 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-20
+__version__ = 0.0.1
+__description__ = SQL 执行统计与日志采样
+"""
+
+import asyncio
+import bisect
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Any
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.settings import settings
+from app.utils.times import dt_to_str
+
+# 不统计, 不输出SQL 的表
+IGNORE_TABLES = ("pg_catalog.pg_class",)
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"\$\d+|%\(\w+\)s|%s|\?")
+_RE_GROUP = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_RE_GROUP_LIST = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+_RE_SPACE = re.compile(r"\s+")
+# 可以 EXPLAIN 的语句
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str | None:
+    """
+        把 SQL 归一化为指纹: 常量与参数替换为 ?, IN 列表与多行 VALUES 折叠为一项, 合并空白.
+        需要忽略的语句返回 None
+    :param statement: SQL 语句
+    :return:
+    """
+    if any(tab in statement for tab in IGNORE_TABLES):
+        return None
+    fp = _RE_STRING.sub("?", statement)
+    fp = _RE_NUMBER.sub("?", fp)
+    fp = _RE_PARAM.sub("?", fp)
+    fp = _RE_GROUP.sub("(?)", fp)
+    fp = _RE_GROUP_LIST.sub("(?)", fp)
+    return _RE_SPACE.sub(" ", fp).strip()
+
+
+class QueryStat:
+    """单个指纹的统计数据, 耗时只保留最近的样本用于计算分位数"""
+
+    __slots__ = ("fingerprint", "calls", "total_ms", "max_ms", "rows", "samples")
+
+    def __init__(self, fp: str, sample_size: int):
+        self.fingerprint = fp
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.samples: deque[float] = deque(maxlen=sample_size)
+
+    def to_dict(self) -> dict[str, Any]:
+        ordered = sorted(self.samples)
+        return {
+            "fingerprint": self.fingerprint,
+            "calls": self.calls,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0,
+            "p50_ms": round(_percentile(ordered, 0.5), 3),
+            "p99_ms": round(_percentile(ordered, 0.99), 3),
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+        }
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class QueryStats:
+    """按指纹聚合的 SQL 统计(当前 worker 进程内), 超出容量时淘汰最久未执行的指纹"""
+
+    def __init__(self, max_entries: int = 500, sample_size: int = 256):
+        self.max_entries = max_entries
+        self.sample_size = sample_size
+        self._entries: OrderedDict[str, QueryStat] = OrderedDict()
+
+    def record(self, fp: str, elapsed_ms: float, rowcount: int):
+        entry = self._entries.get(fp)
+        if entry is None:
+            if len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            entry = self._entries[fp] = QueryStat(fp, self.sample_size)
+        else:
+            self._entries.move_to_end(fp)
+
+        entry.calls += 1
+        entry.total_ms += elapsed_ms
+        entry.samples.append(elapsed_ms)
+        if elapsed_ms > entry.max_ms:
+            entry.max_ms = elapsed_ms
+        if rowcount > 0:
+            entry.rows += rowcount
+
+    def snapshot(self, order_by: str = "total_ms", limit: int = 50) -> list[dict[str, Any]]:
+        items = [entry.to_dict() for entry in list(self._entries.values())]
+        items.sort(key=lambda item: item[order_by], reverse=True)
+        return items[:limit]
+
+    def reset(self):
+        self._entries.clear()
+
+
+class PlanCapture:
+    """
+    慢查询执行计划采集: 在独立的连接上异步执行 EXPLAIN (FORMAT JSON), 同一指纹在间隔时间内最多采集一次.
+    采集结果放在固定大小的环形缓冲区中
+    """
+
+    def __init__(self, threshold_ms: float, interval_s: float, buffer_size: int):
+        self.threshold_ms = threshold_ms
+        self.interval_s = interval_s
+        self.plans: deque[dict[str, Any]] = deque(maxlen=buffer_size)
+        self._last_captured: dict[str, float] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def maybe_capture(self, engine: AsyncEngine | None, fp: str, statement: str, parameters: Any, elapsed_ms: float):
+        if not self.threshold_ms or elapsed_ms < self.threshold_ms or engine is None:
+            return
+        if not statement.lstrip()[:6].upper().startswith(_EXPLAINABLE):
+            return
+
+        now = time.monotonic()
+        last = self._last_captured.get(fp)
+        if last is not None and now - last < self.interval_s:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        if len(self._last_captured) >= 4096:
+            self._last_captured = {k: v for k, v in self._last_captured.items() if now - v < self.interval_s}
+        self._last_captured[fp] = now
+
+        # executemany 时只取第一组参数
+        if isinstance(parameters, list):
+            parameters = parameters[0] if parameters else None
+        task = loop.create_task(self._capture(engine, fp, statement, parameters, elapsed_ms))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _capture(self, engine: AsyncEngine, fp: str, statement: str, parameters: Any, elapsed_ms: float):
+        try:
+            async with engine.connect() as conn:
+                result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters or ())
+                plan = result.scalar()
+        except Exception as e:
+            logger.warning(f"采集执行计划失败: {fp} => {e}")
+            return
+        self.plans.append(
+            {
+                "fingerprint": fp,
+                "statement": statement,
+                "elapsed_ms": round(elapsed_ms, 3),
+                "captured_at": dt_to_str(),
+                "plan": plan,
+            }
+        )
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        return list(reversed(self.plans))
+
+
+class SqlMonitor:
+    """
+    SQL 执行监控: 每条语句都计入统计, 只有采样命中或超过慢查询阈值的语句才输出日志.
+    超过 EXPLAIN 阈值的语句会异步采集执行计划
+    """
+
+    def __init__(self, sample_rate: float, slow_ms: float, max_entries: int, plans: PlanCapture):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.stats = QueryStats(max_entries=max_entries)
+        self.plans = plans
+
+    def on_query(
+        self, statement: str, parameters: Any, elapsed_ms: float, rowcount: int, engine: AsyncEngine | None = None
+    ):
+        fp = fingerprint(statement)
+        if fp is None:
+            return
+        self.stats.record(fp, elapsed_ms, rowcount)
+        self.plans.maybe_capture(engine, fp, statement, parameters, elapsed_ms)
+
+        if elapsed_ms >= self.slow_ms:
+            level = "WARNING"
+        elif self.sample_rate and random.random() < self.sample_rate:
+            level = "DEBUG"
+        else:
+            return
+        # 参数可能是很长的批量数据, 只有日志真正输出时才格式化
+        logger.opt(lazy=True).log(
+            level,
+            "SQL[{:.2f}ms] Rows[{}] => {} | Params => {}",
+            lambda: elapsed_ms,
+            lambda: rowcount,
+            lambda: statement,
+            lambda: _truncate(repr(parameters)),
+        )
+
+
+# 获取连接等待耗时直方图的分桶上限(毫秒)
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolStats:
+    """连接池获取连接的等待耗时直方图与超时次数"""
+
+    def __init__(self):
+        self.waits = 0
+        self.wait_total_ms = 0.0
+        self.timeouts = 0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record_wait(self, elapsed_ms: float):
+        self.waits += 1
+        self.wait_total_ms += elapsed_ms
+        self.buckets[bisect.bisect_left(WAIT_BUCKETS_MS, elapsed_ms)] += 1
+
+    def record_timeout(self):
+        self.timeouts += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        labels = [f"<={b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+        return {
+            "waits": self.waits,
+            "wait_total_ms": round(self.wait_total_ms, 3),
+            "timeouts": self.timeouts,
+            "wait_histogram": dict(zip(labels, self.buckets, strict=True)),
+        }
+
+
+def _truncate(text: str, limit: int = 1000) -> str:
+    return text if len(text) <= limit else f"{text[:limit]}...({len(text)} chars)"
+
+
+sql_monitor = SqlMonitor(
+    sample_rate=settings.log.sql_sample_rate,
+    slow_ms=settings.log.sql_slow_ms,
+    max_entries=settings.log.sql_stats_size,
+    plans=PlanCapture(
+        threshold_ms=settings.log.sql_explain_ms,
+        interval_s=settings.log.sql_explain_interval,
+        buffer_size=settings.log.sql_plan_size,
+    ),
+)
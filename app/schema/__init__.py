@@ -4,11 +4,17 @@ __date__ = 2024-10-20
 __version__ = 0.0.1
 __description__ = 表单及响应模型基类
 """
-from typing import Any
+from datetime import datetime
+from decimal import Decimal
+from typing import Annotated, Any, Self
 
-from pydantic import BaseModel, ConfigDict, alias_generators, field_serializer
+from pydantic import BaseModel, ConfigDict, PlainSerializer, alias_generators
 
-from app.utils.serials import custom_serializer
+from app.utils.serials import app_json_encoders, build_schema
+
+# 带序列化器的日期时间与数值类型, 其它类型的字段直接由 pydantic-core 序列化
+DatetimeField = Annotated[datetime, PlainSerializer(app_json_encoders[datetime], return_type=str)]
+DecimalField = Annotated[Decimal, PlainSerializer(app_json_encoders[Decimal], return_type=float)]
 
 
 class BaseSchema(BaseModel):
@@ -19,12 +25,13 @@ class BaseSchema(BaseModel):
         alias_generator=alias_generators.to_camel,
         from_attributes=True,
         populate_by_name=True,
-        arbitrary_types_allowed=True
+        arbitrary_types_allowed=True,
+        # 校验器与序列化器在第一次使用时才编译, 减少导入与 worker 启动耗时
+        defer_build=True,
     )
 
-    @field_serializer('*')
-    def serialize_dt(self, item: Any, _info):
-        return custom_serializer(item)
-
-
-
+    @classmethod
+    def model_construct(cls, _fields_set: set[str] | None = None, **values: Any) -> Self:
+        # 跳过校验构造的实例不会触发编译, 需要先编译才能序列化
+        build_schema(cls)
+        return super().model_construct(_fields_set, **values)
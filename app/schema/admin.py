@@ -0,0 +1,67 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-20
+__version__ = 0.0.1
+__description__ = 运维监控相关的响应模型
+"""
+
+from typing import Any
+
+from app.schema import BaseSchema
+
+
+class SqlStatSchema(BaseSchema):
+    fingerprint: str
+    calls: int
+    total_ms: float
+    mean_ms: float
+    p50_ms: float
+    p99_ms: float
+    max_ms: float
+    rows: int
+
+
+class SqlPlanSchema(BaseSchema):
+    fingerprint: str
+    statement: str
+    elapsed_ms: float
+    captured_at: str
+    plan: Any
+
+
+class ResultCacheStatSchema(BaseSchema):
+    table: str
+    hits: int
+    misses: int
+    skipped: int
+    bypassed: int
+    errors: int
+
+
+class ApiCacheStatSchema(BaseSchema):
+    hits: int = 0
+    misses: int = 0
+    stale_served: int = 0
+    coalesced: int = 0
+    coalesced_remote: int = 0
+    refreshes: int = 0
+
+
+class SchemaBuildSchema(BaseSchema):
+    name: str
+    table: str
+    build_ms: float
+    reused: int
+    built: bool
+
+
+class PoolStatSchema(BaseSchema):
+    name: str
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    waits: int
+    wait_total_ms: float
+    timeouts: int
+    wait_histogram: dict[str, int]
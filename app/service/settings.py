@@ -5,13 +5,16 @@ __version__ = 0.0.1
 __description__ = settings service
 """
 
-from collections.abc import Sequence
+from collections.abc import AsyncIterator, Sequence
 from typing import Annotated
 
 from fastapi import Depends
 
+from app.dao import STREAM_FETCH_SIZE
 from app.dao.settings import SettingsDao
+from app.db import AsyncSessionLocal, read_session
 from app.schema.settings import SettingsSchema
+from app.utils.metas import tables_to_schemas
 
 
 class SettingsService:
@@ -22,4 +25,11 @@ class SettingsService:
 
     async def get_all(self) -> Sequence[SettingsSchema]:
         settings = await self.settings_dao.get_all()
-        return [SettingsSchema.model_validate(st) for st in settings]
+        return tables_to_schemas(settings, SettingsSchema, exclude_none=False, trusted=True)
+
+    @staticmethod
+    async def stream_all(fetch_size: int = STREAM_FETCH_SIZE) -> AsyncIterator[SettingsSchema]:
+        # 依赖注入的 session 在响应发送前就会关闭, 流式输出需要使用独立的 session
+        async with AsyncSessionLocal() as db, read_session(db) as read_db:
+            async for st in SettingsDao(db, read_db).stream(fetch_size=fetch_size):
+                yield SettingsSchema.model_validate(st)
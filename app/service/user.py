@@ -5,13 +5,16 @@ __version__ = 0.0.1
 __description__ = 逻辑处理层
 """
 
-from collections.abc import Sequence
+from collections.abc import AsyncIterator, Sequence
 from typing import Annotated
 
 from fastapi import Depends
 
+from app.dao import STREAM_FETCH_SIZE
 from app.dao.user import UserDao
+from app.db import AsyncSessionLocal, read_session
 from app.schema.user import UserSchema, UserSimple
+from app.utils.metas import tables_to_schemas
 
 
 class UserService:
@@ -26,9 +29,16 @@ class UserService:
 
     async def get_all(self) -> Sequence[UserSchema]:
         users = await self.user_dao.get_all()
-        # 类型转换 table => schema
-        return [UserSchema.model_validate(user) for user in users]
+        # 类型转换 table => schema, 数据来自数据库, 跳过校验
+        return tables_to_schemas(users, UserSchema, exclude_none=False, trusted=True)
 
     async def get_all_simple(self):
-        users = await self.user_dao.get_all()
-        return [UserSimple.model_validate(user) for user in users]
+        # 只查询 UserSimple 需要的列
+        return await self.user_dao.get_all(schema=UserSimple)
+
+    @staticmethod
+    async def stream_all(fetch_size: int = STREAM_FETCH_SIZE) -> AsyncIterator[UserSchema]:
+        # 依赖注入的 session 在响应发送前就会关闭, 流式输出需要使用独立的 session
+        async with AsyncSessionLocal() as db, read_session(db) as read_db:
+            async for user in UserDao(db, read_db).stream(fetch_size=fetch_size):
+                yield UserSchema.model_validate(user)
@@ -6,12 +6,17 @@ __description__ = 读取配置文件
 """
 
 import os
+from collections.abc import Callable, Mapping
+from datetime import date, datetime
+from decimal import Decimal
 from pathlib import Path
+from types import MappingProxyType
 from typing import Any
 
 from dotenv import load_dotenv
-from pydantic import BaseModel, ValidationError
-from pydantic_settings import BaseSettings
+from pydantic import BaseModel, ValidationError, field_validator
+
+from app.utils.serials import loads_json
 
 APP_NAME = "API-BASE"
 DIR_APP_ROOT = Path(__file__).parent.parent
@@ -29,6 +34,21 @@ class DatabaseConfig(BaseModel):
     db: str
     pool_size: int = 10
     use_async: bool = False
+    # 只读副本的完整连接 URL, 环境变量中多个 URL 以逗号分隔
+    replica_urls: list[str] = []
+    # 写入后在该时间窗口(秒)内的读操作仍然走主库
+    replica_sticky_seconds: float = 5
+    # 副本健康检查间隔(秒)
+    replica_check_interval: int = 10
+    # 启动时预先建立的连接数(主库与每个副本)
+    warmup_size: int = 5
+
+    @field_validator("replica_urls", mode="before")
+    @classmethod
+    def split_replica_urls(cls, value: Any) -> Any:
+        if isinstance(value, str):
+            return [url.strip() for url in value.split(",") if url.strip()]
+        return value
 
     def build_url(self) -> str:
         """生成数据库连接 URL（支持主流关系型数据库）"""
@@ -76,6 +96,12 @@ class RedisConfig(BaseModel):
     password: str | None
     db: int = 0
     pool_size: int = 10
+    # 启动时预先建立的连接数
+    warmup_size: int = 5
+    # 后台健康检查间隔(秒), 同时也是单次检查的超时时间
+    breaker_check_interval: float = 2
+    # 连续失败多少次后熔断
+    breaker_threshold: int = 3
 
     def build_url(self) -> str:
         return f"redis://{self.host}:{self.port}/{self.db}"
@@ -86,6 +112,53 @@ class LogConfig(BaseModel):
     level: str = "INFO"
     base_dir: str = f"{DIR_LOG}"
     keep_days: int = 7
+    # SQL 日志采样比例(0~1), 0 表示只输出慢查询
+    sql_sample_rate: float = 0.0
+    # 慢查询阈值(毫秒), 超过后一定输出日志
+    sql_slow_ms: float = 200
+    # 每个 worker 最多保留多少个 SQL 指纹的统计
+    sql_stats_size: int = 500
+    # 超过该耗时(毫秒)的语句自动采集执行计划, 0 表示不采集
+    sql_explain_ms: float = 0
+    # 同一 SQL 指纹两次采集执行计划的最小间隔(秒)
+    sql_explain_interval: float = 600
+    # 最多保留多少条执行计划
+    sql_plan_size: int = 100
+
+
+class AdminConfig(BaseModel):
+    # 运维监控接口的访问密钥, 为空时这些接口不可用
+    api_key: str | None = None
+    # 传递访问密钥的请求头
+    key_header: str = "x-admin-key"
+
+
+class CacheConfig(BaseModel):
+    # fastapi-cache2 的 key 前缀
+    prefix: str = "api-cache"
+    # 接口缓存默认过期时间(秒)
+    expire: int = 300
+    # 接口缓存过期后仍可返回旧值的时间(秒), 0 表示不返回旧值
+    stale_ttl: int = 0
+    # 接口缓存超过多少字节后压缩保存
+    compress_min_bytes: int = 1024
+    # 接口缓存的压缩方式: zlib 或 lzma
+    compress_codec: str = "zlib"
+    # 参与生成接口缓存 key 的请求头, 逗号分隔, 如: accept-language
+    vary_headers: list[str] = []
+    # 进程内缓存的最大字节数
+    local_max_bytes: int = 32 * 1024 * 1024
+    # 进程内缓存的最长过期时间(秒), 不会超过 redis 中的剩余过期时间
+    local_ttl: int = 60
+    # 业务配置版本号的检查间隔(秒)
+    biz_refresh_interval: float = 5
+
+    @field_validator("vary_headers", mode="before")
+    @classmethod
+    def split_vary_headers(cls, value: Any) -> Any:
+        if isinstance(value, str):
+            return [header.strip().lower() for header in value.split(",") if header.strip()]
+        return value
 
 
 # --------------------------
@@ -110,6 +183,8 @@ class AppSettings:
         self.database: DatabaseConfig
         self.redis: RedisConfig
         self.log: LogConfig
+        self.cache: CacheConfig
+        self.admin: AdminConfig
 
         self.extra: dict[str, str] = {}
 
@@ -158,8 +233,22 @@ class AppSettings:
         except ValidationError as e:
             raise ValueError(f"Invalid log config: {e}") from e
 
+        # 解析 Cache 配置
+        cache_vars = self._extract_vars(env_vars, prefix="cache_")
+        try:
+            self.cache = CacheConfig(**cache_vars)
+        except ValidationError as e:
+            raise ValueError(f"Invalid cache config: {e}") from e
+
+        # 解析 Admin 配置
+        admin_vars = self._extract_vars(env_vars, prefix="admin_")
+        try:
+            self.admin = AdminConfig(**admin_vars)
+        except ValidationError as e:
+            raise ValueError(f"Invalid admin config: {e}") from e
+
         # 存储其他配置项
-        exclude_prefix = ("database_", "redis_", "log_")
+        exclude_prefix = ("database_", "redis_", "log_", "cache_", "admin_")
         self.extra = {k: v for k, v in env_vars.items() if not k.startswith(exclude_prefix)}
 
     @staticmethod
@@ -181,6 +270,9 @@ class AppSettings:
         print(f"\n{' Log Config ':~^40}")
         print(self.log.model_dump_json())
 
+        print(f"\n{' Cache Config ':~^40}")
+        print(self.cache.model_dump_json())
+
         print(f"\n{' Extra Config ':~^40}")
         for k, v in self.extra.items():
             print(f"{k}: {v}")
@@ -191,23 +283,88 @@ if __name__ == "__main__":
     settings.show_config()
 
 
-class BizSettings(BaseSettings):
+def _to_bool(value: str) -> bool:
+    text = value.strip().lower()
+    if text in ("1", "true", "yes", "on", "y"):
+        return True
+    if text in ("0", "false", "no", "off", "n", ""):
+        return False
+    raise ValueError(f"invalid bool: {value!r}")
+
+
+# value_type => 把字符串形式的配置值转换为对应类型
+BIZ_VALUE_DECODERS: dict[str, Callable[[str], Any]] = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "decimal": Decimal,
+    "bool": _to_bool,
+    "json": loads_json,
+    "list": lambda value: [item.strip() for item in value.split(",") if item.strip()],
+    "date": date.fromisoformat,
+    "datetime": datetime.fromisoformat,
+}
+
+
+def decode_biz_value(value: str | None, value_type: str | None, value_bundle: Any = None) -> Any:
     """
-    业务配置. 从数据库中读取后按module 放到不同的模块变量中
+        按 value_type 转换配置值, 并按 value_bundle 校验:
+        value_bundle 为列表时表示可选值, 为字典时支持 min/max 范围
+    :param value: 数据库中的配置值
+    :param value_type: 配置值类型, 为空时按字符串处理
+    :param value_bundle: 配置值约束
+    :return:
     """
+    if value is None:
+        return None
+    decoder = BIZ_VALUE_DECODERS.get((value_type or "str").lower())
+    if decoder is None:
+        raise ValueError(f"unknown value_type: {value_type!r}")
+    decoded = decoder(value)
+
+    if isinstance(value_bundle, list) and value_bundle and decoded not in value_bundle:
+        raise ValueError(f"{decoded!r} not in {value_bundle!r}")
+    if isinstance(value_bundle, dict):
+        low, high = value_bundle.get("min"), value_bundle.get("max")
+        if low is not None and decoded < type(decoded)(low):
+            raise ValueError(f"{decoded!r} < min {low!r}")
+        if high is not None and decoded > type(decoded)(high):
+            raise ValueError(f"{decoded!r} > max {high!r}")
+    return decoded
+
+
+class BizSettings:
+    """
+    业务配置. 启动时从 sys_settings 加载已激活的配置, 转换类型后保存为只读快照, 按 (module, key) 读取.
+    配置变更后整体替换快照, 读取过程没有任何 IO
+    """
+
+    def __init__(self):
+        self.version: str | None = None
+        # 是否已经加载过快照. redis 中的版本号不存在(新部署或被清空)时为 None, 不能用 version 判断
+        self.loaded = False
+        self._values: Mapping[tuple[str, str], Any] = MappingProxyType({})
+        self._modules: Mapping[str, Mapping[str, Any]] = MappingProxyType({})
 
-    pk_cache_ns: str = "public:settings"
-    mod_keyword: str = "__mod__"
+    def get(self, module: str, key: str, default: Any = None) -> Any:
+        return self._values.get((module, key), default)
 
-    __mod__api: dict[str, Any] = {}
-    __mod__user: dict[str, Any] = {}
+    def module(self, module: str) -> Mapping[str, Any]:
+        """获取某个模块下的所有配置"""
+        return self._modules.get(module, MappingProxyType({}))
 
     def get_module_names(self) -> list[str]:
-        return [
-            name.replace(self.mod_keyword, "").upper()
-            for name, _ in self.model_fields
-            if name.startswith(self.mod_keyword)
-        ]
+        return list(self._modules)
+
+    def swap(self, values: dict[tuple[str, str], Any], version: str | None):
+        """用新的配置替换当前快照"""
+        modules: dict[str, dict[str, Any]] = {}
+        for (module, key), value in values.items():
+            modules.setdefault(module, {})[key] = value
+        self._values = MappingProxyType(values)
+        self._modules = MappingProxyType({name: MappingProxyType(items) for name, items in modules.items()})
+        self.version = version
+        self.loaded = True
 
 
 biz_settings = BizSettings()
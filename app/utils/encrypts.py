@@ -15,3 +15,9 @@ def hash_md5(text: int | str) -> str:
     if isinstance(text, int):
         _text = str(text)
     return hashlib.md5(_text.encode(STD_UTF8)).hexdigest()
+
+
+def hash_blake2b(data: str | bytes, digest_size: int = 16) -> str:
+    if isinstance(data, str):
+        data = data.encode(STD_UTF8)
+    return hashlib.blake2b(data, digest_size=digest_size).hexdigest()
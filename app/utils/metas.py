@@ -5,27 +5,32 @@ __version__ = 0.0.1
 __description__ = schema 与model 的处理工具
 """
 
-from typing import Any, Callable, Optional, Set, Type, Union, get_args, get_origin
+import time
+from collections.abc import Callable, Iterable, Sequence
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Optional, Union, get_args, get_origin
 
 from pydantic import BaseModel, create_model, field_validator
 from pydantic.alias_generators import to_snake
 from pydantic.fields import FieldInfo
-from sqlalchemy import inspect as sa_inspect
 from sqlalchemy.orm import InstrumentedAttribute
 
-from app.ctx import T_TABLE
-from app.model import BaseTable
-from app.schema import BaseSchema
-from app.utils.serials import dumps_json
+from app.ctx import T_SCHEMA, T_TABLE
+from app.model import BaseTable, table_meta
+from app.schema import BaseSchema, DatetimeField, DecimalField
+from app.utils.serials import build_schema
 
 
 def schema_to_dict(
     schema: BaseSchema,
-    table_cls: Type[BaseTable],
+    table_cls: type[BaseTable],
     /,
     exclude_none: bool = True,
-    exclude: Set[str] | None = None,
-    include: Set[str] | None = None,
+    exclude: set[str] | None = None,
+    include: set[str] | None = None,
     extra: dict[str, Any] = None,
     mapping: dict[str, Callable[[Any], Any]] = None,
 ) -> dict[str, Any]:
@@ -47,25 +52,305 @@ def schema_to_dict(
     if mapping is None:
         mapping = {}
 
-    table_cols = [col.name for col in sa_inspect(table_cls).columns]
-    table_data = {
-        to_snake(k): mapping.get(k, mapping.get(to_snake(k)))(v) if (k in mapping or to_snake(k) in mapping) else v
-        for k, v in schema_data.items()
-        if to_snake(k) in table_cols
-    }
+    field_to_column = table_meta(table_cls).field_to_column
+    table_data = {}
+    for k, v in schema_data.items():
+        col = field_to_column.get(k)
+        if col is None:
+            # 不常见的命名形式(如大驼峰)再转换一次
+            col = field_to_column.get(to_snake(k))
+            if col is None:
+                continue
+        func = mapping.get(k, mapping.get(col))
+        table_data[col] = func(v) if func is not None else v
 
     return table_data
 
 
+def _resolve_column(field_to_column: dict[str, str], key: str) -> str | None:
+    col = field_to_column.get(key)
+    if col is None:
+        col = field_to_column.get(to_snake(key))
+    return col
+
+
+@dataclass(frozen=True, slots=True)
+class SchemaConverter:
+    """
+    预先编译好的 schema => 表数据的转换计划: 每个字段对应的列与映射函数只计算一次,
+    转换时直接读取 schema 的属性值(不经过 model_dump 与序列化器), 得到可以直接写入数据库的原始类型
+    """
+
+    # (schema 字段名, 列名, 映射函数)
+    items: tuple[tuple[str, str, Callable[[Any], Any] | None], ...]
+    field_to_column: dict[str, str]
+    mapping: dict[str, Callable[[Any], Any]]
+
+    @property
+    def columns(self) -> tuple[str, ...]:
+        return tuple(col for _, col, _ in self.items)
+
+    def _extra_row(self, extra: dict[str, Any] | None) -> dict[str, Any]:
+        """extra 中的 key 同样转换为列名并应用映射函数, 表中不存在的 key 忽略"""
+        row = {}
+        for k, v in (extra or {}).items():
+            col = _resolve_column(self.field_to_column, k)
+            if col is None:
+                continue
+            func = self.mapping.get(k, self.mapping.get(col))
+            row[col] = func(v) if func is not None else v
+        return row
+
+    def _batch_items(
+        self, schemas: Sequence[BaseModel], exclude_unset: bool, exclude_none: bool, extra_row: dict[str, Any]
+    ) -> list[tuple[str, str, Callable[[Any], Any] | None]]:
+        """
+        计算本批次需要写入的列. 批量写入时每行的 key 需要一致, 因此按整个批次判断:
+        exclude_unset 只保留至少一行显式设置过的字段, exclude_none 排除在所有行中都为 None 的字段,
+        未写入的列交给数据库默认值处理, 冲突更新时也不会被 None 覆盖
+        """
+        items = [item for item in self.items if item[1] not in extra_row]
+        if exclude_unset:
+            fields_set = set().union(*(schema.model_fields_set for schema in schemas))
+            items = [item for item in items if item[0] in fields_set]
+        if exclude_none:
+            items = [item for item in items if any(getattr(schema, item[0]) is not None for schema in schemas)]
+        return items
+
+    def to_rows(
+        self,
+        schemas: Sequence[BaseModel],
+        exclude_unset: bool = True,
+        exclude_none: bool = False,
+        extra: dict[str, Any] = None,
+    ) -> list[dict[str, Any]]:
+        """
+            批量转换为行数据, 每行的 key 保持一致
+        :param schemas: 表单实例列表
+        :param exclude_unset: 是否排除在所有行中都未显式设置的字段
+        :param exclude_none: 是否排除在所有行中都为 None 的字段
+        :param extra: 每行都附加的其它数据, 会覆盖 schema 中的同名字段
+        :return:
+        """
+        extra_row = self._extra_row(extra)
+        items = self._batch_items(schemas, exclude_unset, exclude_none, extra_row)
+        rows = []
+        for schema in schemas:
+            row = {}
+            for field, col, func in items:
+                value = getattr(schema, field)
+                row[col] = func(value) if func is not None else value
+            if extra_row:
+                row.update(extra_row)
+            rows.append(row)
+        return rows
+
+    def to_columns(
+        self,
+        schemas: Sequence[BaseModel],
+        exclude_unset: bool = True,
+        exclude_none: bool = False,
+        extra: dict[str, Any] = None,
+    ) -> dict[str, list[Any]]:
+        """
+            批量转换为按列存放的数组: {列名: [每行的值]}, 可以直接用于 COPY 等按列写入的场景
+        :param schemas: 表单实例列表
+        :param exclude_unset: 是否排除在所有行中都未显式设置的字段
+        :param exclude_none: 是否排除在所有行中都为 None 的字段
+        :param extra: 每行都附加的其它数据, 会覆盖 schema 中的同名字段
+        :return:
+        """
+        extra_row = self._extra_row(extra)
+        data: dict[str, list[Any]] = {}
+        for field, col, func in self._batch_items(schemas, exclude_unset, exclude_none, extra_row):
+            if func is None:
+                data[col] = [getattr(schema, field) for schema in schemas]
+            else:
+                data[col] = [func(getattr(schema, field)) for schema in schemas]
+        for col, value in extra_row.items():
+            data[col] = [value] * len(schemas)
+        return data
+
+
+def _build_schema_converter(
+    schema_cls: type[BaseModel],
+    table_cls: type[BaseTable],
+    exclude: frozenset[str] | None,
+    include: frozenset[str] | None,
+    mapping: dict[str, Callable[[Any], Any]],
+) -> SchemaConverter:
+    field_to_column = table_meta(table_cls).field_to_column
+    items = []
+    for field in schema_cls.model_fields:
+        if (exclude and field in exclude) or (include and field not in include):
+            continue
+        col = _resolve_column(field_to_column, field)
+        if col is None:
+            continue
+        items.append((field, col, mapping.get(field, mapping.get(col))))
+    return SchemaConverter(items=tuple(items), field_to_column=field_to_column, mapping=mapping)
+
+
+@lru_cache(maxsize=256)
+def _cached_schema_converter(
+    schema_cls: type[BaseModel],
+    table_cls: type[BaseTable],
+    exclude: frozenset[str] | None,
+    include: frozenset[str] | None,
+) -> SchemaConverter:
+    return _build_schema_converter(schema_cls, table_cls, exclude, include, {})
+
+
+def compile_schema_converter(
+    schema_cls: type[BaseModel],
+    table_cls: type[BaseTable],
+    /,
+    exclude: set[str] | None = None,
+    include: set[str] | None = None,
+    mapping: dict[str, Callable[[Any], Any]] = None,
+) -> SchemaConverter:
+    """
+        编译 schema 到表数据的转换计划. 不带 mapping 时按参数缓存(有上限);
+        mapping 中的函数往往是临时创建的, 作为缓存 key 只会让缓存无限增长, 因此带 mapping 时每次重新编译
+    :param schema_cls: 表单类型
+    :param table_cls: 数据库表类型
+    :param exclude: 需要排除的字段
+    :param include: 需要包含的字段
+    :param mapping: 对指定的key进行映射转换
+    :return:
+    """
+    exclude = frozenset(exclude) if exclude else None
+    include = frozenset(include) if include else None
+    if mapping:
+        return _build_schema_converter(schema_cls, table_cls, exclude, include, mapping)
+    return _cached_schema_converter(schema_cls, table_cls, exclude, include)
+
+
+def schemas_to_dicts(
+    schemas: Sequence[BaseModel],
+    table_cls: type[BaseTable],
+    /,
+    exclude_unset: bool = True,
+    exclude_none: bool = False,
+    exclude: set[str] | None = None,
+    include: set[str] | None = None,
+    extra: dict[str, Any] = None,
+    mapping: dict[str, Callable[[Any], Any]] = None,
+) -> list[dict[str, Any]]:
+    """
+        批量将schema 转换为table 匹配的字典项, 用于批量写入. 批量写入时每行的 key 需要一致,
+        因此 exclude_unset/exclude_none 按整个批次判断, 见 SchemaConverter.to_rows
+    :return: 匹配table 类型的 dict 列表
+    """
+    if not schemas:
+        return []
+    converter = compile_schema_converter(type(schemas[0]), table_cls, exclude=exclude, include=include, mapping=mapping)
+    return converter.to_rows(schemas, exclude_unset=exclude_unset, exclude_none=exclude_none, extra=extra)
+
+
+def _column_names(fields: list[str | InstrumentedAttribute] | None) -> set[str]:
+    return {f.name if isinstance(f, InstrumentedAttribute) else f for f in fields or ()}
+
+
+def _trusted_constructor(schema: type[T_SCHEMA]) -> Callable[[dict[str, Any]], T_SCHEMA]:
+    """
+    可信数据的构造函数: 直接设置实例的 __dict__, 比 model_construct 少了逐个字段的别名与默认值处理.
+    有私有属性、默认值工厂或可变默认值的 schema 仍使用 model_construct
+    """
+    # 直接构造的实例需要已编译的序列化器
+    fields = build_schema(schema).model_fields
+    # 可变的默认值需要为每个实例复制一份, 同样交给 model_construct
+    if schema.__private_attributes__ or any(
+        f.default_factory is not None or isinstance(f.default, list | dict | set) for f in fields.values()
+    ):
+        return lambda data: schema.model_construct(**data)
+
+    defaults = {name: f.default for name, f in fields.items() if not f.is_required()}
+    new = schema.__new__
+    set_attr = object.__setattr__
+
+    def construct(data: dict[str, Any]) -> T_SCHEMA:
+        fields_set = set(data)
+        if not fields_set.issubset(fields):
+            data = {k: v for k, v in data.items() if k in fields}
+            fields_set = set(data)
+        obj = new(schema)
+        if len(data) != len(fields):
+            # 补上缺少字段的默认值, 并保持字段顺序(序列化输出的顺序与 __dict__ 一致)
+            data = {
+                name: data[name] if name in data else defaults[name]
+                for name in fields
+                if name in data or name in defaults
+            }
+        set_attr(obj, "__dict__", data)
+        set_attr(obj, "__pydantic_fields_set__", fields_set)
+        set_attr(obj, "__pydantic_extra__", None)
+        set_attr(obj, "__pydantic_private__", None)
+        return obj
+
+    return construct
+
+
+def tables_to_schemas(
+    rows: Iterable[BaseTable],
+    schema: type[T_SCHEMA],
+    /,
+    exclude_none: bool = True,
+    exclude: list[str | InstrumentedAttribute] = None,
+    include: list[str | InstrumentedAttribute] = None,
+    extra: dict[str, Any] = None,
+    trusted: bool = False,
+) -> list[T_SCHEMA]:
+    """
+        批量转换model数据到指定的schema类型. 字段、排除与包含列表在每次调用中只解析一次,
+        直接从实体属性构建 schema, 不经过 json 序列化与解析
+    :param rows: 数据库模型实体列表
+    :param schema: pydantic 模型
+    :param exclude_none:是否去除none
+    :param exclude: 排除字段
+    :param include: 包含字段
+    :param extra: 附加数据(key必须是schema已有的字段,否则会报错)
+    :param trusted: 数据是否可信(如刚从数据库读取), 可信时跳过校验直接构造实例
+    :return:
+    """
+    fields = list(schema.model_fields)
+    if exclude and any(exclude):
+        exclude_names = _column_names(exclude)
+        fields = [f for f in fields if f not in exclude_names]
+    if include and any(include):
+        include_names = _column_names(include)
+        fields = [f for f in fields if f in include_names]
+
+    construct = _trusted_constructor(schema) if trusted else schema.model_validate
+    # 实体类型 => 该类型上存在的字段
+    fields_by_type: dict[type, list[str]] = {}
+    result = []
+    for row in rows:
+        row_fields = fields_by_type.get(type(row))
+        if row_fields is None:
+            row_fields = fields_by_type[type(row)] = [f for f in fields if hasattr(type(row), f)]
+
+        data = {}
+        for field in row_fields:
+            value = getattr(row, field)
+            if exclude_none and value is None:
+                continue
+            data[field] = value
+        if extra:
+            data.update(extra)
+        result.append(construct(data))
+    return result
+
+
 def table_to_schema(
     instance: BaseTable,
-    schema: Type[BaseModel],
+    schema: type[T_SCHEMA],
     /,
     exclude_none: bool = True,
     exclude: list[str | InstrumentedAttribute] = None,
     include: list[str | InstrumentedAttribute] = None,
     extra: dict[str, Any] = None,
-) -> BaseModel:
+) -> T_SCHEMA:
     """
         转换model数据到指定的schema类型
     :param instance: 数据库模型实体
@@ -76,38 +361,78 @@ def table_to_schema(
     :param extra: 附加数据(key必须是schema已有的字段,否则会报错)
     :return:
     """
-    data = {}
-    for field in schema.model_fields:
-        if hasattr(instance, field):
-            value = getattr(instance, field)
-            if exclude_none and value is None:
-                continue
-            data[field] = value
+    return tables_to_schemas(
+        [instance], schema, exclude_none=exclude_none, exclude=exclude, include=include, extra=extra
+    )[0]
 
-    if exclude and any(exclude):
-        exclude = list(map(lambda f: f.name if isinstance(f, InstrumentedAttribute) else f, exclude))
-        data = dict(filter(lambda item: item[0] not in exclude, data.items()))
 
-    if include and any(include):
-        include = list(map(lambda f: f.name if isinstance(f, InstrumentedAttribute) else f, include))
-        data = dict(filter(lambda item: item[0] in include, data.items()))
+# 需要自定义序列化的类型 => 带序列化器的注解类型
+SERIALIZED_TYPES: dict[type, Any] = {datetime: DatetimeField, Decimal: DecimalField}
+
+
+def _field_type(py_type: type) -> Any:
+    """按 MRO 把列的 python 类型替换为带序列化器的注解类型, 其它类型原样返回"""
+    return next((SERIALIZED_TYPES[base] for base in py_type.__mro__ if base in SERIALIZED_TYPES), py_type)
+
+
+@dataclass(slots=True)
+class SchemaEntry:
+    """create_schema 创建的 schema 及其创建耗时"""
+
+    schema: type[BaseModel]
+    table: str
+    build_ms: float
+    # 相同参数再次调用时直接复用的次数
+    reused: int = 0
 
-    if extra:
-        data.update(extra)
 
-    return schema.model_validate_json(dumps_json(data))
+# (表, 包含列, 排除列, 校验函数, 合并的schema) => 已创建的 schema
+_SCHEMA_REGISTRY: dict[tuple, SchemaEntry] = {}
+
+
+def _registry_key(
+    cls_table: type[T_TABLE],
+    include: list[str | InstrumentedAttribute] | None,
+    exclude: list[str | InstrumentedAttribute] | None,
+    validators: dict[str | InstrumentedAttribute, Callable] | None,
+    other_schemas: list[type[BaseModel]] | None,
+) -> tuple:
+    return (
+        cls_table,
+        frozenset(_column_names(include)) if include and any(include) else None,
+        frozenset(_column_names(exclude)) if exclude and any(exclude) else None,
+        frozenset((_column_names([name]).pop(), func) for name, func in (validators or {}).items()),
+        tuple(other_schemas or ()),
+    )
+
+
+def schema_registry_report() -> list[dict[str, Any]]:
+    """
+    create_schema 的耗时报告. 创建时只生成模型类, 校验器在第一次使用时才编译(defer_build),
+    built 表示是否已经编译
+    """
+    return [
+        {
+            "name": entry.schema.__name__,
+            "table": entry.table,
+            "build_ms": round(entry.build_ms, 3),
+            "reused": entry.reused,
+            "built": entry.schema.__pydantic_complete__,
+        }
+        for entry in _SCHEMA_REGISTRY.values()
+    ]
 
 
 def create_schema(
-    cls_table: Type[T_TABLE],
+    cls_table: type[T_TABLE],
     *,
     include: list[str | InstrumentedAttribute] = None,
     exclude: list[str | InstrumentedAttribute] = None,
     validators: dict[str | InstrumentedAttribute, Callable] = None,
-    other_schemas: list[Type[BaseModel]] = None,
-) -> Type[BaseModel]:
+    other_schemas: list[type[BaseModel]] = None,
+) -> type[BaseModel]:
     """
-        根据sqlalchemy模型动态创建pydantic模型
+        根据sqlalchemy模型动态创建pydantic模型. 相同参数的调用返回同一个模型
     :param cls_table: 数据库模型
     :param include: 包含哪些字段(如果同时出现在排除列表中, 就不会被包含到最终结果)
     :param exclude: 排除哪些字段(先排除再包含)
@@ -115,7 +440,31 @@ def create_schema(
     :param other_schemas: 与自定义的schema进行合并
     :return:
     """
-    model_columns = sa_inspect(cls_table).columns
+    key = _registry_key(cls_table, include, exclude, validators, other_schemas)
+    entry = _SCHEMA_REGISTRY.get(key)
+    if entry is not None:
+        entry.reused += 1
+        return entry.schema
+
+    start = time.perf_counter()
+    schema = _build_schema(
+        cls_table, include=include, exclude=exclude, validators=validators, other_schemas=other_schemas
+    )
+    _SCHEMA_REGISTRY[key] = SchemaEntry(
+        schema=schema, table=cls_table.__tablename__, build_ms=(time.perf_counter() - start) * 1000
+    )
+    return schema
+
+
+def _build_schema(
+    cls_table: type[T_TABLE],
+    *,
+    include: list[str | InstrumentedAttribute] = None,
+    exclude: list[str | InstrumentedAttribute] = None,
+    validators: dict[str | InstrumentedAttribute, Callable] = None,
+    other_schemas: list[type[BaseModel]] = None,
+) -> type[BaseModel]:
+    model_columns = table_meta(cls_table).columns
     # 去除数据库模型命名的前缀tab
     model_name = cls_table.__name__
     if model_name[0:3] == "Tab":
@@ -133,7 +482,8 @@ def create_schema(
     schema_fields = {}
     for col in model_columns:
         # 是否为必填项取决于table 是否可空 或 没有默认值
-        py_type = Optional[col.type.python_type] if (col.nullable or col.default is not None) else col.type.python_type
+        col_type = _field_type(col.type.python_type)
+        py_type = Optional[col_type] if (col.nullable or col.default is not None) else col_type
         default = None if is_optional_type(py_type) else ...
         desc = col.comment if col.comment else None
         schema_fields[col.name] = (py_type, FieldInfo(default=default, description=desc))
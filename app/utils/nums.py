@@ -5,16 +5,27 @@ __version__ = 0.0.1
 __description__ = 
 """
 import re
+from collections.abc import Iterable
 from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
 
+# 正则表达式解释:
+# ^[-+]? : 可选的负号或正号
+# \d+ : 至少一个整数部分数字
+# (\.\d{1,5})?$ : 可选的小数点后跟 1 到 5 位小数数字
+_RE_NUMBER = re.compile(r"^[-+]?\d+(\.\d{1,5})?$")
 
-def is_valid_number(s: str) -> bool:
-    # 正则表达式解释:
-    # ^[-+]? : 可选的负号或正号
-    # \d+ : 至少一个整数部分数字
-    # (\.\d{1,5})?$ : 可选的小数点后跟 1 到 5 位小数数字
-    pattern = r"^[-+]?\d+(\.\d{1,5})?$"
-    return bool(re.match(pattern, s))
+
+def is_valid_number(s: str | Decimal | float | int) -> bool:
+    # 数值类型本身就是合法的数字, 只有字符串需要校验格式
+    if isinstance(s, Decimal | float | int):
+        return True
+    return bool(_RE_NUMBER.match(s))
+
+
+@lru_cache(maxsize=32)
+def _quantizer(digits: int) -> Decimal:
+    return Decimal(f"0.{'0' * digits}")
 
 
 def format_decimal(value: Decimal | str | float | int | None, digits: int = 2) -> Decimal:
@@ -22,10 +33,14 @@ def format_decimal(value: Decimal | str | float | int | None, digits: int = 2) -
         将value转换为decimal
     """
     if value is None or value == "":
-        return Decimal(0).quantize(Decimal(f"0.{'0' * digits}"), rounding=ROUND_HALF_UP)
+        return Decimal(0).quantize(_quantizer(digits), rounding=ROUND_HALF_UP)
+
+    # Decimal 是最常见的输入, 直接量化
+    if type(value) is Decimal:
+        return value.quantize(_quantizer(digits), rounding=ROUND_HALF_UP)
 
     if not is_valid_number(value):
-        raise ValueError("value[{value}] is not a valid number!")
+        raise ValueError(f"value[{value}] is not a valid number!")
 
     # 如果 value 已经是 Decimal 类型，直接使用
     if isinstance(value, Decimal):
@@ -37,4 +52,19 @@ def format_decimal(value: Decimal | str | float | int | None, digits: int = 2) -
         except ValueError:
             raise
 
-    return decimal_value.quantize(Decimal(f"0.{'0' * digits}"), rounding=ROUND_HALF_UP)
\ No newline at end of file
+    return decimal_value.quantize(_quantizer(digits), rounding=ROUND_HALF_UP)
+
+
+def format_decimals(values: Iterable[Decimal | str | float | int | None], digits: int = 2) -> list[Decimal | None]:
+    """批量转换一列数值为decimal, None 保持为 None"""
+    quantizer = _quantizer(digits)
+    result = []
+    for value in values:
+        if value is None:
+            result.append(None)
+        elif type(value) is Decimal:
+            # 与 format_decimal 相同, 只是量化因子在整列中复用
+            result.append(value.quantize(quantizer, rounding=ROUND_HALF_UP))
+        else:
+            result.append(format_decimal(value, digits))
+    return result
@@ -6,14 +6,10 @@ __description__ = web 请求
 """
 import time
 import uuid
-from typing import Optional
 
 import httpx
 from httpx import Auth
 from loguru import logger
-from ujson import JSONDecodeError
-
-from app.utils.serials import dumps_json
 
 
 class HttpxClient:
@@ -45,7 +41,8 @@ class HttpxClient:
         request.headers["start_time"] = str(time.time())  # 将开始时间存储在请求上下文中
         line = f"HttpxRequest[{trace_id}] => [{request.method}] | {request.url}"
         if request.content:
-            line += f" | {dumps_json(request.content.decode('utf-8'))}"
+            # 直接输出原始内容, 不再解析后重新序列化
+            line += f" | {request.content.decode('utf-8', errors='replace')}"
         logger.info(line)
 
     @staticmethod
@@ -57,16 +54,13 @@ class HttpxClient:
         if start_time:
             duration = time.time() - float(start_time)  # 计算耗时
 
-        # 有可能返回的是html无法被dumps
-        try:
-            resp_body = dumps_json(response.text)
-        except JSONDecodeError:
-            resp_body = response.text
-
-        logger.debug(f"HttpxResponse[{trace_id}] => [{response.status_code}] | {resp_body}")
+        # 只有 debug 日志真正输出时才读取响应内容
+        logger.opt(lazy=True).debug(
+            "HttpxResponse[{}] => [{}] | {}", lambda: trace_id, lambda: response.status_code, lambda: response.text
+        )
         logger.info(f"================Httpx[{trace_id}] Spend Time [{duration:.2f}S]=====================")
 
-    def get(self, url: str, params: Optional[dict] = None) -> httpx.Response:
+    def get(self, url: str, params: dict | None = None) -> httpx.Response:
         with httpx.Client(event_hooks=self._hooks, timeout=self._timeout) as client:
             return client.get(url, params=params)
 
@@ -74,7 +68,7 @@ class HttpxClient:
         with httpx.Client(event_hooks=self._hooks, timeout=self._timeout) as client:
             return client.post(url, json=data, auth=auth)
 
-    async def get_async(self, url: str, params: Optional[dict] = None) -> httpx.Response:
+    async def get_async(self, url: str, params: dict | None = None) -> httpx.Response:
         async with httpx.AsyncClient(event_hooks=self._hooks_async, timeout=self._timeout) as client:
             return await client.get(url, params=params)
 
@@ -4,14 +4,21 @@ __date__ = 2024-10-20
 __version__ = 0.0.1
 __description__ = 字符串处理相关的工具函数
 """
+import csv
+import io
 import re
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable, Sequence
 from datetime import datetime
 from decimal import Decimal
+from functools import lru_cache
+from typing import Any
 
 import ujson
+from pydantic import BaseModel
+from pydantic_core import to_json
 
-from app.utils.nums import format_decimal
-from app.utils.times import dt_to_str
+from app.utils.nums import format_decimal, format_decimals
+from app.utils.times import dt_to_str, dts_to_str
 
 
 # ===========================String===========================
@@ -34,16 +41,31 @@ app_json_encoders = {
 }
 
 
+_encoder_types = tuple(app_json_encoders)
+
+
+@lru_cache(maxsize=256)
+def _find_encoder(cls: type) -> Callable[[Any], Any] | None:
+    """按 MRO 查找类型对应的编码函数, 子类也能使用父类的编码函数"""
+    return next((app_json_encoders[base] for base in cls.__mro__ if base in app_json_encoders), None)
+
+
 def custom_serializer(obj):
     """
         自定义序列化函数
     """
-    if isinstance(obj, tuple(app_json_encoders.keys())):
-        return app_json_encoders[type(obj)](obj)
+    if isinstance(obj, _encoder_types):
+        return _find_encoder(type(obj))(obj)
 
     return obj
 
 
+class RawJSON(bytes):
+    """已经是合法 json 的字节串, 序列化时原样输出, 不再解析后重新序列化"""
+
+    __slots__ = ()
+
+
 def loads_json(json_str: str):
     return ujson.loads(json_str)
 
@@ -52,9 +74,140 @@ def dumps_json(json_obj: str | dict | list) -> str:
     """对json进行压缩,去除多余的空格,tab,换行"""
     if json_obj is None:
         return "{}"
+    if isinstance(json_obj, RawJSON):
+        return json_obj.decode("utf-8")
 
     maybe_json_obj = json_obj
     if isinstance(json_obj, str | bytes):
         maybe_json_obj = loads_json(json_obj)
 
-    return ujson.dumps(maybe_json_obj, ensure_ascii=False, separators=(",", ":"), default=custom_serializer)
\ No newline at end of file
+    return ujson.dumps(maybe_json_obj, ensure_ascii=False, separators=(",", ":"), default=custom_serializer)
+
+
+def build_schema(schema: type[BaseModel]) -> type[BaseModel]:
+    """
+        编译 defer_build 的 schema. 未编译的 schema 可以校验(第一次校验时自动编译),
+        但直接构造(model_construct)的实例无法序列化, 字段别名也可能还未生成, 因此这些场景需要先编译
+    """
+    if not schema.__pydantic_complete__:
+        schema.model_rebuild()
+    return schema
+
+
+# ===========================STREAM===========================
+def encode_json_row(row: Any) -> bytes:
+    """把单行数据编码为 json 字节: schema 由 pydantic-core 直接输出, RawJSON 原样输出"""
+    if isinstance(row, BaseModel):
+        return to_json(row, by_alias=True)
+    if isinstance(row, RawJSON):
+        return row
+    return dumps_json(row).encode("utf-8")
+
+
+async def _aiter(rows: Iterable[Any] | AsyncIterable[Any]) -> AsyncIterator[Any]:
+    if isinstance(rows, AsyncIterable):
+        async for row in rows:
+            yield row
+    else:
+        for row in rows:
+            yield row
+
+
+async def aiter_json_chunks(
+    rows: Iterable[Any] | AsyncIterable[Any],
+    chunk_rows: int = 200,
+    sep: bytes = b",",
+    head: bytes = b"[",
+    tail: bytes = b"]",
+) -> AsyncIterator[bytes]:
+    """
+        增量编码: 逐行编码为 json 并以 sep 连接, 每 chunk_rows 行输出一个数据块, 可直接作为流式响应的 body.
+        完整的结果不会以一个字符串的形式出现在内存中
+    :param rows: 同步或异步迭代的数据(schema/dict/list/RawJSON)
+    :param chunk_rows: 每个数据块包含的行数
+    :param sep: 行之间的分隔符
+    :param head: 第一个数据块的前缀
+    :param tail: 最后一个数据块的后缀
+    :return:
+    """
+    buffer = [head] if head else []
+    count = 0
+    async for row in _aiter(rows):
+        if count:
+            buffer.append(sep)
+        buffer.append(encode_json_row(row))
+        count += 1
+        if count % chunk_rows == 0:
+            yield b"".join(buffer)
+            buffer.clear()
+    # 没有数据且没有前缀时(如 NDJSON)不输出任何内容
+    if count or head:
+        buffer.append(tail)
+        yield b"".join(buffer)
+
+
+def aiter_json_envelope(
+    rows: Iterable[Any] | AsyncIterable[Any], code: int = 0, msg: str = "ok", chunk_rows: int = 200
+) -> AsyncIterator[bytes]:
+    """增量输出 {code, msg, data: [...]} 结构的响应"""
+    head = b'{"code":' + to_json(code) + b',"msg":' + to_json(msg) + b',"data":['
+    return aiter_json_chunks(rows, chunk_rows=chunk_rows, head=head, tail=b"]}")
+
+
+def aiter_ndjson(rows: Iterable[Any] | AsyncIterable[Any], chunk_rows: int = 200) -> AsyncIterator[bytes]:
+    """
+        将迭代的 schema 逐行编码为 NDJSON, 每 chunk_rows 行输出一个数据块
+    :param rows: 同步或异步迭代的 schema 实例
+    :param chunk_rows: 每个数据块包含的行数
+    :return:
+    """
+    return aiter_json_chunks(rows, chunk_rows=chunk_rows, sep=b"\n", head=b"", tail=b"\n")
+
+
+# CSV 中按列批量格式化的类型: 日期与 json 响应使用相同的格式, 数值保留两位小数
+_CSV_COLUMN_FORMATTERS: tuple[tuple[type, Callable[[Sequence[Any]], list[Any]]], ...] = (
+    (datetime, dts_to_str),
+    (Decimal, format_decimals),
+)
+
+
+def _format_columns(rows: list[list[Any]]) -> Iterable[tuple[Any, ...]]:
+    """把一批 CSV 行转置为列, 日期与数值列整列格式化后再转回行"""
+    columns = list(zip(*rows, strict=True))
+    for i, values in enumerate(columns):
+        sample = next((value for value in values if value is not None), None)
+        formatter = next((func for cls, func in _CSV_COLUMN_FORMATTERS if isinstance(sample, cls)), None)
+        if formatter is not None:
+            columns[i] = formatter(values)
+    return zip(*columns, strict=True)
+
+
+async def aiter_csv(
+    rows: AsyncIterator[BaseModel], schema: type[BaseModel], chunk_rows: int = 200
+) -> AsyncIterator[bytes]:
+    """
+        将异步迭代的 schema 编码为 CSV(首行为表头), 每 chunk_rows 行按列格式化日期与数值后输出一个数据块
+    :param rows: 异步迭代的 schema 实例
+    :param schema: schema 类型, 用于生成表头
+    :param chunk_rows: 每个数据块包含的行数
+    :return:
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # defer_build 的 schema 编译后才会生成字段别名, 先编译保证表头一致
+    fields = build_schema(schema).model_fields
+    writer.writerow([field.alias or name for name, field in fields.items()])
+
+    chunk: list[list[Any]] = []
+    async for row in rows:
+        chunk.append(list(row.model_dump(by_alias=True).values()))
+        if len(chunk) >= chunk_rows:
+            writer.writerows(_format_columns(chunk))
+            chunk.clear()
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if chunk:
+        writer.writerows(_format_columns(chunk))
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
@@ -4,8 +4,9 @@ __date__ = 2024-10-20
 __version__ = 0.0.1
 __description__ = 日期时间相关的工具函数
 """
-from datetime import datetime
-from typing import Union
+from collections.abc import Callable, Iterable
+from datetime import date, datetime
+from typing import Any
 
 import arrow
 
@@ -14,6 +15,14 @@ FMT_TIME = "HH:mm:ss"
 FMT_DT = f"{FMT_DATE} {FMT_TIME}"
 FMT_DT_NO_GAP = "YYYYMMDDHHmmss"
 
+# 常用格式的快速格式化函数, 输出与 arrow 的格式化结果一致, 其它格式仍然使用 arrow
+_FAST_FORMATTERS: dict[str, Callable[[datetime], str]] = {
+    FMT_DATE: lambda d: f"{d.year:04d}-{d.month:02d}-{d.day:02d}",
+    FMT_TIME: lambda d: f"{d.hour:02d}:{d.minute:02d}:{d.second:02d}",
+    FMT_DT: lambda d: f"{d.year:04d}-{d.month:02d}-{d.day:02d} {d.hour:02d}:{d.minute:02d}:{d.second:02d}",
+    FMT_DT_NO_GAP: lambda d: f"{d.year:04d}{d.month:02d}{d.day:02d}{d.hour:02d}{d.minute:02d}{d.second:02d}",
+}
+
 
 def dt_now() -> datetime:
     return arrow.now().naive
@@ -27,12 +36,35 @@ def dt_to_str(date_obj: datetime = None, pat=FMT_DT) -> str:
     :return:
     """
     if date_obj is None:
-        date_obj = arrow.now()
+        date_obj = datetime.now()
+    formatter = _FAST_FORMATTERS.get(pat)
+    # date 类型没有时分秒, 只有日期格式可以走快速格式化
+    if formatter is not None and (isinstance(date_obj, datetime) or (pat == FMT_DATE and isinstance(date_obj, date))):
+        return formatter(date_obj)
     return arrow.get(date_obj).format(pat)
 
 
+def dts_to_str(values: Iterable[datetime | None], pat=FMT_DT) -> list[str | None]:
+    """
+        批量格式化一列日期, None 保持为 None
+    :param values: 日期实例
+    :param pat: 日期格式化模式
+    :return:
+    """
+    formatter = _FAST_FORMATTERS.get(pat)
+    if formatter is None:
+        return [None if value is None else arrow.get(value).format(pat) for value in values]
+    return [None if value is None else _format_one(formatter, value, pat) for value in values]
+
+
+def _format_one(formatter: Callable[[datetime], str], value: Any, pat: str) -> str:
+    if isinstance(value, datetime) or (pat == FMT_DATE and isinstance(value, date)):
+        return formatter(value)
+    return arrow.get(value).format(pat)
+
+
 def adjust_datetime(
-    date_input: Union[datetime, str],
+    date_input: datetime | str,
     *,
     year: int = 0,
     month: int = 0,
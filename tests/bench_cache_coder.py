@@ -0,0 +1,67 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 接口缓存编解码基准测试: 二进制信封与原 json 字符串方式对比, 用法: python -m tests.bench_cache_coder
+"""
+
+import timeit
+from datetime import datetime
+
+from starlette.responses import JSONResponse
+
+from app.ctx import APIResponse
+from app.main import app  # noqa: F401 完成 schema 的构建
+from app.midware import UJsonCoder
+from app.schema.user import UserSchema
+from app.settings import settings
+from app.utils.serials import loads_json
+
+
+def _response(count: int) -> JSONResponse:
+    users = [
+        UserSchema(
+            id=i,
+            username=f"user_{i}",
+            password="p",
+            nickname=f"昵称{i}",
+            age=i % 100,
+            last_login_time=datetime(2024, 11, 30, 12, 0, i % 60),
+            expired=False,
+            locked=False,
+            created_time=datetime(2024, 1, 1),
+            updated_time=datetime(2024, 1, 1),
+        )
+        for i in range(count)
+    ]
+    return APIResponse.success(data=users)
+
+
+def _baseline_encode(value: JSONResponse) -> bytes:
+    # 原实现: 直接保存响应内容
+    return bytes(value.body)
+
+
+def _baseline_decode(value: bytes) -> JSONResponse:
+    # 原实现: 解析为 dict 后再由 JSONResponse 重新序列化
+    return JSONResponse(loads_json(value))
+
+
+def bench(number: int = 200):
+    for count in (10, 100, 1000):
+        response = _response(count)
+        for codec in ("raw", "zlib", "lzma"):
+            settings.cache.compress_codec = codec
+            settings.cache.compress_min_bytes = 1 << 62 if codec == "raw" else 1024
+            encoded = UJsonCoder.encode(response)
+            enc = timeit.timeit(lambda: UJsonCoder.encode(response), number=number) / number  # noqa: B023
+            dec = timeit.timeit(lambda: UJsonCoder.decode(encoded), number=number) / number  # noqa: B023
+            print(f"{count:>5} envelope/{codec:<5} {len(encoded):>8} B enc {enc * 1e6:9.1f} us dec {dec * 1e6:9.1f} us")
+        encoded = _baseline_encode(response)
+        enc = timeit.timeit(lambda: _baseline_encode(response), number=number) / number  # noqa: B023
+        dec = timeit.timeit(lambda: _baseline_decode(encoded), number=number) / number  # noqa: B023
+        print(f"{count:>5} baseline json  {len(encoded):>8} B enc {enc * 1e6:9.1f} us dec {dec * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,70 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 接口缓存 key 生成耗时基准测试(与原 md5 key 生成函数对比), 用法: python -m tests.bench_cache_key
+"""
+
+import json
+import timeit
+
+from fastapi_cache import FastAPICache
+from starlette.requests import Request
+
+from app.main import app  # noqa: F401 注册缓存插件
+from app.utils.encrypts import hash_md5
+
+# 场景名称 => (query 参数, 函数参数)
+CASES = {
+    "no-params": ("", {}),
+    "query-5": ("page=1&size=20&sort=id&order=desc&q=abc", {}),
+    "repeated-query-20": ("&".join(f"id={i}" for i in range(20)), {}),
+    "kwargs": ("", {"page": 1, "size": 20, "ids": list(range(20)), "service": object()}),
+}
+
+
+async def handler(*args, **kwargs): ...
+
+
+def md5_key_builder(func, namespace="", *, request=None, response=None, args=(), kwargs=None):
+    """
+    原实现: 逐个参数试探 json.dumps 判断是否可序列化, 拼接后计算 md5.
+    不包含 query 参数(不同的 query 得到相同的 key), 因此带 query 的场景中它做的工作更少;
+    原实现直接拼接参数值, 遇到非字符串的参数会报错, 这里先转换为字符串
+    """
+
+    def is_serializable(obj):
+        try:
+            json.dumps(obj)
+            return True
+        except TypeError:
+            return False
+
+    hash_keys = []
+    key = f"{namespace}:{request.url.path}" if request and request.url else f"{namespace}:{func.__name__}"
+    if args:
+        hash_keys.extend([arg for arg in args if is_serializable(arg)])
+    if kwargs:
+        hash_keys.extend([arg for arg in kwargs.values() if is_serializable(arg)])
+    if hash_keys:
+        key = f"{key}:{hash_md5(''.join(map(str, hash_keys)))}"
+    return key
+
+
+def bench(number: int = 50_000):
+    builder = FastAPICache.get_key_builder()
+    for name, (query, kwargs) in CASES.items():
+        request = Request(
+            {"type": "http", "method": "GET", "path": "/user/all", "query_string": query.encode(), "headers": []}
+        )
+
+        def build(request=request, kwargs=kwargs, builder=builder):
+            return builder(handler, "api-cache:user", request=request, response=None, args=(), kwargs=kwargs)
+
+        new = timeit.timeit(build, number=number) / number
+        old = timeit.timeit(lambda b=build: b(builder=md5_key_builder), number=number) / number
+        print(f"{name:<20} canonical {new * 1e6:8.2f} us/key  md5 baseline {old * 1e6:8.2f} us/key  x{old / new:5.1f}")
+
+
+if __name__ == "__main__":
+    bench()
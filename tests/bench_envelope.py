@@ -0,0 +1,52 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 统一响应序列化基准测试(与原 model_dump + JSONResponse 对比), 用法: python -m tests.bench_envelope
+"""
+
+import timeit
+from datetime import datetime
+
+from starlette.responses import JSONResponse
+
+from app.ctx import APIResponse
+from app.main import app  # noqa: F401 完成 schema 的构建
+from app.schema.user import UserSchema
+
+
+def _users(count: int) -> list[UserSchema]:
+    return [
+        UserSchema(
+            id=i,
+            username=f"user_{i}",
+            password="p",
+            nickname=f"昵称{i}",
+            age=i % 100,
+            last_login_time=datetime(2024, 11, 30, 12, 0, i % 60),
+            expired=False,
+            locked=False,
+            created_time=datetime(2024, 1, 1),
+            updated_time=datetime(2024, 1, 1),
+        )
+        for i in range(count)
+    ]
+
+
+def _baseline(data: list[UserSchema]) -> JSONResponse:
+    # 原实现: 先构建 APIResponse 模型并 dump 为 dict, 再由 JSONResponse 用标准库 json 序列化
+    content = APIResponse(data=data).model_dump(by_alias=True)
+    return JSONResponse(content=content, status_code=200)
+
+
+def bench():
+    for count, number in ((1, 20_000), (100, 1000), (1000, 100), (10_000, 10), (100_000, 2)):
+        users = _users(count)
+        assert len(APIResponse.success(data=users).body) > 0
+        new = timeit.timeit(lambda: APIResponse.success(data=users), number=number) / number  # noqa: B023
+        old = timeit.timeit(lambda: _baseline(users), number=number) / number  # noqa: B023
+        print(f"{count:>6} rows  envelope {new * 1e6:10.1f} us  baseline {old * 1e6:10.1f} us  x{old / new:5.1f}")
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,69 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 日期与数值格式化基准测试: 快速路径与原 arrow/正则实现对比, 用法: python -m tests.bench_formatting
+"""
+
+import re
+import timeit
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+import arrow
+
+from app.utils.nums import format_decimal, format_decimals
+from app.utils.times import FMT_DATE, FMT_DT, FMT_DT_NO_GAP, dt_to_str, dts_to_str
+
+
+def _baseline_dt_to_str(date_obj: datetime, pat: str = FMT_DT) -> str:
+    # 原实现: 每次都经过 arrow 解析格式串
+    return arrow.get(date_obj).format(pat)
+
+
+def _baseline_format_decimal(value: str, digits: int = 2) -> Decimal:
+    # 原实现: 每次编译正则并构建量化因子(原实现不支持 Decimal 输入, 这里使用字符串对比)
+    if not re.match(r"^[-+]?\d+(\.\d{1,5})?$", value):
+        raise ValueError(value)
+    return Decimal(value).quantize(Decimal(f"0.{'0' * digits}"), rounding=ROUND_HALF_UP)
+
+
+def _report(name: str, new, old, number: int):
+    new_us = timeit.timeit(new, number=number) / number * 1e6
+    old_us = timeit.timeit(old, number=number) / number * 1e6
+    print(f"{name:<28} new {new_us:9.2f} us  baseline {old_us:9.2f} us  x{old_us / new_us:6.1f}")
+
+
+def bench(number: int = 20_000):
+    dt = datetime(2024, 11, 30, 12, 34, 56)
+    for pat in (FMT_DT, FMT_DATE, FMT_DT_NO_GAP):
+        assert dt_to_str(dt, pat) == _baseline_dt_to_str(dt, pat)
+        _report(f"dt_to_str {pat}", lambda: dt_to_str(dt, pat), lambda: _baseline_dt_to_str(dt, pat), number)  # noqa: B023
+
+    values = [datetime(2024, 11, 30, 12, 0, i % 60) for i in range(1000)]
+    _report(
+        "dts_to_str 1000",
+        lambda: dts_to_str(values),
+        lambda: [_baseline_dt_to_str(v) for v in values],
+        number // 1000,
+    )
+
+    assert format_decimal("123.456") == _baseline_format_decimal("123.456")
+    _report(
+        "format_decimal str", lambda: format_decimal("123.456"), lambda: _baseline_format_decimal("123.456"), number
+    )
+    amount = Decimal("123.456")
+    _report(
+        "format_decimal Decimal", lambda: format_decimal(amount), lambda: _baseline_format_decimal("123.456"), number
+    )
+    amounts = [f"{i}.{i % 1000:03d}" for i in range(1000)]
+    _report(
+        "format_decimals 1000 str",
+        lambda: format_decimals(amounts),
+        lambda: [_baseline_format_decimal(v) for v in amounts],
+        number // 1000,
+    )
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,59 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = pg_upsert 写入模式基准测试, 用法: ALLOW_TEST_DB_WRITE=1 python -m tests.bench_pg_upsert 10000 100000
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from sqlalchemy import delete
+
+from app.db import AsyncSessionLocal, pg_upsert
+from app.model.user import TabUser
+
+# 模式名称 => pg_upsert 参数
+MODES = {
+    "executemany": {},
+    "concurrent": {"concurrency": 4},
+    "copy": {"use_copy": True},
+}
+
+
+def _rows(count: int, tag: str) -> list[dict]:
+    return [{"username": f"bench_{tag}_{i}", "password": "p", "age": i % 100} for i in range(count)]
+
+
+async def _clear():
+    # 只删除基准测试写入的数据, "_" 在 LIKE 中是通配符, 需要转义
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(TabUser).where(TabUser.username.startswith("bench_", autoescape=True)))
+        await session.commit()
+
+
+async def bench(count: int):
+    for mode, kwargs in MODES.items():
+        await _clear()
+        rows = _rows(count, mode)
+        # 第一次全部是插入, 第二次全部命中冲突走更新
+        for phase in ("insert", "update"):
+            async with AsyncSessionLocal() as session:
+                start = time.perf_counter()
+                ids = await pg_upsert(session, TabUser, rows, batch_size=1000, **kwargs)
+                elapsed = time.perf_counter() - start
+            print(f"{count:>9} {mode:<12} {phase:<7} {elapsed:8.3f}s {count / elapsed:12.0f} rows/s ids={len(ids)}")
+    await _clear()
+
+
+async def main(counts: list[int]):
+    for count in counts:
+        await bench(count)
+
+
+if __name__ == "__main__":
+    if os.getenv("ALLOW_TEST_DB_WRITE") != "1":
+        sys.exit("基准测试会写入并删除配置的数据库中的数据, 确认连接的是测试库后设置 ALLOW_TEST_DB_WRITE=1 再运行")
+    asyncio.run(main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]))
@@ -0,0 +1,62 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = ORM 实例与只读记录的读取基准测试, 用法: ALLOW_TEST_DB_WRITE=1 python -m tests.bench_records 100000
+"""
+
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+from sqlalchemy import delete
+
+from app.dao import BaseDao
+from app.db import AsyncSessionLocal, pg_upsert
+from app.model.user import TabUser
+
+
+async def _cleanup():
+    # 只删除基准测试写入的数据, "_" 在 LIKE 中是通配符, 需要转义
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(TabUser).where(TabUser.username.startswith("bench_rec_", autoescape=True)))
+        await session.commit()
+
+
+async def _prepare(count: int):
+    rows = [{"username": f"bench_rec_{i}", "password": "p", "nickname": f"n{i}", "age": i % 100} for i in range(count)]
+    await _cleanup()
+    async with AsyncSessionLocal() as session:
+        await pg_upsert(session, TabUser, rows, use_copy=True)
+
+
+async def _measure(name: str, read):
+    # 耗时与内存分两次测量, tracemalloc 会明显拖慢读取
+    async with AsyncSessionLocal() as session:
+        start = time.perf_counter()
+        rows = await read(BaseDao(TabUser, session))
+        elapsed = time.perf_counter() - start
+    async with AsyncSessionLocal() as session:
+        tracemalloc.start()
+        await read(BaseDao(TabUser, session))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(f"{name:<16} rows={len(rows):>8} {elapsed:8.3f}s peak={peak / 1024 / 1024:8.1f} MiB")
+
+
+async def main(count: int):
+    await _prepare(count)
+    # 第一次读取包含类型查询与预编译, 不计入结果
+    await _measure("warmup", lambda dao: dao.get_all_records())
+    await _measure("orm get_all", lambda dao: dao.get_all())
+    await _measure("get_all_records", lambda dao: dao.get_all_records())
+    await _measure("records 3 cols", lambda dao: dao.get_all_records([TabUser.id, TabUser.username, TabUser.age]))
+    await _cleanup()
+
+
+if __name__ == "__main__":
+    if os.getenv("ALLOW_TEST_DB_WRITE") != "1":
+        sys.exit("基准测试会写入并删除配置的数据库中的数据, 确认连接的是测试库后设置 ALLOW_TEST_DB_WRITE=1 再运行")
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
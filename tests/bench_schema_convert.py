@@ -0,0 +1,65 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 表实体转换 schema 基准测试: 批量转换与原 json 往返方式对比, 用法: python -m tests.bench_schema_convert
+"""
+
+import timeit
+from datetime import datetime
+
+from app.main import app  # noqa: F401 完成 schema 的构建
+from app.model.user import TabUser
+from app.schema.user import UserSchema
+from app.utils.metas import tables_to_schemas
+from app.utils.serials import dumps_json
+
+
+def _users(count: int) -> list[TabUser]:
+    return [
+        TabUser(
+            id=i,
+            username=f"user_{i}",
+            password="p",
+            nickname=f"昵称{i}",
+            age=i % 100,
+            last_login_time=datetime(2024, 11, 30, 12, 0, i % 60),
+            expired=False,
+            locked=False,
+            created_time=datetime(2024, 1, 1),
+            updated_time=datetime(2024, 1, 1),
+        )
+        for i in range(count)
+    ]
+
+
+def _baseline(users: list[TabUser]) -> list[UserSchema]:
+    # 原实现: 逐个实体取出字段后序列化为 json, 再由 schema 解析校验
+    result = []
+    for user in users:
+        data = {}
+        for field in UserSchema.model_fields:
+            if hasattr(user, field):
+                value = getattr(user, field)
+                if value is None:
+                    continue
+                data[field] = value
+        result.append(UserSchema.model_validate_json(dumps_json(data)))
+    return result
+
+
+def bench(count: int = 1000, number: int = 50):
+    users = _users(count)
+    cases = {
+        "json round trip": lambda: _baseline(users),
+        "model_validate": lambda: [UserSchema.model_validate(user) for user in users],
+        "tables_to_schemas": lambda: tables_to_schemas(users, UserSchema),
+        "trusted": lambda: tables_to_schemas(users, UserSchema, exclude_none=False, trusted=True),
+    }
+    for name, case in cases.items():
+        elapsed = timeit.timeit(case, number=number) / number
+        print(f"{name:<18} {count} rows {elapsed * 1e3:8.2f} ms")
+
+
+if __name__ == "__main__":
+    bench()
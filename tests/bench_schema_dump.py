@@ -0,0 +1,78 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = schema 序列化基准测试: 按字段绑定序列化器与通配序列化器对比, 用法: python -m tests.bench_schema_dump
+"""
+
+import timeit
+from datetime import datetime
+from decimal import Decimal
+from typing import Any
+
+from pydantic import BaseModel, ConfigDict, TypeAdapter, alias_generators, field_serializer
+
+from app.schema import BaseSchema, DatetimeField, DecimalField
+from app.utils.serials import custom_serializer
+
+
+class FieldOrder(BaseSchema):
+    id: int
+    order_no: str
+    buyer: str
+    quantity: int
+    paid: bool
+    amount: DecimalField
+    created_time: DatetimeField
+    updated_time: DatetimeField
+
+
+class WildcardOrder(BaseModel):
+    """原实现: 所有字段都经过 python 层的通配序列化器"""
+
+    model_config = ConfigDict(alias_generator=alias_generators.to_camel, from_attributes=True, populate_by_name=True)
+
+    id: int
+    order_no: str
+    buyer: str
+    quantity: int
+    paid: bool
+    amount: Decimal
+    created_time: datetime
+    updated_time: datetime
+
+    @field_serializer("*")
+    def serialize_dt(self, item: Any, _info):
+        return custom_serializer(item)
+
+
+def _rows(count: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "id": i,
+            "order_no": f"NO{i:08d}",
+            "buyer": f"buyer_{i}",
+            "quantity": i % 10,
+            "paid": i % 2 == 0,
+            "amount": Decimal(i) / 7,
+            "created_time": datetime(2024, 11, 30, 12, 0, i % 60),
+            "updated_time": datetime(2024, 11, 30, 12, 30, i % 60),
+        }
+        for i in range(count)
+    ]
+
+
+def bench(count: int = 1000, number: int = 100):
+    rows = _rows(count)
+    for schema in (FieldOrder, WildcardOrder):
+        items = [schema(**row) for row in rows]
+        adapter = TypeAdapter(list[schema])
+        dump_json = timeit.timeit(lambda: adapter.dump_json(items, by_alias=True), number=number) / number  # noqa: B023
+        dump = timeit.timeit(lambda: [item.model_dump() for item in items], number=number) / number  # noqa: B023
+        print(
+            f"{schema.__name__:<14} {count} rows  dump_json {dump_json * 1e3:7.2f} ms  model_dump {dump * 1e3:7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,103 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = 业务配置快照测试
+"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+import redis
+
+from app import biz
+from app.settings import BizSettings, decode_biz_value
+
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    """替换为新的快照, 并记录 load 的调用"""
+    fresh = BizSettings()
+    loads = []
+
+    async def load(version=None):
+        loads.append(version)
+        fresh.swap({}, version)
+
+    monkeypatch.setattr(biz, "biz_settings", fresh)
+    monkeypatch.setattr(biz.biz_settings_loader, "load", load)
+    monkeypatch.setattr(biz.redis_breaker, "available", True)
+    return loads
+
+
+@pytest.mark.asyncio
+async def test_refresh_loads_when_version_missing(snapshot, monkeypatch):
+    async def get(_):
+        return None
+
+    monkeypatch.setattr(biz.async_redis, "get", get)
+    await biz.biz_settings_loader.refresh()
+    await biz.biz_settings_loader.refresh()
+    assert snapshot == [None]
+
+
+@pytest.mark.asyncio
+async def test_refresh_loads_when_redis_down(snapshot, monkeypatch):
+    async def get(_):
+        raise redis.exceptions.ConnectionError("down")
+
+    monkeypatch.setattr(biz.async_redis, "get", get)
+    monkeypatch.setattr(biz.redis_breaker, "record_failure", lambda: None)
+    await biz.biz_settings_loader.refresh()
+    monkeypatch.setattr(biz.redis_breaker, "available", False)
+    await biz.biz_settings_loader.refresh()
+    assert snapshot == [None]
+
+
+@pytest.mark.asyncio
+async def test_refresh_reloads_on_version_change(snapshot, monkeypatch):
+    versions = iter(["1", "1", "2"])
+
+    async def get(_):
+        return next(versions)
+
+    monkeypatch.setattr(biz.async_redis, "get", get)
+    for _ in range(3):
+        await biz.biz_settings_loader.refresh()
+    assert snapshot == ["1", "2"]
+
+
+@pytest.mark.parametrize(
+    ("value", "value_type", "expected"),
+    [
+        (None, "int", None),
+        ("abc", None, "abc"),
+        ("42", "int", 42),
+        ("1.5", "float", 1.5),
+        ("1.50", "decimal", Decimal("1.50")),
+        ("Yes", "bool", True),
+        ("off", "BOOL", False),
+        ('{"a": [1]}', "json", {"a": [1]}),
+        ("a, b,,c ", "list", ["a", "b", "c"]),
+        ("2024-12-02", "date", date(2024, 12, 2)),
+    ],
+)
+def test_decode_biz_value(value, value_type, expected):
+    assert decode_biz_value(value, value_type) == expected
+
+
+def test_decode_biz_value_bundle():
+    assert decode_biz_value("b", "str", ["a", "b"]) == "b"
+    assert decode_biz_value("5", "int", {"min": 1, "max": "5"}) == 5
+    with pytest.raises(ValueError):
+        decode_biz_value("c", "str", ["a", "b"])
+    with pytest.raises(ValueError):
+        decode_biz_value("0", "int", {"min": 1})
+    with pytest.raises(ValueError):
+        decode_biz_value("x", "bool")
+    # 无效的 json 与其它类型一样抛出 ValueError, 加载时会被忽略
+    with pytest.raises(ValueError):
+        decode_biz_value("{a", "json")
+    with pytest.raises(ValueError):
+        decode_biz_value("1", "uuid")
@@ -0,0 +1,284 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = 接口缓存测试
+"""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi_cache import FastAPICache, default_key_builder
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from sqlalchemy import select
+from starlette.responses import Response
+
+from app import cache
+from app.db import TABLE_VERSION_KEY
+from app.midware import UJsonCoder
+from app.model.settings import TabSettings
+from app.model.user import TabUser
+
+
+@pytest.fixture
+def api_cache(monkeypatch):
+    # redis 熔断时跨 worker 的锁直接视为拿到锁
+    monkeypatch.setattr(cache.redis_breaker, "available", False)
+    # 只替换测试需要的配置, 测试结束后还原(其它测试依赖 app 注册的配置)
+    monkeypatch.setattr(FastAPICache, "_backend", InMemoryBackend())
+    monkeypatch.setattr(FastAPICache, "_prefix", "test")
+    monkeypatch.setattr(FastAPICache, "_expire", 60)
+    monkeypatch.setattr(FastAPICache, "_coder", UJsonCoder)
+    monkeypatch.setattr(FastAPICache, "_key_builder", FastAPICache._key_builder or default_key_builder)
+
+
+@pytest.mark.asyncio
+async def test_coalesced_requests_get_their_own_response(api_cache):
+    calls = 0
+    release = asyncio.Event()
+
+    @cache.cached(namespace="coalesce")
+    async def endpoint():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return Response(b'{"code":0}', media_type="application/json")
+
+    tasks = [asyncio.create_task(endpoint()) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    release.set()
+    responses = await asyncio.gather(*tasks)
+
+    assert calls == 1
+    assert len({id(response) for response in responses}) == 3
+    assert {response.body for response in responses} == {b'{"code":0}'}
+    responses[1].set_cookie("leaked", "1")
+    assert all(b"set-cookie" not in dict(response.raw_headers) for response in (responses[0], responses[2]))
+
+
+@pytest.mark.asyncio
+async def test_table_change_bumps_result_cache_version(api_cache, monkeypatch):
+    bumped, cleared = [], []
+
+    async def bump(table_type):
+        bumped.append(table_type)
+
+    class Backend:
+        async def clear(self, namespace=None, key=None):
+            cleared.append(namespace)
+
+    monkeypatch.setattr(cache, "bump_table_version", bump)
+    monkeypatch.setitem(cache.TABLE_NAMESPACES, TabSettings.__tablename__, {"settings"})
+    listener = cache.TableChangeListener(cache.async_engine, Backend())
+    await listener._invalidate(TabSettings.__tablename__, "42")
+    assert bumped == [TabSettings]
+    assert cleared == ["test:settings"]
+
+
+@pytest.mark.parametrize("size", [10, 100_000])
+def test_coder_round_trip(size):
+    body = b'{"data":"' + b"x" * size + b'"}'
+    response = Response(body, status_code=201, media_type="application/json", headers={"ETag": '"v1"'})
+    response.set_cookie("rw_sticky_until", "1")
+    response.raw_headers.extend([(b"date", b"Mon, 02 Dec 2024 00:00:00 GMT"), (b"server", b"uvicorn")])
+
+    decoded = UJsonCoder.decode(UJsonCoder.encode(response))
+    assert decoded.body == body
+    assert decoded.status_code == 201
+    assert decoded.media_type == "application/json"
+    headers = dict(decoded.raw_headers)
+    assert headers[b"etag"] == b'"v1"'
+    assert headers[b"content-length"] == str(len(body)).encode()
+    assert not {b"set-cookie", b"date", b"server"} & headers.keys()
+
+
+def test_coder_plain_value_and_limits():
+    decoded = UJsonCoder.decode(UJsonCoder.encode({"code": 0}))
+    assert (decoded.status_code, decoded.body) == (200, b'{"code":0}')
+
+    response = Response(b"{}", media_type="application/json", headers={"Cache-Control": "x" * 70_000})
+    assert b"cache-control" not in dict(UJsonCoder.decode(UJsonCoder.encode(response)).raw_headers)
+    with pytest.raises(ValueError):
+        UJsonCoder.encode(Response(b"{}", media_type="application/" + "x" * 300))
+
+
+def test_local_lru_evicts_by_bytes():
+    lru = cache.LocalLRU(max_bytes=10)
+    lru.set("a", b"xxxx", ttl=60, remote_ttl=60)
+    lru.set("b", b"xxxx", ttl=60, remote_ttl=60)
+    assert lru.get("a") is not None
+    lru.set("c", b"xxxx", ttl=60, remote_ttl=60)
+    # a 刚被读取过, 淘汰的是 b
+    assert lru.get("b") is None
+    assert lru.get("a") is not None and lru.get("c") is not None
+    assert lru.size == 8
+    lru.set("big", b"x" * 11, ttl=60, remote_ttl=60)
+    assert lru.get("big") is None
+
+
+def test_local_lru_ttl(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(cache._time, "monotonic", lambda: now)
+    lru = cache.LocalLRU(max_bytes=100)
+    lru.set("a", b"v", ttl=10, remote_ttl=30)
+    lru.set("b", b"v", ttl=10, remote_ttl=5)
+    lru.set("c", b"v", ttl=10, remote_ttl=0)
+    assert lru.get("a") == (30, b"v")
+    assert lru.get("c") is None
+    now += 6
+    # 本地副本不会比 redis 中的数据活得更久
+    assert lru.get("b") is None
+    assert lru.get("a") == (24, b"v")
+    now += 5
+    assert lru.get("a") is None
+    assert lru.size == 0
+
+
+class _PubSub:
+    def __init__(self, messages: list[bytes]):
+        self.messages = messages
+
+    async def subscribe(self, channel):
+        assert channel == cache.INVALIDATE_CHANNEL
+
+    async def get_message(self, ignore_subscribe_messages, timeout):
+        if self.messages:
+            return {"data": self.messages.pop(0)}
+        await asyncio.sleep(timeout)
+
+    async def aclose(self):
+        pass
+
+
+class _PubSubClient:
+    def __init__(self, messages: list[bytes]):
+        self._pubsub = _PubSub(messages)
+
+    def pubsub(self):
+        return self._pubsub
+
+    async def publish(self, channel, message):
+        assert channel == cache.INVALIDATE_CHANNEL
+        self._pubsub.messages.append(message.encode("utf-8"))
+
+
+async def _drain(backend: cache.TieredBackend, messages: list[bytes]):
+    backend.start()
+    try:
+        for _ in range(100):
+            if not messages:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+    finally:
+        await backend.stop()
+
+
+@pytest.mark.asyncio
+async def test_tiered_backend_drops_local_copies_on_invalidation():
+    messages = [b'{"namespace":"api:user","key":null}', b'{"namespace":null,"key":"api:settings:k1"}']
+    backend = cache.TieredBackend(InMemoryBackend(), _PubSubClient(messages), local_max_bytes=1000, local_ttl=60)
+    for key in ("api:user:k1", "api:user:k2", "api:settings:k1", "api:settings:k2"):
+        backend.local.set(key, b"v", ttl=60, remote_ttl=60)
+
+    await _drain(backend, messages)
+    assert [key for key in ("api:user:k1", "api:user:k2", "api:settings:k1") if backend.local.get(key)] == []
+    assert backend.local.get("api:settings:k2") is not None
+
+
+@pytest.mark.asyncio
+async def test_owner_clear_drops_local_copies_read_during_invalidation(api_cache, monkeypatch):
+    # 先处理通知的 worker 没有抢到锁, 后处理的 worker 持有锁
+    owners = [False, True]
+
+    async def try_lock(lock_key, token, lock_ms):
+        return owners.pop(0)
+
+    async def bump(table_type):
+        pass
+
+    monkeypatch.setattr(cache, "_try_lock", try_lock)
+    monkeypatch.setattr(cache, "bump_table_version", bump)
+    monkeypatch.setitem(cache.TABLE_NAMESPACES, TabSettings.__tablename__, {"settings"})
+    # 两个 worker 共用同一个 redis
+    remote, messages = InMemoryBackend(), []
+    client = _PubSubClient(messages)
+    owner = cache.TieredBackend(remote, client, local_max_bytes=1000, local_ttl=60)
+    other = cache.TieredBackend(remote, client, local_max_bytes=1000, local_ttl=60)
+    await owner.set("test:settings:k1", b"old", expire=60)
+
+    await cache.TableChangeListener(cache.async_engine, other)._invalidate(TabSettings.__tablename__, "42")
+    assert other.local.get("test:settings:k1") is None
+    # 持锁的 worker 清理 redis 之前, 其它 worker 又把旧值读入了本地副本
+    assert await other.get("test:settings:k1") == b"old"
+    await cache.TableChangeListener(cache.async_engine, owner)._invalidate(TabSettings.__tablename__, "42")
+
+    await _drain(other, messages)
+    assert await other.get("test:settings:k1") is None
+    assert await owner.get("test:settings:k1") is None
+
+
+class _Redis:
+    """只实现查询结果缓存用到的命令"""
+
+    def __init__(self):
+        self.data: dict[str, str] = {}
+
+    async def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+
+@pytest.fixture
+def result_cache(monkeypatch):
+    monkeypatch.setattr(cache.redis_breaker, "available", True)
+    client = _Redis()
+    client.data[TABLE_VERSION_KEY.format(TabUser.__tablename__)] = "3"
+    return cache.ResultCache(client)
+
+
+def _users() -> list[TabUser]:
+    return [
+        TabUser(id=i, username=f"u{i}", password="p", age=None, last_login_time=datetime(2024, 12, 2, 8, 0, i))
+        for i in range(3)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_result_cache_hit(result_cache):
+    key = result_cache.build_key(TabUser, select(TabUser))
+    assert await result_cache.get(TabUser, key) == (None, "3")
+    await result_cache.set(TabUser, key, "3", _users(), ttl=60, max_bytes=10_000)
+
+    rows, version = await result_cache.get(TabUser, key)
+    assert version == "3"
+    assert [row.to_dict() for row in rows] == [row.to_dict() for row in _users()]
+    assert result_cache.stats[TabUser.__tablename__]["hits"] == 1
+
+    columns = ("id", "last_login_time")
+    key = result_cache.build_key(TabUser, select(TabUser.id, TabUser.last_login_time))
+    values = [{"id": user.id, "last_login_time": user.last_login_time} for user in _users()]
+    await result_cache.set(TabUser, key, "3", values, ttl=60, max_bytes=10_000, columns=columns)
+    assert await result_cache.get(TabUser, key, columns) == (values, "3")
+
+
+@pytest.mark.asyncio
+async def test_result_cache_misses_after_version_bump(result_cache):
+    key = result_cache.build_key(TabUser, select(TabUser))
+    await result_cache.set(TabUser, key, "3", _users(), ttl=60, max_bytes=10_000)
+    result_cache.client.data[TABLE_VERSION_KEY.format(TabUser.__tablename__)] = "4"
+    # 写入缓存时的版本号已经过期, 返回当前版本号用于写入新的结果
+    assert await result_cache.get(TabUser, key) == (None, "4")
+    assert result_cache.stats[TabUser.__tablename__]["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_result_cache_skips_oversize_payload(result_cache):
+    key = result_cache.build_key(TabUser, select(TabUser))
+    await result_cache.set(TabUser, key, "3", _users(), ttl=60, max_bytes=100)
+    assert key not in result_cache.client.data
+    assert result_cache.stats[TabUser.__tablename__]["skipped"] == 1
+    assert await result_cache.get(TabUser, key) == (None, "3")
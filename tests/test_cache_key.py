@@ -0,0 +1,120 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 接口缓存 key 的规范编码与碰撞测试
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+
+import pytest
+from fastapi_cache import FastAPICache
+from pydantic import BaseModel
+from starlette.requests import Request
+
+from app.main import app  # noqa: F401 注册缓存插件
+from app.midware import _canonical
+from app.settings import settings
+
+
+class Color(Enum):
+    RED = "red"
+
+
+class Page(BaseModel):
+    no: int
+    size: int
+
+
+async def handler(*args, **kwargs): ...
+
+
+def _request(path: str = "/user/all", query: str = "", headers: dict[str, str] | None = None) -> Request:
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request(
+        {"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": raw_headers}
+    )
+
+
+def _key(request: Request | None = None, args: tuple = (), kwargs: dict | None = None) -> str:
+    builder = FastAPICache.get_key_builder()
+    return builder(handler, "api-cache:ns", request=request, response=None, args=args, kwargs=kwargs or {})
+
+
+@pytest.mark.parametrize(
+    ("left", "right"),
+    [
+        ("1", 1),
+        (1, 1.0),
+        (1, True),
+        (0, False),
+        (None, "n"),
+        (None, "None"),
+        ("", None),
+        (("ab", "c"), ("a", "bc")),
+        (["a", "b"], ["b", "a"]),
+        (["a"], "a"),
+        ("s1:a", ["a"]),
+        (Decimal("1.0"), 1.0),
+        (date(2024, 1, 1), "2024-01-01"),
+        (datetime(2024, 1, 1), date(2024, 1, 1)),
+    ],
+)
+def test_canonical_distinguishes_values(left, right):
+    assert _canonical(left) != _canonical(right)
+
+
+def test_canonical_normalizes_equivalent_values():
+    assert _canonical({"a", "b", "c"}) == _canonical({"c", "b", "a"})
+    assert _canonical(Color.RED) == _canonical("red")
+    assert _canonical(Page(no=1, size=10)) == _canonical(Page(size=10, no=1))
+    assert _canonical(Page(no=1, size=10)) != _canonical(Page(no=10, size=1))
+
+
+def test_canonical_skips_unsupported_values():
+    assert _canonical(object()) is None
+    assert _canonical([1, object()]) is None
+
+
+def test_query_param_names_are_order_independent():
+    assert _key(_request(query="a=1&b=2")) == _key(_request(query="b=2&a=1"))
+
+
+def test_repeated_query_params_keep_their_order():
+    assert _key(_request(query="a=1&a=2")) != _key(_request(query="a=2&a=1"))
+    assert _key(_request(query="a=1&b=3&a=2")) == _key(_request(query="b=3&a=1&a=2"))
+
+
+@pytest.mark.parametrize(
+    ("left", "right"),
+    [
+        ("a=1&b=2", "a=1b=2"),
+        ("a=1,2", "a=1&a=2"),
+        ("a=1", "b=1"),
+        ("ab=1", "a=b1"),
+    ],
+)
+def test_query_strings_do_not_collide(left, right):
+    assert _key(_request(query=left)) != _key(_request(query=right))
+
+
+def test_path_is_part_of_key():
+    assert _key(_request(path="/user/all")) != _key(_request(path="/user/all_simple"))
+
+
+def test_vary_headers(monkeypatch):
+    monkeypatch.setattr(settings.cache, "vary_headers", ["accept-language"])
+    zh = _key(_request(headers={"Accept-Language": "zh"}))
+    en = _key(_request(headers={"Accept-Language": "en"}))
+    assert zh != en
+    assert zh == _key(_request(headers={"Accept-Language": "zh", "X-Trace": "1"}))
+
+
+def test_function_arguments():
+    assert _key(args=(1, 2)) != _key(args=(12,))
+    assert _key(kwargs={"a": 1, "b": 2}) == _key(kwargs={"b": 2, "a": 1})
+    assert _key(kwargs={"a": 1}) != _key(kwargs={"b": 1})
+    # 无法编码的参数(注入的 service, session 等)不参与生成 key
+    assert _key(kwargs={"a": 1, "service": object()}) == _key(kwargs={"a": 1})
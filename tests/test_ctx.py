@@ -0,0 +1,35 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = 统一响应测试
+"""
+
+from datetime import datetime
+
+from app.ctx import APIResponse
+from app.main import app  # noqa: F401 完成 schema 的构建
+from app.model import record_class, table_meta
+from app.model.user import TabUser
+from app.schema.user import UserSchema
+from app.utils.metas import tables_to_schemas
+
+
+def test_tables_and_records_serialize_like_schemas():
+    user = TabUser(
+        id=1,
+        username="u",
+        password="p",
+        nickname=None,
+        age=3,
+        last_login_time=datetime(2024, 12, 2, 8, 30, 0),
+        expired=False,
+        locked=False,
+        created_time=datetime(2024, 1, 1),
+        updated_time=datetime(2024, 1, 1),
+    )
+    record = record_class(TabUser).from_row(table_meta(TabUser).getter(user))
+    expected = APIResponse.success(tables_to_schemas([user], UserSchema, exclude_none=False, trusted=True)).body
+    assert b'"lastLoginTime":"2024-12-02 08:30:00"' in expected
+    assert APIResponse.success([user]).body == expected
+    assert APIResponse.success([record]).body == expected
@@ -0,0 +1,158 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = 数据库与 redis 连接工具测试
+"""
+
+import asyncio
+import os
+import time
+from typing import Annotated
+
+import asyncpg
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError, InvalidRequestError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import db
+from app.model.user import TabUser
+
+
+def _read_session_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    async def route(
+        primary: Annotated[AsyncSession, Depends(db.use_db)], reader: Annotated[AsyncSession, Depends(db.use_read_db)]
+    ):
+        return {"shared": primary is reader, "bind": str(reader.bind.url)}
+
+    return app
+
+
+def test_read_db_shares_primary_session_without_replicas(monkeypatch):
+    monkeypatch.setattr(db.replica_router, "healthy", [])
+    assert TestClient(_read_session_app()).get("/").json()["shared"] is True
+
+
+def test_read_db_uses_replica(monkeypatch):
+    replica = db._create_engine("postgresql+asyncpg://replica:5432/db")
+    monkeypatch.setattr(db.replica_router, "healthy", [replica])
+    body = TestClient(_read_session_app()).get("/").json()
+    assert body == {"shared": False, "bind": str(replica.url)}
+
+
+def test_read_db_is_primary_while_sticky(monkeypatch):
+    replica = db._create_engine("postgresql+asyncpg://replica:5432/db")
+    monkeypatch.setattr(db.replica_router, "healthy", [replica])
+    monkeypatch.setattr(db, "is_read_sticky", lambda: True)
+    assert TestClient(_read_session_app()).get("/").json()["shared"] is True
+
+
+def _update_set(stmt) -> set[str]:
+    sql = str(stmt.compile(dialect=postgresql.asyncpg.dialect()))
+    update = sql.split("DO UPDATE SET ", 1)[1].split(" RETURNING")[0]
+    return {item.split(" = ")[0].strip() for item in update.split(", ")}
+
+
+def test_upsert_updates_all_columns_by_default():
+    stmt = db._build_upsert_stmt(TabUser, frozenset({"username"}), frozenset({"id", "created_time", "updated_time"}))
+    expected = {col.name for col in TabUser.__table__.columns} - {"id", "username", "created_time", "updated_time"}
+    assert _update_set(stmt) == expected
+
+
+def test_upsert_updates_written_columns_only():
+    conflict, ignore = frozenset({"username"}), frozenset({"id", "created_time", "updated_time"})
+    stmt = db._build_upsert_stmt(TabUser, conflict, ignore, frozenset({"username", "age"}))
+    assert _update_set(stmt) == {"age"}
+    # 只写入了冲突列时也要有更新的列, RETURNING 才能返回已存在数据的ID
+    stmt = db._build_upsert_stmt(TabUser, conflict, ignore, frozenset({"username"}))
+    assert _update_set(stmt) == {"username"}
+
+
+def test_merge_keeps_last_row_per_conflict_key():
+    stmt = db._merge_staging_stmt(TabUser, "_stg_user", ["username", "age"], {"username"}, ["id"])
+    sql = str(stmt.compile(dialect=postgresql.asyncpg.dialect()))
+    # 每个冲突键只合并输入行号最大的一行, 冲突键为 NULL 的行各自保留
+    assert "SELECT DISTINCT ON (_stg_user.username, CASE WHEN (_stg_user.username IS NULL) THEN" in sql
+    assert "_stg_user._stg_ordinal END, _stg_user._stg_ordinal DESC ON CONFLICT (username)" in sql
+
+
+def test_stale_staging_tables():
+    now = int(time.time())
+    names = [
+        f"_stg_user_{now - 7200}_0123abcd",
+        f"_stg_user_{now}_0123abcd",
+        f"_stg_user_{now - 7200}_zzz",
+        "_stg_user",
+        "user",
+    ]
+    assert db._stale_staging_tables(names, now - db.STAGING_MAX_AGE) == [names[0]]
+
+
+def test_staging_records_reject_missing_columns():
+    columns = db._staging_columns(TabUser, {"username": "a", "age": 1, "extra": {}})
+    assert db._staging_records(columns, [{"username": "a", "age": 1}], 5) == [["a", 1, 5]]
+    with pytest.raises(InvalidRequestError, match="age"):
+        db._staging_records(columns, [{"username": "a", "age": 1}, {"username": "b"}], 0)
+
+
+@pytest.mark.asyncio
+async def test_copy_upsert_wraps_driver_errors(monkeypatch):
+    rollbacks = []
+
+    class Session:
+        async def rollback(self):
+            rollbacks.append(True)
+
+    async def copy_upsert(*args):
+        raise asyncpg.UniqueViolationError("duplicate key")
+
+    monkeypatch.setattr(db, "_pg_copy_upsert", copy_upsert)
+    with pytest.raises(DBAPIError) as info:
+        await db.pg_upsert(Session(), TabUser, [{"username": "a"}], use_copy=True)
+    assert isinstance(info.value.orig, asyncpg.UniqueViolationError)
+    assert rollbacks == [True]
+
+
+@pytest.mark.asyncio
+async def test_breaker_keeps_recovery_task_until_done(monkeypatch):
+    flushed = asyncio.Event()
+
+    async def flush():
+        flushed.set()
+
+    monkeypatch.setattr(db, "_flush_pending_versions", flush)
+    breaker = db.RedisBreaker(db.async_redis, check_interval=1, failure_threshold=1)
+    breaker.record_failure()
+    assert not breaker.available
+    breaker.record_success()
+    assert breaker.available and len(breaker._tasks) == 1
+    await asyncio.wait_for(flushed.wait(), 1)
+    await asyncio.sleep(0)
+    assert not breaker._tasks
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(os.getenv("ALLOW_TEST_DB_WRITE") != "1", reason="需要可写入的测试库")
+@pytest.mark.parametrize("kwargs", [{}, {"concurrency": 2}, {"use_copy": True}])
+async def test_upsert_duplicate_keys_across_batches(kwargs):
+    prefix = "test_dup_"
+    rows = [{"username": f"{prefix}{i % 3}", "password": "p", "age": i} for i in range(6)]
+    where = TabUser.username.startswith(prefix, autoescape=True)
+    async with db.AsyncSessionLocal() as session:
+        await session.execute(delete(TabUser).where(where))
+        await session.commit()
+        try:
+            ids = await db.pg_upsert(session, TabUser, rows, batch_size=2, **kwargs)
+            ages = dict((await session.execute(select(TabUser.username, TabUser.age).where(where))).all())
+        finally:
+            await session.execute(delete(TabUser).where(where))
+            await session.commit()
+    assert ages == {f"{prefix}0": 3, f"{prefix}1": 4, f"{prefix}2": 5}
+    assert len(ids) == 6 and ids[:3] == ids[3:]
@@ -0,0 +1,91 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 表实体与 schema 转换测试
+"""
+
+from datetime import datetime
+
+import pytest
+
+from app.main import app  # noqa: F401 完成 schema 的构建
+from app.model.user import TabUser
+from app.schema.user import UserSchema, UserSimple
+from app.utils.metas import _cached_schema_converter, compile_schema_converter, schemas_to_dicts, tables_to_schemas
+
+
+def _users() -> list[TabUser]:
+    return [
+        TabUser(
+            id=i,
+            username=f"user_{i}",
+            password="p",
+            nickname=None if i == 1 else f"n{i}",
+            age=i,
+            last_login_time=datetime(2024, 11, 30, 12, 0, i),
+            expired=False,
+            locked=False,
+            created_time=datetime(2024, 1, 1),
+            updated_time=datetime(2024, 1, 1),
+        )
+        for i in range(3)
+    ]
+
+
+@pytest.mark.parametrize("exclude_none", [True, False])
+@pytest.mark.parametrize("schema", [UserSchema, UserSimple])
+def test_trusted_matches_validated(schema, exclude_none):
+    users = _users()
+    trusted = tables_to_schemas(users, schema, exclude_none=exclude_none, trusted=True)
+    validated = tables_to_schemas(users, schema, exclude_none=exclude_none)
+    assert trusted == validated
+    for t, v in zip(trusted, validated, strict=True):
+        assert t.model_fields_set == v.model_fields_set
+        assert t.model_dump_json(by_alias=True) == v.model_dump_json(by_alias=True)
+
+
+def test_trusted_ignores_unknown_extra():
+    (user,) = tables_to_schemas(_users()[:1], UserSimple, trusted=True, extra={"age": 9, "unknown": 1})
+    assert user.age == 9
+    assert "unknown" not in user.model_dump()
+
+
+def test_batch_omits_unset_fields():
+    rows = schemas_to_dicts([UserSchema(id=0, username="z", password="p")], TabUser)
+    assert rows == [{"id": 0, "username": "z", "password": "p"}]
+
+
+def test_batch_keys_are_uniform():
+    schemas = [UserSchema(id=0, username="a", password="p"), UserSchema(id=0, username="b", password="p", age=3)]
+    rows = schemas_to_dicts(schemas, TabUser)
+    assert rows == [
+        {"id": 0, "username": "a", "password": "p", "age": None},
+        {"id": 0, "username": "b", "password": "p", "age": 3},
+    ]
+    assert compile_schema_converter(UserSchema, TabUser).to_columns(schemas) == {
+        "id": [0, 0],
+        "username": ["a", "b"],
+        "password": ["p", "p"],
+        "age": [None, 3],
+    }
+
+
+def test_batch_exclude_none_drops_all_none_columns():
+    schemas = [UserSchema(id=0, username="a", password="p", age=None, nickname=None)] * 2
+    rows = schemas_to_dicts(schemas, TabUser, exclude_none=True)
+    assert rows == [{"id": 0, "username": "a", "password": "p"}] * 2
+    assert "age" in schemas_to_dicts(schemas, TabUser)[0]
+
+
+def test_mapping_converters_are_not_cached():
+    _cached_schema_converter.cache_clear()
+    for i in range(10):
+        rows = schemas_to_dicts(
+            [UserSchema(id=0, username="z", password="p")], TabUser, mapping={"username": lambda v, i=i: f"{v}{i}"}
+        )
+        assert rows[0]["username"] == f"z{i}"
+    schemas_to_dicts([UserSchema(id=0, username="z", password="p")], TabUser)
+    schemas_to_dicts([UserSchema(id=0, username="y", password="p")], TabUser)
+    info = _cached_schema_converter.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
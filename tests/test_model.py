@@ -0,0 +1,35 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-11-30
+__version__ = 0.0.1
+__description__ = 表元数据测试
+"""
+
+from sqlalchemy import String, UniqueConstraint
+from sqlalchemy.orm import mapped_column
+
+from app.model import BaseTable, _unique_constraints, table_meta
+from app.model.user import TabUser
+
+
+class TabMultiUnique(BaseTable):
+    __tablename__ = "test_multi_unique"
+    __table_args__ = (UniqueConstraint("c", "b", name="uq_cb"), UniqueConstraint("d", name="uq_d"))
+
+    a = mapped_column(String(5), unique=True)
+    b = mapped_column(String(5))
+    c = mapped_column(String(5))
+    d = mapped_column(String(5))
+
+
+def test_unique_constraints_follow_column_order():
+    constraints = _unique_constraints(TabMultiUnique.__table__)
+    assert constraints == [frozenset({"a"}), frozenset({"b", "c"}), frozenset({"d"})]
+    assert table_meta(TabMultiUnique).conflict_target == frozenset({"a"})
+
+
+def test_field_to_column_accepts_snake_and_camel():
+    meta = table_meta(TabUser)
+    assert meta.field_to_column["last_login_time"] == "last_login_time"
+    assert meta.field_to_column["lastLoginTime"] == "last_login_time"
+    assert meta.conflict_target == frozenset({"username"})
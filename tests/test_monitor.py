@@ -0,0 +1,141 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = SQL 执行统计测试
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from app import monitor
+from app.db import handle_error  # noqa: F401 注册执行耗时的监听器
+from app.monitor import WAIT_BUCKETS_MS, PlanCapture, PoolStats, QueryStats, fingerprint
+
+
+@pytest.mark.parametrize(
+    ("statement", "expected"),
+    [
+        ("SELECT * FROM t WHERE id = 42", "SELECT * FROM t WHERE id = ?"),
+        ("SELECT * FROM t WHERE name = 'it''s' AND v > -1.5", "SELECT * FROM t WHERE name = ? AND v > ?"),
+        ("SELECT * FROM t WHERE id = $1 AND b = %(b)s", "SELECT * FROM t WHERE id = ? AND b = ?"),
+        ("SELECT * FROM t WHERE id IN ($1, $2,  $3)", "SELECT * FROM t WHERE id IN (?)"),
+        ("INSERT INTO t (a, b) VALUES ($1, $2), ($3, $4)", "INSERT INTO t (a, b) VALUES (?)"),
+        ("SELECT t1.a\n  FROM t1", "SELECT t1.a FROM t1"),
+        ("SELECT * FROM pg_catalog.pg_class", None),
+    ],
+)
+def test_fingerprint(statement, expected):
+    assert fingerprint(statement) == expected
+
+
+def test_query_stats_evicts_least_recent():
+    stats = QueryStats(max_entries=2, sample_size=2)
+    stats.record("a", 1, 1)
+    stats.record("b", 2, 0)
+    stats.record("a", 3, -1)
+    stats.record("c", 4, 0)
+    items = {item["fingerprint"]: item for item in stats.snapshot()}
+    assert set(items) == {"a", "c"}
+    assert items["a"]["calls"] == 2
+    assert items["a"]["total_ms"] == 4
+    assert items["a"]["max_ms"] == 3
+    assert items["a"]["rows"] == 1
+
+
+def test_pool_stats_buckets():
+    stats = PoolStats()
+    for elapsed in (0.5, 1, 1.5, 5000, 5001):
+        stats.record_wait(elapsed)
+    stats.record_timeout()
+    data = stats.to_dict()
+    histogram = data["wait_histogram"]
+    assert len(histogram) == len(WAIT_BUCKETS_MS) + 1
+    assert histogram["<=1ms"] == 2
+    assert histogram["<=5ms"] == 1
+    assert histogram["<=5000ms"] == 1
+    assert histogram[">5000ms"] == 1
+    assert (data["waits"], data["timeouts"]) == (5, 1)
+
+
+def test_failed_statement_clears_start_time():
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        with pytest.raises(exc.OperationalError):
+            conn.execute(text("SELECT * FROM missing"))
+        assert conn.info["query_start_time"] == []
+        conn.execute(text("SELECT 1"))
+        assert conn.info["query_start_time"] == []
+
+
+class _Result:
+    def __init__(self, statement: str):
+        self.statement = statement
+
+    def scalar(self):
+        return [{"Plan": self.statement}]
+
+
+class _Conn:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def exec_driver_sql(self, statement, parameters):
+        return _Result(statement)
+
+
+class _Engine:
+    def __init__(self):
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        return _Conn()
+
+
+async def _settle(capture: PlanCapture):
+    while capture._tasks:
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_plan_capture_rate_limited_per_fingerprint(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(monitor.time, "monotonic", lambda: now)
+    engine, capture = _Engine(), PlanCapture(threshold_ms=10, interval_s=60, buffer_size=10)
+
+    capture.maybe_capture(engine, "fp1", "SELECT 1", None, 20)
+    capture.maybe_capture(engine, "fp1", "SELECT 1", None, 20)
+    # 未超过阈值与不能 EXPLAIN 的语句不采集
+    capture.maybe_capture(engine, "fp2", "SELECT 2", None, 5)
+    capture.maybe_capture(engine, "fp3", "VACUUM t", None, 20)
+    await _settle(capture)
+    assert engine.connects == 1
+
+    now += 59
+    capture.maybe_capture(engine, "fp1", "SELECT 1", None, 20)
+    capture.maybe_capture(engine, "fp2", "SELECT 2", None, 20)
+    await _settle(capture)
+    assert [plan["fingerprint"] for plan in capture.snapshot()] == ["fp2", "fp1"]
+
+    now += 1
+    capture.maybe_capture(engine, "fp1", "SELECT 1", None, 20)
+    await _settle(capture)
+    assert [plan["fingerprint"] for plan in capture.snapshot()] == ["fp1", "fp2", "fp1"]
+
+
+@pytest.mark.asyncio
+async def test_plan_capture_buffer_is_bounded():
+    engine, capture = _Engine(), PlanCapture(threshold_ms=10, interval_s=60, buffer_size=3)
+    for i in range(5):
+        capture.maybe_capture(engine, f"fp{i}", f"SELECT {i}", [{"a": 1}], 20)
+    await _settle(capture)
+    assert engine.connects == 5
+    assert len(capture.plans) == capture.plans.maxlen == 3
+    assert [plan["fingerprint"] for plan in capture.snapshot()] == ["fp4", "fp3", "fp2"]
+    assert capture.snapshot()[0]["plan"] == [{"Plan": "EXPLAIN (FORMAT JSON) SELECT 4"}]
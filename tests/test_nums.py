@@ -0,0 +1,27 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = 数值格式化测试
+"""
+
+from decimal import ROUND_HALF_UP, Decimal
+
+import pytest
+
+from app.utils.nums import format_decimal, format_decimals
+
+
+@pytest.mark.parametrize("digits", [0, 2, 4])
+def test_batch_matches_quantize(digits):
+    values = [Decimal("1.005"), Decimal("-2.5"), "3.14159", "-0.125", 7, 1.25, ""]
+    quantizer = Decimal(1).scaleb(-digits)
+    expected = [Decimal(str(value) or 0).quantize(quantizer, rounding=ROUND_HALF_UP) for value in values]
+    assert format_decimals(values, digits) == expected
+    assert format_decimals(values, digits) == [format_decimal(value, digits) for value in values]
+
+
+def test_batch_keeps_none_and_rejects_invalid():
+    assert format_decimals([None, Decimal("1")]) == [None, Decimal("1.00")]
+    with pytest.raises(ValueError):
+        format_decimals(["1.0", "abc"])
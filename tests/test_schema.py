@@ -0,0 +1,50 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = defer_build 的 schema 构建测试
+"""
+
+import subprocess
+import sys
+import textwrap
+
+# 需要在新的进程中执行: 同一进程中其它测试校验过的 schema 已经编译
+_FRESH_PROCESS = textwrap.dedent(
+    """
+    import asyncio
+    from datetime import datetime
+
+    from app.main import app  # noqa: F401
+    from app.ctx import APIResponse
+    from app.model.user import TabUser
+    from app.schema.settings import SettingsSchema
+    from app.schema.user import UserSchema, UserSimple
+    from app.utils.metas import tables_to_schemas
+    from app.utils.serials import aiter_csv
+
+    assert not UserSimple.__pydantic_complete__
+    user = TabUser(id=1, username="u", password="p", last_login_time=datetime(2024, 12, 2, 8, 0, 0))
+    body = APIResponse.success(tables_to_schemas([user], UserSimple, trusted=True)).body
+    assert b'"lastLoginTime":"2024-12-02 08:00:00"' in body, body
+
+    async def header():
+        return [chunk async for chunk in aiter_csv(_empty(), UserSchema)][0].split(b"\\r\\n")[0]
+
+    async def _empty():
+        return
+        yield
+
+    assert b"lastLoginTime" in asyncio.run(header())
+
+    # 启动时不编译 schema, 跳过校验直接构造时才编译
+    assert not SettingsSchema.__pydantic_complete__
+    body = APIResponse.success([SettingsSchema.model_construct(id=2, value_type="int")]).body
+    assert b'"valueType":"int"' in body, body
+    """
+)
+
+
+def test_unbuilt_schema_serializes_in_fresh_process():
+    result = subprocess.run([sys.executable, "-c", _FRESH_PROCESS], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,106 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = 流式 json 编码测试
+"""
+
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+import ujson
+from pydantic import BaseModel
+
+from app.schema.user import UserSchema
+from app.utils.serials import RawJSON, aiter_csv, aiter_json_chunks, aiter_json_envelope, aiter_ndjson
+
+
+def _rows(count: int) -> list:
+    kinds = [
+        lambda i: UserSchema(
+            id=i, username=f"user_{i}", password="p", nickname="昵称", last_login_time=datetime(2024, 12, 2, 8, 0, i)
+        ),
+        lambda i: {"id": i, "amount": Decimal("1.50"), "time": datetime(2024, 12, 2)},
+        lambda i: RawJSON(b'{"id":%d,"raw":true}' % i),
+    ]
+    return [kinds[i % len(kinds)](i) for i in range(count)]
+
+
+async def _arows(rows: list):
+    for row in rows:
+        yield row
+
+
+async def _join(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+COUNTS = [0, 1, 7]
+CHUNKS = [1, 2, 200]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", COUNTS)
+@pytest.mark.parametrize("chunk_rows", CHUNKS)
+@pytest.mark.parametrize("is_async", [False, True])
+async def test_json_chunks_form_array(count, chunk_rows, is_async):
+    rows = _rows(count)
+    body = await _join(aiter_json_chunks(_arows(rows) if is_async else rows, chunk_rows=chunk_rows))
+    data = ujson.loads(body)
+    assert len(data) == count
+    for got, row in zip(data, rows, strict=True):
+        if isinstance(row, UserSchema):
+            assert got == ujson.loads(row.model_dump_json(by_alias=True))
+        elif isinstance(row, RawJSON):
+            assert got == ujson.loads(row)
+        else:
+            assert got == {"id": row["id"], "amount": 1.5, "time": "2024-12-02 00:00:00"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", COUNTS)
+@pytest.mark.parametrize("chunk_rows", CHUNKS)
+async def test_json_envelope(count, chunk_rows):
+    body = await _join(aiter_json_envelope(_rows(count), msg="成功", chunk_rows=chunk_rows))
+    result = ujson.loads(body)
+    assert (result["code"], result["msg"], len(result["data"])) == (0, "成功", count)
+    assert [row["id"] for row in result["data"]] == list(range(count))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", COUNTS)
+@pytest.mark.parametrize("chunk_rows", CHUNKS)
+async def test_ndjson_lines(count, chunk_rows):
+    body = await _join(aiter_ndjson(_arows(_rows(count)), chunk_rows=chunk_rows))
+    if not count:
+        assert body == b""
+        return
+    assert body.endswith(b"\n")
+    lines = body.decode("utf-8").split("\n")[:-1]
+    assert [ujson.loads(line)["id"] for line in lines] == list(range(count))
+
+
+class _Amount(BaseModel):
+    name: str
+    amount: Decimal | None
+    time: datetime | None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_rows", [1, 2, 200])
+async def test_csv_formats_dates_and_decimals(chunk_rows):
+    rows = [
+        _Amount(name="a", amount=Decimal("1.005"), time=datetime(2024, 12, 2, 8, 0, 1, 500)),
+        _Amount(name="b", amount=None, time=None),
+        _Amount(name="c", amount=Decimal("-2"), time=datetime(2024, 12, 3)),
+    ]
+    body = await _join(aiter_csv(_arows(rows), _Amount, chunk_rows=chunk_rows))
+    assert list(csv.reader(io.StringIO(body.decode("utf-8")))) == [
+        ["name", "amount", "time"],
+        ["a", "1.01", "2024-12-02 08:00:01"],
+        ["b", "", ""],
+        ["c", "-2.00", "2024-12-03 00:00:00"],
+    ]
@@ -0,0 +1,46 @@
+"""
+__author__ = <huyaro> huyaro.dev@outlook.com
+__date__ = 2024-12-02
+__version__ = 0.0.1
+__description__ = 日期格式化测试
+"""
+
+from datetime import UTC, date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import arrow
+import pytest
+
+from app.utils.times import _FAST_FORMATTERS, FMT_DATE, dt_to_str, dts_to_str
+
+VALUES = [
+    datetime(2024, 1, 2, 3, 4, 5),
+    datetime(999, 12, 31, 23, 59, 59, 999_999),
+    datetime(2024, 11, 30, 12, 0, 0, tzinfo=UTC),
+    datetime(2024, 11, 30, 23, 30, 1, tzinfo=timezone(timedelta(hours=8))),
+    datetime(2024, 3, 10, 2, 30, 0, tzinfo=ZoneInfo("America/New_York")),
+]
+
+
+@pytest.mark.parametrize("pat", list(_FAST_FORMATTERS))
+@pytest.mark.parametrize("value", VALUES, ids=str)
+def test_fast_path_matches_arrow(pat, value):
+    assert dt_to_str(value, pat) == arrow.get(value).format(pat)
+
+
+def test_date_uses_fast_path_only_for_date_pattern():
+    value = date(2024, 2, 29)
+    assert dt_to_str(value, FMT_DATE) == arrow.get(value).format(FMT_DATE) == "2024-02-29"
+    assert dt_to_str(value) == arrow.get(value).format("YYYY-MM-DD HH:mm:ss")
+
+
+def test_other_patterns_use_arrow():
+    value = datetime(2024, 1, 2, 3, 4, 5)
+    assert dt_to_str(value, "YYYY/MM/DD A") == "2024/01/02 AM"
+
+
+@pytest.mark.parametrize("pat", [*_FAST_FORMATTERS, "YYYY/MM/DD A"])
+def test_batch_matches_arrow(pat):
+    values = [*VALUES, None, date(2024, 2, 29)]
+    expected = [None if value is None else arrow.get(value).format(pat) for value in values]
+    assert dts_to_str(values, pat) == expected